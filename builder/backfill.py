@@ -0,0 +1,237 @@
+"""
+Backfill - загрузка полной истории свечей Coinglass в локальное хранилище
+"""
+from src.data.async_coinglass_client import AsyncCoinglassClient
+from src.data.candle_store import CandleStore
+from src.data.coinglass_client import (
+    CANDLES_LIMIT,
+    INTERVAL_SECONDS,
+    CoinglassClient,
+    UpstreamError,
+    normalize_symbol,
+)
+from config import config
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import sys
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Set, Tuple
+
+# Добавляем путь к common модулям
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+STORE_DIR = pathlib.Path("/app/data/candles")
+DEFAULT_START = "2017-05-01"  # первая дата CBMA
+DEFAULT_INTERVALS = ["1d", "4h"]
+
+
+class Checkpoint:
+    """Список уже загруженных окон, переживающий перезапуск"""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.completed: Dict[str, Set[int]] = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.completed = {
+                key: set(starts) for key, starts in data.get("completed", {}).items()
+            }
+
+    @staticmethod
+    def key(symbol: str, interval: str) -> str:
+        return f"{symbol}:{interval}"
+
+    def is_done(self, symbol: str, interval: str, start: int) -> bool:
+        return start in self.completed.get(self.key(symbol, interval), ())
+
+    def mark_done(self, symbol: str, interval: str, start: int):
+        self.completed.setdefault(self.key(symbol, interval), set()).add(start)
+
+    def save(self):
+        """Атомарно сохранить прогресс"""
+        payload = {
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "completed": {
+                key: sorted(starts) for key, starts in sorted(self.completed.items())
+            },
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, self.path)
+
+
+def split_windows(start: int, end: int, interval: str) -> List[Tuple[int, int]]:
+    """Разбить [start, end) на окна по CANDLES_LIMIT свечей"""
+    span = INTERVAL_SECONDS[interval] * CANDLES_LIMIT
+    windows = []
+    window_start = start
+    while window_start < end:
+        windows.append((window_start, min(window_start + span, end) - 1))
+        window_start += span
+    return windows
+
+
+async def backfill(
+    client: AsyncCoinglassClient,
+    store: CandleStore,
+    checkpoint: Checkpoint,
+    symbols: List[str],
+    intervals: List[str],
+    start: int,
+    end: int,
+) -> Dict[str, int]:
+    """Загрузить все недостающие окна и записать их в хранилище"""
+    stats = {"windows": 0, "skipped": 0, "loaded": 0, "empty": 0, "failed": 0}
+
+    jobs = []
+    for symbol in symbols:
+        for interval in intervals:
+            for window_start, window_end in split_windows(start, end, interval):
+                stats["windows"] += 1
+                if checkpoint.is_done(symbol, interval, window_start):
+                    stats["skipped"] += 1
+                    continue
+                jobs.append((symbol, interval, window_start, window_end))
+
+    logger.info(
+        f"Окон всего: {stats['windows']}, уже загружено: {stats['skipped']}, "
+        f"к загрузке: {len(jobs)}"
+    )
+
+    async def run(job):
+        symbol, interval, window_start, window_end = job
+        try:
+            candles = await client.fetch_candles(
+                symbol, interval, window_start, window_end
+            )
+            return job, candles, None
+        except UpstreamError as e:
+            return job, None, e
+
+    # Параллельность ограничена семафором клиента и общим rate limiter
+    for future in asyncio.as_completed([run(job) for job in jobs]):
+        (symbol, interval, window_start, window_end), candles, error = await future
+
+        if error is not None:
+            stats["failed"] += 1
+            logger.warning(f"{symbol} {interval} @ {window_start}: {error}")
+            continue
+
+        if candles:
+            store.merge(symbol, interval, candles)
+            stats["loaded"] += 1
+        else:
+            stats["empty"] += 1
+
+        # Последнее окно еще пополняется - его перезагружаем при каждом запуске
+        if window_end < end - INTERVAL_SECONDS[interval]:
+            checkpoint.mark_done(symbol, interval, window_start)
+            checkpoint.save()
+
+    return stats
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Загрузка истории свечей Coinglass")
+    parser.add_argument(
+        "--symbols",
+        nargs="+",
+        help="Символы (по умолчанию - все доступные символы Coinglass)",
+    )
+    parser.add_argument(
+        "--intervals",
+        nargs="+",
+        default=DEFAULT_INTERVALS,
+        choices=sorted(INTERVAL_SECONDS),
+    )
+    parser.add_argument("--start", default=DEFAULT_START, help="Дата начала YYYY-MM-DD")
+    parser.add_argument("--end", help="Дата окончания YYYY-MM-DD (по умолчанию - сейчас)")
+    parser.add_argument("--workers", type=int, default=4, help="Параллельных запросов")
+    parser.add_argument("--store", type=pathlib.Path, default=STORE_DIR)
+    parser.add_argument(
+        "--checkpoint",
+        type=pathlib.Path,
+        help="Файл прогресса (по умолчанию {store}/backfill_checkpoint.json)",
+    )
+    parser.add_argument(
+        "--reset", action="store_true", help="Игнорировать сохраненный прогресс"
+    )
+    return parser.parse_args(argv)
+
+
+def to_timestamp(date_str: str) -> int:
+    """YYYY-MM-DD -> секунды UTC"""
+    date = datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return int(date.timestamp())
+
+
+def main(argv=None):
+    """Загружает историю свечей с возобновлением после прерывания"""
+    args = parse_args(argv)
+
+    if not config.coinglass_api_key:
+        logger.error("COINGLASS_API_KEY не задан")
+        return 1
+
+    start = to_timestamp(args.start)
+    end = to_timestamp(args.end) if args.end else int(time.time())
+
+    sync_client = CoinglassClient(config.coinglass_api_key)
+    symbols = args.symbols or [
+        s["symbol"] for s in sync_client.get_available_symbols()
+    ]
+    symbols = [normalize_symbol(symbol) for symbol in symbols]
+
+    store = CandleStore(args.store)
+    checkpoint_path = args.checkpoint or args.store / "backfill_checkpoint.json"
+    checkpoint = Checkpoint(checkpoint_path)
+    if args.reset:
+        checkpoint.completed = {}
+
+    logger.info(
+        f"Backfill {len(symbols)} символов x {args.intervals} "
+        f"с {args.start}, параллельно {args.workers}"
+    )
+
+    async def run():
+        client = AsyncCoinglassClient(client=sync_client, max_concurrency=args.workers)
+        try:
+            return await backfill(
+                client, store, checkpoint, symbols, args.intervals, start, end
+            )
+        finally:
+            await client.close()
+
+    started = time.monotonic()
+    try:
+        stats = asyncio.run(run())
+    except KeyboardInterrupt:
+        logger.warning("Прервано, прогресс сохранен в " + str(checkpoint_path))
+        return 130
+
+    logger.info(
+        f"✅ Backfill завершен за {time.monotonic() - started:.1f}s: "
+        f"загружено {stats['loaded']}, пустых {stats['empty']}, "
+        f"пропущено {stats['skipped']}, ошибок {stats['failed']}"
+    )
+    return 0 if stats["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,12 +1,34 @@
 """
 CBMA Builder - построение индекса с использованием универсальных модулей
 """
+from src.data.artifacts import (
+    content_version,
+    dump_json_bytes,
+    publish_artifact,
+    read_manifest,
+    update_manifest,
+)
 from src.data.cbma_calculator import CBMACalculator
+from src.data.cbma_matrix import MATRIX_DIR, Variant, compute_variant, matrix_variants
+from src.data.candles import from_columns
+from src.data.market_store import MarketStore, build_market_store
+from src.data.static_assets import publish_static_assets
+from src.data.tiles import TILES_DIR, TILES_INDEX, publish_tiles
+from config import config
+import argparse
+import hashlib
 import json
+import os
 import pathlib
+import signal
 import sys
 import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime
+from typing import Dict, List, Optional
 
 # Добавляем путь к common модулям
 sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
@@ -21,71 +43,462 @@ logger = logging.getLogger(__name__)
 
 SRC = pathlib.Path("/app/data/data.json")
 DST = pathlib.Path("/app/data/CBMA.json")
+STATE_FILE = DST.parent / ".build_state.json"
+MATRIX_PATH = DST.parent / MATRIX_DIR
+MARKET_PATH = DST.parent / "market"
+TILES_PATH = DST.parent / TILES_DIR
+# Статика графика: хэшированные и предсжатые копии для nginx
+CHART_PATH = pathlib.Path(__file__).parent.parent / "src" / "chart"
+STATIC_PATH = DST.parent / "static"
 DEFAULT_MA_PERIOD = 14
 
 
-def main():
-    """Строит CBMA индекс используя универсальные модули"""
-    try:
-        logger.info(f"Строим CBMA индекс из {SRC}")
+@dataclass
+class BuildState:
+    """Состояние между сборками: отпечаток входа и результат прошлой сборки"""
 
-        # Проверяем существование исходного файла
-        if not SRC.exists():
-            logger.error(f"Исходный файл не найден: {SRC}")
-            return 1
+    input_mtime_ns: int = 0
+    input_size: int = 0
+    input_hash: str = ""
+    last_full_build: float = 0.0
+    # Точки и CBMA прошлой сборки (только в памяти демона)
+    items: Optional[List[Dict]] = None
+    result: Optional[List[Dict]] = None
+    counters: Dict[str, int] = field(
+        default_factory=lambda: {"full": 0, "incremental": 0, "skipped": 0, "failed": 0}
+    )
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "BuildState":
+        """Загрузить отпечаток входа прошлой сборки (если есть)"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(
+                input_mtime_ns=data.get("input_mtime_ns", 0),
+                input_size=data.get("input_size", 0),
+                input_hash=data.get("input_hash", ""),
+            )
+        except (OSError, ValueError):
+            return cls()
+
+    def save(self, path: pathlib.Path):
+        """Сохранить отпечаток входа, чтобы перезапуск не пересобирал индекс"""
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "input_mtime_ns": self.input_mtime_ns,
+                    "input_size": self.input_size,
+                    "input_hash": self.input_hash,
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
+
+
+def file_digest(path: pathlib.Path) -> str:
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_append_only(previous: List[Dict], current: List[Dict]) -> bool:
+    """Новые точки только добавлены в конец, старые не изменились"""
+    if not previous or len(current) < len(previous):
+        return False
+    return all(
+        old["timestamp"] == new["timestamp"] and old["value"] == new["value"]
+        for old, new in zip(previous, current)
+    )
+
+
+def write_index(processed_data: List[Dict]):
+    """Записать CBMA.json в формате UDF"""
+    # Формируем данные в формате UDF
+    times = []
+    values = []
+
+    for item in processed_data:
+        times.append(item['timestamp'])
+        values.append(item['cbma'])
+
+    # UDF формат для history endpoint
+    payload = {
+        "s": "ok",
+        "t": times,
+        "o": values,  # open
+        "h": values,  # high
+        "l": values,  # low
+        "c": values,  # close
+        "v": [0] * len(values)  # volume (для индекса = 0)
+    }
+
+    # Сохраняем результат атомарно, компактно и со сжатыми копиями (.gz/.br)
+    entry = publish_artifact(DST, dump_json_bytes(payload))
+    update_manifest(DST.parent, {DST.name: entry})
+
+    logger.info(
+        f"Индекс CBMA сохранен в {DST} (версия {entry['version']}, "
+        f"{entry['size']} байт, gzip {entry['gzip_size']} байт)"
+    )
+
+
+# Входной ряд в процессах пула: передается один раз при старте процесса,
+# а не с каждой задачей
+_worker_series = None
+
+
+def _init_worker(times: List[int], values: List[float]):
+    global _worker_series
+    _worker_series = (times, values)
+
+
+def _compute_in_worker(variant: Variant) -> Dict:
+    times, values = _worker_series
+    return compute_variant(times, values, variant)
+
+
+def build_matrix(items: List[Dict], variants: List[Variant], workers: int = 0) -> Dict:
+    """
+    Рассчитать все варианты матрицы из одного разобранного входа
+
+    Варианты независимы, поэтому считаются в пуле процессов.
+    """
+    times = [item["timestamp"] for item in items]
+    values = [item["value"] for item in items]
+
+    workers = min(workers or os.cpu_count() or 1, len(variants))
+    if workers <= 1:
+        return {variant: compute_variant(times, values, variant) for variant in variants}
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(times, values)
+    ) as pool:
+        return dict(zip(variants, pool.map(_compute_in_worker, variants)))
+
+
+def matrix_missing(variants: List[Variant]) -> bool:
+    """Каких-то артефактов матрицы нет на диске (например, после обновления)"""
+    return any(not (MATRIX_PATH / variant.file_name).exists() for variant in variants)
+
+
+def write_matrix(payloads: Dict) -> int:
+    """
+    Опубликовать варианты матрицы в data/cbma/ и обновить ее манифест
+
+    Неизменившиеся варианты (та же версия содержимого) не перезаписываются.
+
+    Returns:
+        Количество перезаписанных артефактов
+    """
+    manifest = read_manifest(MATRIX_PATH)
+    published = manifest.get("artifacts", {})
+    entries = {}
+    written = 0
+
+    for variant, payload in payloads.items():
+        data = dump_json_bytes(payload)
+        previous = published.get(variant.file_name)
+        path = MATRIX_PATH / variant.file_name
+        if previous and previous.get("version") == content_version(data) and path.exists():
+            continue
+        entry = publish_artifact(path, data)
+        entry.update(variant.to_dict())
+        entry["points"] = len(payload.get("t", []))
+        entries[variant.file_name] = entry
+        written += 1
+
+    if entries:
+        update_manifest(MATRIX_PATH, entries, manifest)
+    return written
+
+
+def log_statistics(processed_data: List[Dict]):
+    """Показать статистику по построенному индексу"""
+    cbma_values = [item['cbma'] for item in processed_data]
+    logger.info("Статистика CBMA:")
+    logger.info(f"  Всего точек: {len(processed_data)}")
+    logger.info(
+        f"  Период: {processed_data[0]['date']} - {processed_data[-1]['date']}")
+    logger.info(
+        f"  Диапазон CBMA: {min(cbma_values):.2f} - {max(cbma_values):.2f}")
+    logger.info(f"  Последнее значение: {cbma_values[-1]:.2f}")
+
+
+def build(
+    calculator: CBMACalculator,
+    state: BuildState,
+    force: bool = False,
+    full_rebuild_interval: Optional[int] = None,
+    variants: Optional[List[Variant]] = None,
+    workers: int = 0,
+) -> str:
+    """
+    Собрать индекс, если входные данные изменились
+
+    Returns:
+        "skipped", "incremental", "full" или "failed"
+    """
+    if not SRC.exists():
+        logger.error(f"Исходный файл не найден: {SRC}")
+        return "failed"
+
+    stat = SRC.stat()
+    due_full = (
+        full_rebuild_interval is not None
+        and time.time() - state.last_full_build >= full_rebuild_interval
+    )
+    variants = variants or []
+    output_ok = DST.exists() and not force and not matrix_missing(variants)
+
+    # Быстрая проверка по mtime и размеру, затем по содержимому
+    if output_ok and (stat.st_mtime_ns, stat.st_size) == (
+        state.input_mtime_ns,
+        state.input_size,
+    ):
+        return "skipped"
+
+    digest = file_digest(SRC)
+    if output_ok and digest == state.input_hash:
+        state.input_mtime_ns, state.input_size = stat.st_mtime_ns, stat.st_size
+        return "skipped"
 
-        # Создаем калькулятор CBMA
-        calculator = CBMACalculator(SRC)
+    logger.info(f"Строим CBMA индекс из {SRC}")
+    raw_data = calculator.load_raw_data()
+    items = calculator.parse_items(raw_data, use_finance=False)
 
-        # Обрабатываем данные с использованием универсальных модулей
+    incremental = not force and not due_full and state.result
+    if incremental and is_append_only(state.items, items):
+        logger.info(f"Добавлено {len(items) - len(state.items)} новых точек")
+        processed_data = calculator.extend_cbma(
+            items, state.result, len(state.items), ma_period=DEFAULT_MA_PERIOD
+        )
+        mode = "incremental"
+    else:
         logger.info(f"Обрабатываем данные с MA{DEFAULT_MA_PERIOD}...")
-        processed_data = calculator.process_data(
-            use_finance=False, ma_period=DEFAULT_MA_PERIOD)
+        processed_data = calculator.build_cbma(items, ma_period=DEFAULT_MA_PERIOD)
+        mode = "full"
 
-        if not processed_data:
-            logger.error("Не удалось обработать данные")
-            return 1
+    if not processed_data:
+        logger.error("Не удалось обработать данные")
+        return "failed"
 
-        logger.info(f"Обработано {len(processed_data)} точек данных")
-
-        # Формируем данные в формате UDF
-        times = []
-        values = []
-
-        for item in processed_data:
-            times.append(item['timestamp'])
-            values.append(item['cbma'])
-
-        # UDF формат для history endpoint
-        payload = {
-            "s": "ok",
-            "t": times,
-            "o": values,  # open
-            "h": values,  # high
-            "l": values,  # low
-            "c": values,  # close
-            "v": [0] * len(values)  # volume (для индекса = 0)
-        }
-
-        # Сохраняем результат
-        DST.parent.mkdir(parents=True, exist_ok=True)
-        with open(DST, 'w', encoding='utf-8') as f:
-            json.dump(payload, f, indent=2, ensure_ascii=False)
-
-        logger.info(f"Индекс CBMA сохранен в {DST}")
-
-        # Показываем статистику
-        stats = calculator.get_statistics()
-        logger.info("Статистика CBMA:")
-        logger.info(f"  Всего точек: {stats['total_points']}")
-        logger.info(
-            f"  Период: {stats['date_range']['from']} - {stats['date_range']['to']}")
+    logger.info(f"Обработано {len(processed_data)} точек данных")
+    write_index(processed_data)
+    log_statistics(processed_data)
+
+    if variants:
+        started = time.monotonic()
+        written = write_matrix(build_matrix(items, variants, workers))
         logger.info(
-            f"  Диапазон CBMA: {stats['cbma']['min']:.2f} - "
-            f"{stats['cbma']['max']:.2f}")
-        logger.info(f"  Последнее значение: {stats['cbma']['latest']:.2f}")
+            f"Матрица CBMA: {len(variants)} вариантов за "
+            f"{time.monotonic() - started:.3f}s, обновлено {written} в {MATRIX_PATH}"
+        )
+
+    state.input_mtime_ns, state.input_size = stat.st_mtime_ns, stat.st_size
+    state.input_hash = digest
+    state.items, state.result = items, processed_data
+    if mode == "full":
+        state.last_full_build = time.time()
+    state.save(STATE_FILE)
+
+    return mode
+
+
+def build_market(force: bool = False) -> bool:
+    """Собрать хранилище рыночных данных из CSV папок, если они изменились"""
+    try:
+        return build_market_store(SRC.parent, MARKET_PATH, force=force) is not None
+    except Exception as e:
+        logger.error(f"Ошибка при сборке хранилища рыночных данных: {e}")
+        return False
+
+
+def build_tiles(variants: List[Variant]):
+    """Нарезать на годовые тайлы рыночные серии и варианты CBMA"""
+    series = []
+
+    market = MarketStore(MARKET_PATH, check_interval=0)
+    for symbol in market.symbols():
+        for resolution in market.resolutions(symbol):
+            series.append((symbol, resolution, market.get(symbol, resolution)))
+
+    for variant in variants:
+        try:
+            with open(MATRIX_PATH / variant.file_name, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if payload.get("s") == "ok":
+            candles = from_columns(*(payload[key] for key in ("t", "o", "h", "l", "c", "v")))
+            # CBMA_ma14_D_smooth -> CBMA / ma14_D_smooth
+            series.append(("CBMA", variant.name[len("CBMA_"):], candles))
+
+    publish_tiles(TILES_PATH, series)
+
+
+def build_stages(
+    calculator: CBMACalculator,
+    state: BuildState,
+    force: bool = False,
+    full_rebuild_interval: Optional[int] = None,
+    variants: Optional[List[Variant]] = None,
+    workers: int = 0,
+) -> str:
+    """Индекс CBMA, хранилище рыночных данных и тайлы истории"""
+    mode = build(calculator, state, force, full_rebuild_interval, variants, workers)
+    market_changed = build_market(force=force)
+
+    tiles_missing = not (TILES_PATH / TILES_INDEX).exists()
+    if mode in ("full", "incremental") or market_changed or tiles_missing:
+        try:
+            build_tiles(variants or [])
+        except Exception as e:
+            logger.error(f"Ошибка при нарезке тайлов истории: {e}")
+
+    return mode
+
+
+def configured_variants() -> List[Variant]:
+    """Матрица вариантов из конфигурации builder"""
+    return matrix_variants(
+        config.builder.ma_periods, config.builder.smoothing, config.builder.resolutions
+    )
+
+
+def publish_static():
+    """Опубликовать статику графика в data/static (nginx отдает ее без сжатия на лету)"""
+    if not CHART_PATH.is_dir():
+        logger.info(f"Каталог {CHART_PATH} не найден, статика не публикуется")
+        return
+    try:
+        publish_static_assets(CHART_PATH, STATIC_PATH)
+    except Exception as e:
+        logger.warning(f"Не удалось опубликовать статику: {e}")
+
+
+def run_daemon(check_interval: int, full_rebuild_interval: int, workers: int = 0) -> int:
+    """Долгоживущий режим: проверять входные данные по расписанию"""
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"Получен сигнал {signum}, завершаем работу")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    calculator = CBMACalculator(SRC)
+    state = BuildState.load(STATE_FILE)
+    # После перезапуска результат прошлой сборки не в памяти, поэтому первая
+    # сборка при изменениях будет полной; без изменений - пропуск
+    state.last_full_build = time.time()
+    variants = configured_variants()
+
+    logger.info(
+        f"Builder запущен: проверка каждые {check_interval}s, "
+        f"полная пересборка не реже чем раз в {full_rebuild_interval}s"
+    )
+
+    next_run = time.monotonic()
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            mode = build_stages(
+                calculator,
+                state,
+                full_rebuild_interval=full_rebuild_interval,
+                variants=variants,
+                workers=workers,
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при построении индекса: {e}")
+            mode = "failed"
+        duration = time.monotonic() - started
+        state.counters[mode] += 1
+
+        counters = state.counters
+        message = (
+            f"Сборка: {mode} за {duration:.3f}s "
+            f"(полных {counters['full']}, инкрементальных {counters['incremental']}, "
+            f"пропущено {counters['skipped']}, ошибок {counters['failed']})"
+        )
+        if mode == "skipped":
+            logger.debug(message)
+        else:
+            logger.info(message)
+
+        # Расписание без накопления дрейфа
+        next_run += check_interval
+        stop.wait(max(0.0, next_run - time.monotonic()))
+
+    return 0
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Построение CBMA индекса")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Работать постоянно и пересобирать индекс при изменении data.json",
+    )
+    parser.add_argument(
+        "--check-interval",
+        type=int,
+        default=config.builder.check_interval,
+        help="Как часто проверять входные данные в режиме демона, секунды",
+    )
+    parser.add_argument(
+        "--full-rebuild-interval",
+        type=int,
+        default=config.builder.update_interval,
+        help="При изменении входа делать полную (а не инкрементальную) "
+        "пересборку, если последняя была больше N секунд назад",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config.builder.workers,
+        help="Процессов для расчета матрицы вариантов (0 - по числу CPU)",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Собрать даже без изменений входа"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Строит CBMA индекс используя универсальные модули"""
+    args = parse_args(argv)
+    publish_static()
+
+    if args.daemon:
+        return run_daemon(args.check_interval, args.full_rebuild_interval, args.workers)
+
+    try:
+        started = time.monotonic()
+        state = BuildState.load(STATE_FILE)
+        mode = build_stages(
+            CBMACalculator(SRC),
+            state,
+            force=args.force,
+            variants=configured_variants(),
+            workers=args.workers,
+        )
+        if mode == "failed":
+            return 1
 
-        logger.info(f"✅ Индекс успешно построен в {datetime.now()}")
+        if mode == "skipped":
+            logger.info("Входные данные не изменились, сборка пропущена")
+        else:
+            logger.info(
+                f"✅ Индекс успешно построен в {datetime.now()} "
+                f"за {time.monotonic() - started:.3f}s"
+            )
         return 0
 
     except Exception as e:
@@ -29,6 +29,8 @@ class APIConfig:
     debug: bool = False
     cors_enabled: bool = True
     cors_origins: Optional[list] = None
+    # С этого числа баров ответ history отдается потоком (0 - всегда целиком)
+    history_stream_rows: int = 20000
 
     def __post_init__(self):
         if self.cors_origins is None:
@@ -38,10 +40,119 @@ class APIConfig:
 @dataclass
 class BuilderConfig:
     """Builder configuration"""
-    update_interval: int = 3600  # 1 час
+    update_interval: int = 3600  # 1 час (интервал полной, а не инкрементальной сборки)
+    check_interval: int = 60  # как часто проверять изменения входных данных
     ma_period: int = 14
     data_input_file: str = "data/data.json"
     data_output_file: str = "data/CBMA.json"
+    # Матрица артефактов: периоды MA x сглаживание x разрешения
+    ma_periods: Optional[list] = None
+    smoothing: Optional[list] = None
+    resolutions: Optional[list] = None
+    workers: int = 0  # процессов для расчета матрицы (0 - по числу CPU)
+
+    def __post_init__(self):
+        if self.ma_periods is None:
+            self.ma_periods = [7, 14, 30]
+        if self.smoothing is None:
+            self.smoothing = [False, True]
+        if self.resolutions is None:
+            self.resolutions = ["D", "W", "M"]
+
+
+@dataclass
+class CoinglassCacheConfig:
+    """Coinglass cache configuration"""
+    enabled: bool = True
+    stale_ttl: int = 3600  # сколько отдавать устаревшие свечи, пока идет обновление
+    max_entries: int = 256
+
+
+@dataclass
+class SharedCacheConfig:
+    """Shared cache backend configuration"""
+    # memory://, sqlite:///path/cache.db, redis://host:6379/0; пусто - выключен
+    url: str = ""
+    max_entries: int = 4096
+
+
+@dataclass
+class BackgroundConfig:
+    """Background jobs configuration (one leader worker runs upstream refreshes)"""
+    enabled: bool = True
+    lock_file: str = "logs/udf-leader.lock"
+    tick: int = 5  # как часто воркеры проверяют лидерство и сроки задач
+    refresh_interval: int = 300  # обновление свечей Coinglass ведущим воркером
+    refresh_symbols: Optional[list] = None
+    refresh_intervals: Optional[list] = None
+    dataset_check_interval: int = 30  # проверка изменений data.json (в каждом воркере)
+
+    def __post_init__(self):
+        if self.refresh_symbols is None:
+            self.refresh_symbols = ["BTCUSDT", "ETHUSDT"]
+        if self.refresh_intervals is None:
+            self.refresh_intervals = ["4h", "1d"]
+
+
+@dataclass
+class MetricsConfig:
+    """Prometheus /metrics configuration"""
+    enabled: bool = True
+    # Снимки воркеров для общего /metrics (пусто - только свой процесс)
+    dir: str = "logs/metrics"
+    publish_interval: int = 5
+
+
+@dataclass
+class TracingConfig:
+    """Stage-level request tracing"""
+    # Разбивка по этапам в заголовке Server-Timing
+    enabled: bool = True
+    # Файл трасс (JSON строки) для разбора потом; пусто - не писать
+    file: str = ""
+    sample_rate: float = 1.0
+    file_max_mb: int = 50
+
+
+@dataclass
+class ProfilingConfig:
+    """On-demand profiling of UDF workers"""
+    # Токен администратора (заголовок X-Profile-Token); пусто - выключено
+    token: str = ""
+    dir: str = "logs/profiles"
+    # Не чаще одного профиля каждого вида за интервал (на воркер)
+    min_interval: int = 60
+    # Периодические окна сэмплирования (0 - только по запросу)
+    sample_every: int = 0
+    sample_seconds: int = 10
+    sample_hz: int = 100
+    max_seconds: int = 30
+    max_files: int = 50
+
+
+@dataclass
+class AdmissionConfig:
+    """Admission control for expensive endpoints"""
+    enabled: bool = True
+    # Емкость в единицах стоимости (узкий запрос = 1) и длина очереди
+    history_capacity: int = 4
+    history_queue: int = 2
+    ohlcv_capacity: int = 2
+    ohlcv_queue: int = 1
+    queue_timeout: float = 2.0
+    bars_per_unit: int = 5000  # сколько баров в ответе стоит одна единица
+    # Потоков gunicorn, которые не отдаются дорогим эндпоинтам (для /health)
+    reserved_threads: int = 2
+    max_ohlcv_days: int = 365
+
+
+@dataclass
+class UpstreamConfig:
+    """Upstream (Coinglass) resilience configuration"""
+    timeout: int = 30  # таймаут чтения ответа, секунды
+    failure_threshold: int = 3  # ошибок подряд до размыкания цепи
+    reset_timeout: int = 30  # через сколько секунд пробовать снова
+    negative_ttl: int = 60  # сколько помнить ответ "нет данных"
 
 
 @dataclass
@@ -50,6 +161,12 @@ class LoggingConfig:
     level: str = "INFO"
     format: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     log_dir: str = "logs"
+    # Вывод логов в отдельном потоке (очередь ограничена, при переполнении записи теряются)
+    queue: bool = True
+    queue_size: int = 10000
+    # Не больше sample_burst одинаковых сообщений за sample_window секунд (0 - без ограничения)
+    sample_burst: int = 5
+    sample_window: float = 10.0
 
 
 class Config:
@@ -66,21 +183,39 @@ class Config:
             port=int(os.getenv('UDF_PORT', 8000)),
             debug=os.getenv('UDF_DEBUG', 'false').lower() == 'true',
             cors_enabled=True,
-            cors_origins=["*"]
+            cors_origins=["*"],
+            history_stream_rows=int(os.getenv('HISTORY_STREAM_MIN_ROWS', 20000))
         )
 
         # Builder Configuration
         self.builder = BuilderConfig(
             update_interval=int(os.getenv('BUILDER_UPDATE_INTERVAL', 3600)),
+            check_interval=int(os.getenv('BUILDER_CHECK_INTERVAL', 60)),
             ma_period=int(os.getenv('BUILDER_MA_PERIOD', 14)),
             data_input_file=os.getenv('DATA_INPUT_FILE', 'data/data.json'),
-            data_output_file=os.getenv('DATA_OUTPUT_FILE', 'data/CBMA.json')
+            data_output_file=os.getenv('DATA_OUTPUT_FILE', 'data/CBMA.json'),
+            ma_periods=[
+                int(p) for p in os.getenv('BUILDER_MA_PERIODS', '7,14,30').split(',')
+            ],
+            smoothing=[
+                s.strip().lower() in ('on', 'true', '1')
+                for s in os.getenv('BUILDER_SMOOTHING', 'off,on').split(',')
+            ],
+            resolutions=[
+                r.strip().upper()
+                for r in os.getenv('BUILDER_RESOLUTIONS', 'D,W,M').split(',')
+            ],
+            workers=int(os.getenv('BUILDER_WORKERS', 0))
         )
 
         # Logging Configuration
         self.logging = LoggingConfig(
             level=os.getenv('LOG_LEVEL', 'INFO'),
-            log_dir=os.getenv('LOG_DIR', 'logs')
+            log_dir=os.getenv('LOG_DIR', 'logs'),
+            queue=os.getenv('LOG_QUEUE_ENABLED', 'true').lower() == 'true',
+            queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+            sample_burst=int(os.getenv('LOG_SAMPLE_BURST', 5)),
+            sample_window=float(os.getenv('LOG_SAMPLE_WINDOW', 10))
         )
 
         # External APIs
@@ -89,6 +224,79 @@ class Config:
             'COINGLASS_BASE_URL',
             'https://open-api-v4.coinglass.com')
 
+        self.coinglass_cache = CoinglassCacheConfig(
+            enabled=os.getenv('COINGLASS_CACHE_ENABLED', 'true').lower() == 'true',
+            stale_ttl=int(os.getenv('COINGLASS_STALE_TTL', 3600)),
+            max_entries=int(os.getenv('COINGLASS_CACHE_MAX_ENTRIES', 256))
+        )
+
+        self.shared_cache = SharedCacheConfig(
+            url=os.getenv('CACHE_BACKEND_URL', ''),
+            max_entries=int(os.getenv('CACHE_BACKEND_MAX_ENTRIES', 4096))
+        )
+
+        self.background = BackgroundConfig(
+            enabled=os.getenv('BACKGROUND_JOBS_ENABLED', 'true').lower() == 'true',
+            lock_file=os.getenv('BACKGROUND_LOCK_FILE', 'logs/udf-leader.lock'),
+            tick=int(os.getenv('BACKGROUND_TICK', 5)),
+            refresh_interval=int(os.getenv('BACKGROUND_REFRESH_INTERVAL', 300)),
+            refresh_symbols=[
+                s.strip().upper()
+                for s in os.getenv('BACKGROUND_REFRESH_SYMBOLS', 'BTCUSDT,ETHUSDT').split(',')
+                if s.strip()
+            ],
+            refresh_intervals=[
+                i.strip()
+                for i in os.getenv('BACKGROUND_REFRESH_INTERVALS', '4h,1d').split(',')
+                if i.strip()
+            ],
+            dataset_check_interval=int(os.getenv('BACKGROUND_DATASET_CHECK_INTERVAL', 30))
+        )
+
+        self.metrics = MetricsConfig(
+            enabled=os.getenv('METRICS_ENABLED', 'true').lower() == 'true',
+            dir=os.getenv('METRICS_DIR', 'logs/metrics'),
+            publish_interval=int(os.getenv('METRICS_PUBLISH_INTERVAL', 5))
+        )
+
+        self.tracing = TracingConfig(
+            enabled=os.getenv('TRACING_ENABLED', 'true').lower() == 'true',
+            file=os.getenv('TRACE_FILE', ''),
+            sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', 1.0)),
+            file_max_mb=int(os.getenv('TRACE_FILE_MAX_MB', 50))
+        )
+
+        self.profiling = ProfilingConfig(
+            token=os.getenv('PROFILING_TOKEN', ''),
+            dir=os.getenv('PROFILING_DIR', 'logs/profiles'),
+            min_interval=int(os.getenv('PROFILING_MIN_INTERVAL', 60)),
+            sample_every=int(os.getenv('PROFILING_SAMPLE_EVERY', 0)),
+            sample_seconds=int(os.getenv('PROFILING_SAMPLE_SECONDS', 10)),
+            sample_hz=int(os.getenv('PROFILING_SAMPLE_HZ', 100)),
+            max_seconds=int(os.getenv('PROFILING_MAX_SECONDS', 30)),
+            max_files=int(os.getenv('PROFILING_MAX_FILES', 50))
+        )
+
+        self.admission = AdmissionConfig(
+            enabled=os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true',
+            history_capacity=int(os.getenv('ADMISSION_HISTORY_CAPACITY', 4)),
+            history_queue=int(os.getenv('ADMISSION_HISTORY_QUEUE', 2)),
+            ohlcv_capacity=int(os.getenv('ADMISSION_OHLCV_CAPACITY', 2)),
+            ohlcv_queue=int(os.getenv('ADMISSION_OHLCV_QUEUE', 1)),
+            queue_timeout=float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 2)),
+            bars_per_unit=int(os.getenv('ADMISSION_BARS_PER_UNIT', 5000)),
+            reserved_threads=int(os.getenv('ADMISSION_RESERVED_THREADS', 2)),
+            max_ohlcv_days=int(os.getenv('MAX_OHLCV_DAYS', 365))
+        )
+        self.gunicorn_threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+        self.upstream = UpstreamConfig(
+            timeout=int(os.getenv('COINGLASS_TIMEOUT', 30)),
+            failure_threshold=int(os.getenv('COINGLASS_BREAKER_FAILURES', 3)),
+            reset_timeout=int(os.getenv('COINGLASS_BREAKER_RESET', 30)),
+            negative_ttl=int(os.getenv('COINGLASS_NEGATIVE_TTL', 60))
+        )
+
         # Frontend Configuration
         self.frontend_api_url = os.getenv('FRONTEND_API_URL', 'http://localhost:8000')
 
@@ -112,21 +320,74 @@ class Config:
                 'host': self.api.host,
                 'port': self.api.port,
                 'debug': self.api.debug,
-                'cors_enabled': self.api.cors_enabled
+                'cors_enabled': self.api.cors_enabled,
+                'history_stream_rows': self.api.history_stream_rows
             },
             'builder': {
                 'update_interval': self.builder.update_interval,
+                'check_interval': self.builder.check_interval,
                 'ma_period': self.builder.ma_period,
                 'data_input_file': self.builder.data_input_file,
-                'data_output_file': self.builder.data_output_file
+                'data_output_file': self.builder.data_output_file,
+                'ma_periods': self.builder.ma_periods,
+                'smoothing': self.builder.smoothing,
+                'resolutions': self.builder.resolutions,
+                'workers': self.builder.workers
             },
             'logging': {
                 'level': self.logging.level,
-                'log_dir': self.logging.log_dir
+                'log_dir': self.logging.log_dir,
+                'queue': self.logging.queue,
+                'sample_burst': self.logging.sample_burst,
+                'sample_window': self.logging.sample_window
             },
             'external_apis': {
                 'coinglass_api_key': bool(self.coinglass_api_key),
-                'coinglass_base_url': self.coinglass_base_url
+                'coinglass_base_url': self.coinglass_base_url,
+                'coinglass_cache_enabled': self.coinglass_cache.enabled,
+                'coinglass_stale_ttl': self.coinglass_cache.stale_ttl,
+                # URL может содержать пароль Redis - наружу только схема
+                'cache_backend': self.shared_cache.url.split('://')[0] or None,
+                'coinglass_timeout': self.upstream.timeout,
+                'coinglass_breaker_failures': self.upstream.failure_threshold,
+                'coinglass_breaker_reset': self.upstream.reset_timeout
+            },
+            'admission': {
+                'enabled': self.admission.enabled,
+                'history_capacity': self.admission.history_capacity,
+                'history_queue': self.admission.history_queue,
+                'ohlcv_capacity': self.admission.ohlcv_capacity,
+                'ohlcv_queue': self.admission.ohlcv_queue,
+                'queue_timeout': self.admission.queue_timeout,
+                'reserved_threads': self.admission.reserved_threads,
+                'max_ohlcv_days': self.admission.max_ohlcv_days
+            },
+            'metrics': {
+                'enabled': self.metrics.enabled,
+                'dir': self.metrics.dir,
+                'publish_interval': self.metrics.publish_interval
+            },
+            'tracing': {
+                'enabled': self.tracing.enabled,
+                'file': self.tracing.file,
+                'sample_rate': self.tracing.sample_rate,
+                'file_max_mb': self.tracing.file_max_mb
+            },
+            'profiling': {
+                'enabled': bool(self.profiling.token),
+                'dir': self.profiling.dir,
+                'min_interval': self.profiling.min_interval,
+                'sample_every': self.profiling.sample_every,
+                'sample_seconds': self.profiling.sample_seconds,
+                'max_files': self.profiling.max_files
+            },
+            'background': {
+                'enabled': self.background.enabled,
+                'lock_file': self.background.lock_file,
+                'refresh_interval': self.background.refresh_interval,
+                'refresh_symbols': self.background.refresh_symbols,
+                'refresh_intervals': self.background.refresh_intervals,
+                'dataset_check_interval': self.background.dataset_check_interval
             },
             'frontend': {
                 'api_url': self.frontend_api_url
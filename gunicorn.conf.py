@@ -0,0 +1,62 @@
+"""
+Конфигурация gunicorn для UDF сервера
+
+    gunicorn -c gunicorn.conf.py src.udf.server:app
+
+При GUNICORN_PRELOAD=true (по умолчанию) приложение и данные загружаются
+один раз в мастере, а воркеры получают их через fork (copy-on-write).
+gc.freeze() перед fork убирает загруженные объекты из обхода сборщика
+мусора, чтобы он не переписывал их страницы в каждом воркере.
+
+Фоновые задачи запускаются в каждом воркере после fork; задачи, которые
+обращаются к внешним API, выполняет только ведущий воркер (src/udf/background.py).
+"""
+import gc
+import os
+import time
+
+bind = f"0.0.0.0:{os.getenv('UDF_PORT', '8000')}"
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+# ASGI режим: GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker и src.udf.asgi:app
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+timeout = 60
+accesslog = "-"
+errorlog = "-"
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def when_ready(server):
+    """Мастер готов: догружаем данные и замораживаем объекты перед fork"""
+    if not preload_app:
+        return
+
+    from src.udf.server import preload_datasets
+    from src.udf.worker_stats import format_memory, memory_usage
+
+    started = time.monotonic()
+    preload_datasets()
+    gc.collect()
+    gc.freeze()
+    server.log.info(
+        f"Datasets preloaded in {(time.monotonic() - started) * 1000:.0f} ms, "
+        f"{gc.get_freeze_count()} objects frozen, master {format_memory(memory_usage())}"
+    )
+
+
+def post_fork(server, worker):
+    worker._forked_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    """Отчет воркера: время от fork до готовности и память; запуск фоновых задач"""
+    from src.udf.server import start_background_jobs
+    from src.udf.worker_stats import format_memory, record_worker_start
+
+    start_background_jobs()
+
+    info = record_worker_start(getattr(worker, "_forked_at", time.monotonic()), preload_app)
+    worker.log.info(
+        f"Worker {info['pid']} ready in {info['startup_ms']} ms "
+        f"(preload={'on' if preload_app else 'off'}), {format_memory(info['memory_kb'])}"
+    )
@@ -0,0 +1,72 @@
+/**
+ * Загрузка истории по годовым тайлам (/data/tiles/)
+ *
+ * Индекс тайлов запрашивается один раз, затем загружаются только тайлы,
+ * пересекающиеся с нужным диапазоном. Тайлы неизменяемы (хэш в имени файла),
+ * поэтому браузер и nginx кэшируют их без срока давности.
+ */
+class HistoryTiles {
+    constructor(baseUrl = '/data/tiles/') {
+        this.baseUrl = baseUrl;
+        this.indexPromise = null;
+        this.tileCache = new Map();
+    }
+
+    async index() {
+        if (!this.indexPromise) {
+            this.indexPromise = fetch(`${this.baseUrl}index.json`)
+                .then(resp => (resp.ok ? resp.json() : null))
+                .catch(() => null);
+        }
+        return this.indexPromise;
+    }
+
+    async has(series, resolution) {
+        const index = await this.index();
+        return Boolean(index && index.series && index.series[`${series}:${resolution}`]);
+    }
+
+    loadTile(file) {
+        if (!this.tileCache.has(file)) {
+            const promise = fetch(`${this.baseUrl}${file}`).then(resp => {
+                if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+                return resp.json();
+            });
+            // Неудачная загрузка не должна оставаться в кэше
+            promise.catch(() => this.tileCache.delete(file));
+            this.tileCache.set(file, promise);
+        }
+        return this.tileCache.get(file);
+    }
+
+    /**
+     * Свечи серии в диапазоне [from, to] (секунды UTC)
+     * @returns {Promise<Array|null>} null - серии нет в индексе
+     */
+    async load(series, resolution, from = 0, to = Infinity) {
+        const index = await this.index();
+        const tiles = index && index.series && index.series[`${series}:${resolution}`];
+        if (!tiles) return null;
+
+        const needed = tiles.filter(tile => tile.to >= from && tile.from <= to);
+        const parts = await Promise.all(needed.map(tile => this.loadTile(tile.file)));
+
+        const result = [];
+        for (const data of parts) {
+            for (let i = 0; i < data.t.length; i++) {
+                const time = data.t[i];
+                if (time < from || time > to) continue;
+                result.push({
+                    time: time,
+                    open: data.o[i],
+                    high: data.h[i],
+                    low: data.l[i],
+                    close: data.c[i]
+                });
+            }
+        }
+        return result;
+    }
+}
+
+window.historyTiles = new HistoryTiles();
@@ -0,0 +1,104 @@
+"""
+Публикация артефактов сборки: атомарная запись, сжатые копии и манифест версий
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli ставится вместе с Flask-Compress, но не обязателен
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+
+def write_atomic(path: Path, data: bytes):
+    """Записать файл через временный файл и rename (читатель не увидит обрезанный файл)"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp создает файл с правами 0600, а читают его другие контейнеры
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+def dump_json_bytes(payload: Any) -> bytes:
+    """Компактный JSON без пробелов"""
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def content_version(data: bytes) -> str:
+    """Версия артефакта по содержимому"""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def publish_artifact(path: Path, data: bytes) -> Dict[str, Any]:
+    """
+    Записать артефакт вместе с .gz и .br копиями
+
+    Сжатые копии пишутся раньше основного файла, поэтому nginx gzip_static
+    не отдаст сжатую версию старее несжатой.
+
+    Returns:
+        Запись для манифеста (версия и размеры)
+    """
+    path = Path(path)
+    entry = {
+        "file": path.name,
+        "version": content_version(data),
+        "size": len(data),
+    }
+
+    # mtime=0 - одинаковое содержимое дает одинаковые байты
+    gz_data = gzip.compress(data, compresslevel=9, mtime=0)
+    write_atomic(path.with_name(path.name + ".gz"), gz_data)
+    entry["gzip_size"] = len(gz_data)
+
+    br_path = path.with_name(path.name + ".br")
+    if brotli is not None:
+        br_data = brotli.compress(data, quality=11)
+        write_atomic(br_path, br_data)
+        entry["br_size"] = len(br_data)
+    elif br_path.exists():
+        # Копия от прошлой сборки (с brotli) устарела - иначе ее отдадут
+        br_path.unlink()
+
+    write_atomic(path, data)
+    return entry
+
+
+def read_manifest(directory: Path) -> Dict[str, Any]:
+    """Прочитать манифест артефактов каталога"""
+    try:
+        with open(Path(directory) / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"artifacts": {}}
+
+
+def update_manifest(
+    directory: Path, entries: Dict[str, Dict[str, Any]], manifest: Optional[Dict] = None
+) -> Dict[str, Any]:
+    """Обновить записи манифеста (остальные записи сохраняются)"""
+    manifest = manifest or read_manifest(directory)
+    manifest.setdefault("artifacts", {}).update(entries)
+    manifest["updated_at"] = datetime.now(timezone.utc).isoformat()
+    write_atomic(Path(directory) / MANIFEST_NAME, dump_json_bytes(manifest))
+    return manifest
@@ -0,0 +1,250 @@
+"""
+Асинхронный клиент Coinglass API с ограничением параллельности
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+from .candles import CandleSeries, decode_candles
+from .circuit_breaker import CircuitBreaker
+from .coinglass_client import (
+    CANDLES_ENDPOINT,
+    UPSTREAM_SECONDS,
+    CoinglassClient,
+    UpstreamError,
+    build_candles_params,
+    is_upstream_failure,
+    unwrap_payload,
+    upstream_outcome,
+)
+from .tracing import span, traced
+
+logger = logging.getLogger(__name__)
+
+# Запрос свечей: (symbol, interval, from_ts, to_ts)
+CandleRequest = Tuple[str, str, Optional[int], Optional[int]]
+
+
+class AsyncCoinglassClient:
+    """
+    Асинхронный вариант CoinglassClient
+
+    Разделяет с синхронным клиентом rate limiter, circuit breaker'ы и negative
+    cache, поэтому суммарная нагрузка на API не растет. Количество
+    одновременных запросов ограничено семафором.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        client: Optional[CoinglassClient] = None,
+        max_concurrency: int = 4,
+    ):
+        self.client = client or CoinglassClient(api_key)
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """HTTP сессия (создается внутри работающего event loop)"""
+        if self._session is None or self._session.closed:
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=self.client.connect_timeout,
+                sock_read=self.client.timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                headers=self.client.headers, timeout=timeout
+            )
+        return self._session
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def close(self):
+        """Закрыть HTTP сессию"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @traced("coinglass.fetch")
+    async def _fetch(self, endpoint: str, params: Optional[Dict] = None) -> Optional[Any]:
+        """Асинхронный аналог CoinglassClient._fetch"""
+        symbol = (params or {}).get("symbol", "")
+        breaker = self.client.breakers.get((endpoint, symbol))
+        if not breaker.allow_request():
+            raise UpstreamError(f"Circuit open for {endpoint} {symbol}")
+        # Пробный запрос half_open освобождается и при отмене (CancelledError)
+        probe = breaker.state == CircuitBreaker.HALF_OPEN
+        try:
+            return await self._fetch_allowed(endpoint, params, breaker)
+        finally:
+            if probe:
+                breaker.release_probe()
+
+    async def _fetch_allowed(
+        self, endpoint: str, params: Optional[Dict], breaker: CircuitBreaker
+    ) -> Optional[Any]:
+        url = f"{self.client.base_url}{endpoint}"
+        session = await self._get_session()
+
+        async with self._get_semaphore():
+            with span("coinglass.rate_limit"):
+                await self.client.rate_limiter.wait_async()
+            started = time.perf_counter()
+            status = None
+            try:
+                async with session.get(url, params=params) as response:
+                    status = response.status
+                    if is_upstream_failure(status):
+                        text = await response.text()
+                        breaker.record_failure()
+                        raise UpstreamError(f"HTTP {status}: {text}")
+
+                    breaker.record_success()
+                    if status != 200:
+                        logger.error(f"HTTP {status}: {await response.text()}")
+                        return None
+
+                    try:
+                        data = await response.json(content_type=None)
+                    except ValueError as e:
+                        logger.error(f"Invalid JSON from {endpoint}: {e}")
+                        return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                breaker.record_failure()
+                raise UpstreamError(f"Request error: {e!r}") from e
+            finally:
+                UPSTREAM_SECONDS.observe(
+                    time.perf_counter() - started, endpoint, upstream_outcome(status)
+                )
+
+        return unwrap_payload(data)
+
+    async def get_available_symbols(self) -> List[Dict[str, str]]:
+        """Список доступных символов"""
+        return self.client.get_available_symbols()
+
+    async def fetch_candles(
+        self,
+        symbol: str,
+        interval: str = "4h",
+        from_ts: int = None,
+        to_ts: int = None,
+    ) -> Optional[CandleSeries]:
+        """
+        Загрузить свечи, не скрывая ошибки API
+
+        Returns:
+            Серия свечей или None, если API ответил, что данных нет
+
+        Raises:
+            UpstreamError: API недоступен или цепь разомкнута
+        """
+        params = build_candles_params(symbol, interval, from_ts, to_ts)
+        symbol = params["symbol"]
+
+        negative_key = (symbol, interval, from_ts, to_ts)
+        if self.client._is_negative_cached(negative_key):
+            return None
+
+        data = await self._fetch(CANDLES_ENDPOINT, params)
+        if not data:
+            params.pop("exchange", None)
+            data = await self._fetch(CANDLES_ENDPOINT, params)
+
+        if not data:
+            logger.warning("No data received for %s", symbol)
+            self.client._remember_no_data(negative_key)
+            return None
+
+        return decode_candles(data)
+
+    async def get_crypto_candles(
+        self,
+        symbol: str,
+        days: int = 365,
+        interval: str = "4h",
+        from_ts: int = None,
+        to_ts: int = None,
+    ) -> Optional[CandleSeries]:
+        """Асинхронный аналог CoinglassClient.get_crypto_candles"""
+        try:
+            return await self.fetch_candles(symbol, interval, from_ts, to_ts)
+        except UpstreamError as e:
+            logger.warning("Coinglass unavailable for %s: %s", symbol, e)
+            return None
+
+    async def get_crypto_ohlcv(
+        self,
+        symbol: str,
+        days: int = 365,
+        interval: str = "4h",
+        from_ts: int = None,
+        to_ts: int = None,
+    ) -> Optional[List[Dict]]:
+        """Асинхронный аналог CoinglassClient.get_crypto_ohlcv"""
+        candles = await self.get_crypto_candles(symbol, days, interval, from_ts, to_ts)
+        return candles.to_rows() if candles else None
+
+    async def get_many_candles(
+        self, requests: Iterable[CandleRequest]
+    ) -> Dict[CandleRequest, Optional[CandleSeries]]:
+        """Загрузить несколько серий параллельно (в пределах семафора)"""
+        requests = list(requests)
+        results = await asyncio.gather(
+            *(
+                self.get_crypto_candles(symbol, interval=interval, from_ts=start, to_ts=end)
+                for symbol, interval, start, end in requests
+            )
+        )
+        return dict(zip(requests, results))
+
+
+class CoinglassSyncFacade:
+    """
+    Синхронный фасад над AsyncCoinglassClient для Flask кода
+
+    Держит собственный event loop в фоновом потоке; вызовы из любых потоков
+    выполняются в нем и ждут результата.
+    """
+
+    def __init__(self, client: AsyncCoinglassClient):
+        self.client = client
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="coinglass-async", daemon=True
+        )
+        self._thread.start()
+
+    def run(self, coro, timeout: Optional[float] = None) -> Any:
+        """Выполнить корутину в фоновом loop и дождаться результата"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        return future.result(timeout)
+
+    def get_available_symbols(self) -> List[Dict[str, str]]:
+        return self.client.client.get_available_symbols()
+
+    def get_crypto_candles(self, *args, **kwargs) -> Optional[CandleSeries]:
+        return self.run(self.client.get_crypto_candles(*args, **kwargs))
+
+    def get_crypto_ohlcv(self, *args, **kwargs) -> Optional[List[Dict]]:
+        return self.run(self.client.get_crypto_ohlcv(*args, **kwargs))
+
+    def get_many_candles(
+        self, requests: Iterable[CandleRequest], timeout: Optional[float] = None
+    ) -> Dict[CandleRequest, Optional[CandleSeries]]:
+        return self.run(self.client.get_many_candles(requests), timeout)
+
+    def close(self):
+        """Закрыть сессию и остановить фоновый loop"""
+        try:
+            self.run(self.client.close(), timeout=5)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
@@ -0,0 +1,486 @@
+"""
+Общий кэш между воркерами и репликами
+
+Бэкенды хранят байты по строковому ключу с TTL:
+
+    memory://                       - LRU в памяти процесса
+    sqlite:///app/data/cache.db     - файл SQLite (WAL + mmap), общий для воркеров
+    redis://host:6379/0             - любой сервер с протоколом Redis (RESP)
+
+Кэш - только ускорение: ошибки бэкенда логируются и считаются промахом.
+"""
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sqlite3
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+
+from .candles import COLUMNS, TIME_DTYPE, VALUE_DTYPE, CandleSeries
+
+logger = logging.getLogger(__name__)
+
+# Заголовок упакованной серии: число свечей и время сохранения
+_SERIES_HEADER = struct.Struct("<qd")
+
+
+def pack_series(candles: CandleSeries, stored_at: float = 0.0) -> bytes:
+    """Серия свечей -> байты (колонки подряд, без JSON)"""
+    parts = [_SERIES_HEADER.pack(len(candles), stored_at)]
+    parts.append(np.ascontiguousarray(candles.t, dtype=TIME_DTYPE).tobytes())
+    for name in COLUMNS[1:]:
+        parts.append(np.ascontiguousarray(getattr(candles, name), dtype=VALUE_DTYPE).tobytes())
+    return b"".join(parts)
+
+
+def unpack_series(data: bytes) -> Tuple[CandleSeries, float]:
+    """Байты из pack_series -> (серия, время сохранения); колонки без копирования"""
+    count, stored_at = _SERIES_HEADER.unpack_from(data)
+    offset = _SERIES_HEADER.size
+    columns = [np.frombuffer(data, dtype=TIME_DTYPE, count=count, offset=offset)]
+    offset += count * columns[0].itemsize
+    for _ in COLUMNS[1:]:
+        column = np.frombuffer(data, dtype=VALUE_DTYPE, count=count, offset=offset)
+        columns.append(column)
+        offset += count * column.itemsize
+    return CandleSeries(*columns), stored_at
+
+
+def pack_json(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def unpack_json(data: bytes) -> Any:
+    return json.loads(data)
+
+
+class CacheBackend(ABC):
+    """Интерфейс бэкенда: байты по ключу с необязательным TTL (секунды)"""
+
+    name = "base"
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Значение или None (нет ключа, истек TTL, ошибка бэкенда)"""
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        """Записать значение; ttl=None - без срока"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Удалить ключ (отсутствующий ключ - не ошибка)"""
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """LRU в памяти процесса (общий только для потоков одного воркера)"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (value, expires_at или None)
+        self._entries: "OrderedDict[str, Tuple[bytes, Optional[float]]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._entries)
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Файл SQLite, общий для всех воркеров на одной машине
+
+    WAL позволяет читать параллельно с записью, страницы читаются через mmap.
+    Соединение у каждого потока свое.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: Path, max_entries: int = 4096, mmap_size: int = 256 << 20):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._writes = 0
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache(expires_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # Соединение, унаследованное через fork (preload gunicorn), не используем
+        if conn is not None and self._local.pid != os.getpid():
+            conn = None
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite cache read failed for {key}: {e}")
+            return None
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return bytes(value)
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        expires_at = time.time() + ttl if ttl else None
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, sqlite3.Binary(value), expires_at),
+            )
+            self._writes += 1
+            # Уборка раз в 100 записей, а не на каждой
+            if self._writes % 100 == 0:
+                self._evict(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite cache write failed for {key}: {e}")
+
+    def _evict(self, conn: sqlite3.Connection):
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM cache WHERE key NOT IN ("
+            "SELECT key FROM cache ORDER BY COALESCE(expires_at, 1e18) DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def delete(self, key: str):
+        try:
+            self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite cache delete failed for {key}: {e}")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RespError(Exception):
+    """Ошибка, которую вернул сервер Redis"""
+
+
+def encode_command(*args) -> bytes:
+    """Команда в формате RESP (массив bulk-строк)"""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode("utf-8")
+        elif isinstance(arg, int):
+            arg = str(arg).encode("ascii")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def read_reply(stream: io.BufferedReader) -> Any:
+    """Прочитать один ответ RESP из потока"""
+    line = stream.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed by Redis server")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode("utf-8")
+    if kind == b"-":
+        raise RespError(payload.decode("utf-8"))
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError("Connection closed by Redis server")
+        return data[:-2]
+    if kind == b"*":
+        count = int(payload)
+        if count < 0:
+            return None
+        return [read_reply(stream) for _ in range(count)]
+    raise ConnectionError(f"Unexpected RESP reply: {line[:32]!r}")
+
+
+class RedisBackend(CacheBackend):
+    """
+    Клиент протокола Redis (RESP) без внешних зависимостей
+
+    Работает с Redis, Valkey, KeyDB и локальной заглушкой
+    (python -m src.data.cache_backend --serve). Соединение у каждого потока
+    свое; после ошибки переподключение не чаще раза в retry_interval секунд.
+    """
+
+    name = "redis"
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        timeout: float = 1.0,
+        prefix: str = "cbma:",
+        retry_interval: float = 5.0,
+    ):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.prefix = prefix
+        self.retry_interval = retry_interval
+        self._local = threading.local()
+        self._down_until = 0.0
+
+    def _connect(self) -> Tuple[socket.socket, io.BufferedReader]:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        if self.password:
+            self._call(conn, "AUTH", self.password)
+        if self.db:
+            self._call(conn, "SELECT", self.db)
+        return conn
+
+    @staticmethod
+    def _call(conn: Tuple[socket.socket, io.BufferedReader], *args) -> Any:
+        sock, stream = conn
+        sock.sendall(encode_command(*args))
+        return read_reply(stream)
+
+    def _drop(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    def execute(self, *args) -> Any:
+        """Выполнить команду; при недоступности сервера - ConnectionError"""
+        if time.time() < self._down_until:
+            raise ConnectionError("Redis backend is temporarily unavailable")
+        conn = getattr(self._local, "conn", None)
+        # Сокет, унаследованный через fork, общий с мастером - открываем свой
+        if conn is not None and self._local.pid != os.getpid():
+            conn = None
+        try:
+            if conn is None:
+                conn = self._local.conn = self._connect()
+                self._local.pid = os.getpid()
+            return self._call(conn, *args)
+        except RespError:
+            raise
+        except (OSError, ValueError) as e:
+            self._drop()
+            self._down_until = time.time() + self.retry_interval
+            raise ConnectionError(f"Redis {self.host}:{self.port}: {e}") from e
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.execute("GET", self.prefix + key)
+        except (ConnectionError, RespError) as e:
+            logger.debug(f"Redis cache read failed for {key}: {e}")
+            return None
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        args = ["SET", self.prefix + key, value]
+        if ttl:
+            args += ["EX", int(ttl)]
+        try:
+            self.execute(*args)
+        except (ConnectionError, RespError) as e:
+            logger.debug(f"Redis cache write failed for {key}: {e}")
+
+    def delete(self, key: str):
+        try:
+            self.execute("DEL", self.prefix + key)
+        except (ConnectionError, RespError) as e:
+            logger.debug(f"Redis cache delete failed for {key}: {e}")
+
+    def ping(self) -> bool:
+        try:
+            return self.execute("PING") == "PONG"
+        except (ConnectionError, RespError):
+            return False
+
+    def close(self):
+        self._drop()
+
+
+def create_cache_backend(url: str, max_entries: int = 1024) -> Optional[CacheBackend]:
+    """
+    Бэкенд по URL (пустая строка - общий кэш выключен)
+
+    Raises:
+        ValueError: Неизвестная схема URL
+    """
+    if not url:
+        return None
+
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryBackend(max_entries=max_entries)
+    if parsed.scheme == "sqlite":
+        # sqlite:///abs/path.db или sqlite://relative/path.db
+        path = parsed.netloc + parsed.path
+        return SQLiteBackend(Path(path), max_entries=max_entries)
+    if parsed.scheme == "redis":
+        db = parsed.path.lstrip("/")
+        return RedisBackend(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(db) if db else 0,
+            password=parsed.password,
+        )
+    raise ValueError(f"Unsupported cache backend: {url}")
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    """Обработчик заглушки: GET/SET [EX]/DEL/PING/SELECT/AUTH/FLUSHDB"""
+
+    def _reply(self, value: Any):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, bytes):
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+        else:
+            self.wfile.write(b"+%s\r\n" % str(value).encode("utf-8"))
+
+    def handle(self):
+        store: MemoryBackend = self.server.store
+        while True:
+            try:
+                command = read_reply(self.rfile)
+            except (ConnectionError, RespError, ValueError):
+                return
+            if not isinstance(command, list) or not command:
+                self.wfile.write(b"-ERR protocol error\r\n")
+                continue
+
+            name = command[0].upper()
+            args = [arg.decode("utf-8") if i == 0 else arg for i, arg in enumerate(command[1:])]
+            if name == b"PING":
+                self._reply("PONG")
+            elif name in (b"SELECT", b"AUTH"):
+                self._reply("OK")
+            elif name == b"GET" and len(args) == 1:
+                self._reply(store.get(args[0]))
+            elif name == b"SET" and len(args) in (2, 4):
+                ttl = int(args[3]) if len(args) == 4 else None
+                store.set(args[0], args[1], ttl)
+                self._reply("OK")
+            elif name == b"DEL" and args:
+                existed = store.get(args[0]) is not None
+                store.delete(args[0])
+                self._reply(int(existed))
+            elif name == b"FLUSHDB":
+                for key in store.keys():
+                    store.delete(key)
+                self._reply("OK")
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    """Локальная заглушка сервера Redis для разработки и проверки RedisBackend"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6380, max_entries: int = 4096):
+        super().__init__((host, port), _RespHandler)
+        self.store = MemoryBackend(max_entries=max_entries)
+
+
+def main():
+    """Запуск заглушки: python -m src.data.cache_backend --serve --port 6380"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Локальная заглушка Redis (RESP)")
+    parser.add_argument("--serve", action="store_true", help="Запустить заглушку")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.serve:
+        parser.print_help()
+        return 0
+
+    server = RespStandIn(args.host, args.port)
+    logger.info(f"RESP stand-in listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
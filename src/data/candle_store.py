@@ -0,0 +1,79 @@
+"""
+Локальное хранилище свечей (по файлу .npz на символ и интервал)
+"""
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .candles import COLUMNS, CandleSeries, concat_candles
+
+logger = logging.getLogger(__name__)
+
+
+class CandleStore:
+    """Хранилище свечей: {root}/{SYMBOL}/{interval}.npz"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._lock = threading.RLock()
+        # Загруженные серии: путь -> (mtime_ns, серия)
+        self._loaded: Dict[Path, Tuple[int, CandleSeries]] = {}
+
+    def path_for(self, symbol: str, interval: str) -> Path:
+        """Путь к файлу серии"""
+        return self.root / symbol.upper() / f"{interval}.npz"
+
+    def symbols(self) -> List[str]:
+        """Символы, для которых есть данные"""
+        if not self.root.exists():
+            return []
+        return sorted(p.name for p in self.root.iterdir() if p.is_dir())
+
+    def load(self, symbol: str, interval: str) -> Optional[CandleSeries]:
+        """Загрузить серию (повторные вызовы без изменений файла - из памяти)"""
+        path = self.path_for(symbol, interval)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        cached = self._loaded.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        try:
+            with np.load(path) as data:
+                series = CandleSeries(*(data[name] for name in COLUMNS))
+        except Exception as e:
+            logger.error(f"Error loading candles from {path}: {e}")
+            return None
+
+        with self._lock:
+            self._loaded[path] = (mtime, series)
+        return series
+
+    def save(self, symbol: str, interval: str, candles: CandleSeries):
+        """Атомарно записать серию (через временный файл и rename)"""
+        path = self.path_for(symbol, interval)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **{name: getattr(candles, name) for name in COLUMNS})
+            os.replace(tmp_name, path)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+    def merge(self, symbol: str, interval: str, candles: CandleSeries) -> CandleSeries:
+        """Добавить свечи к сохраненной серии (новые значения важнее старых)"""
+        with self._lock:
+            merged = concat_candles(self.load(symbol, interval), candles)
+            self.save(symbol, interval, merged)
+        return merged
@@ -0,0 +1,194 @@
+"""
+Колоночное представление OHLCV свечей
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+TIME_DTYPE = np.int64
+VALUE_DTYPE = np.float64
+
+# Порядок колонок в ответе UDF
+COLUMNS = ("t", "o", "h", "l", "c", "v")
+
+
+@dataclass(frozen=True)
+class CandleSeries:
+    """Неизменяемая серия свечей в виде типизированных колонок t/o/h/l/c/v"""
+
+    t: np.ndarray  # время открытия свечи, секунды UTC
+    o: np.ndarray
+    h: np.ndarray
+    l: np.ndarray  # noqa: E741
+    c: np.ndarray
+    v: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "CandleSeries":
+        """Пустая серия"""
+        values = np.empty(0, dtype=VALUE_DTYPE)
+        return cls(np.empty(0, dtype=TIME_DTYPE), values, values, values, values, values)
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    def slice_range(self, from_ts: int, to_ts: int) -> "CandleSeries":
+        """Срез по диапазону времени [from_ts, to_ts] без копирования данных"""
+        start = int(np.searchsorted(self.t, from_ts, side="left"))
+        end = int(np.searchsorted(self.t, to_ts, side="right"))
+        if start == 0 and end == len(self.t):
+            return self
+        return CandleSeries(*(getattr(self, name)[start:end] for name in COLUMNS))
+
+    def to_udf(self) -> Dict[str, Any]:
+        """Ответ history в формате UDF"""
+        result = {"s": "ok"}
+        for name in COLUMNS:
+            result[name] = getattr(self, name).tolist()
+        return result
+
+    def to_rows(self) -> List[Dict[str, Any]]:
+        """Построчное представление (формат /api/crypto/ohlcv)"""
+        return [
+            {
+                "timestamp": t * 1000,
+                "time": t,
+                "open": o,
+                "high": h,
+                "low": l,
+                "close": c,
+                "volume": v,
+            }
+            for t, o, h, l, c, v in zip(
+                *(getattr(self, name).tolist() for name in COLUMNS)
+            )
+        ]
+
+
+def is_sorted(times: np.ndarray) -> bool:
+    """Проверить, что метки времени не убывают (один проход)"""
+    return len(times) < 2 or bool(np.all(times[1:] >= times[:-1]))
+
+
+def from_columns(
+    t: Any, o: Any, h: Any, l: Any, c: Any, v: Any  # noqa: E741
+) -> CandleSeries:
+    """Собрать серию из колонок; сортирует только если данные не упорядочены"""
+    times = np.asarray(t, dtype=TIME_DTYPE)
+    columns = [np.asarray(col, dtype=VALUE_DTYPE) for col in (o, h, l, c, v)]
+
+    if not is_sorted(times):
+        order = np.argsort(times, kind="stable")
+        times = times[order]
+        columns = [col[order] for col in columns]
+
+    return CandleSeries(times, *columns)
+
+
+def _decode_rows(data: List[List[Any]]) -> Optional[CandleSeries]:
+    """[[timestamp_ms, open, high, low, close, volume], ...]"""
+    rows = [row for row in data if len(row) >= 5]
+    if not rows:
+        return None
+
+    if all(len(row) >= 6 for row in rows):
+        matrix = np.array([row[:6] for row in rows], dtype=VALUE_DTYPE)
+        volume = matrix[:, 5]
+    else:
+        matrix = np.array([row[:5] for row in rows], dtype=VALUE_DTYPE)
+        volume = np.fromiter(
+            (float(row[5]) if len(row) > 5 else 0.0 for row in rows),
+            dtype=VALUE_DTYPE,
+            count=len(rows),
+        )
+
+    times = matrix[:, 0].astype(TIME_DTYPE) // 1000
+    return from_columns(
+        times, matrix[:, 1], matrix[:, 2], matrix[:, 3], matrix[:, 4], volume
+    )
+
+
+def _decode_dicts(data: List[Dict[str, Any]]) -> Optional[CandleSeries]:
+    """[{"time": ms, "open": ..., "volume_usd": ...}, ...]"""
+    count = len(data)
+
+    def column(key: str, fallback: Optional[str] = None) -> np.ndarray:
+        if fallback is None:
+            values = (float(item.get(key, 0)) for item in data)
+        else:
+            values = (float(item.get(key, item.get(fallback, 0))) for item in data)
+        return np.fromiter(values, dtype=VALUE_DTYPE, count=count)
+
+    times = (
+        np.fromiter(
+            (int(item.get("time", 0)) for item in data), dtype=TIME_DTYPE, count=count
+        )
+        // 1000
+    )
+    return from_columns(
+        times,
+        column("open"),
+        column("high"),
+        column("low"),
+        column("close"),
+        column("volume_usd", "volume"),
+    )
+
+
+def decode_candles(data: Any) -> Optional[CandleSeries]:
+    """
+    Разобрать ответ Coinglass напрямую в колонки
+
+    Args:
+        data: Массив массивов или массив словарей (время в миллисекундах)
+
+    Returns:
+        Серия свечей или None, если формат не распознан или данных нет
+    """
+    if not isinstance(data, list) or not data:
+        return None
+
+    if isinstance(data[0], (list, tuple)):
+        series = _decode_rows(data)
+    elif isinstance(data[0], dict):
+        series = _decode_dicts(data)
+    else:
+        return None
+
+    return series if series is not None and len(series) else None
+
+
+def concat_candles(*parts: Optional[CandleSeries]) -> CandleSeries:
+    """
+    Объединить серии с удалением дублей по времени
+
+    При совпадении меток времени побеждает свеча из более поздней серии
+    """
+    parts = [part for part in parts if part is not None and len(part)]
+    if not parts:
+        return CandleSeries.empty()
+    if len(parts) == 1:
+        return parts[0]
+
+    # Переворачиваем порядок, чтобы np.unique оставлял свечи поздних серий
+    columns = {
+        name: np.concatenate([getattr(part, name) for part in reversed(parts)])
+        for name in COLUMNS
+    }
+    times, index = np.unique(columns["t"], return_index=True)
+    return CandleSeries(
+        times, *(columns[name][index] for name in COLUMNS if name != "t")
+    )
+
+
+def extend_history(history: Optional[CandleSeries], live: CandleSeries) -> CandleSeries:
+    """Дополнить свежее окно свечей более старой историей из хранилища"""
+    if history is None or not len(history) or not len(live):
+        return live
+    older = history.slice_range(int(history.t[0]), int(live.t[0]) - 1)
+    if not len(older):
+        return live
+    return CandleSeries(
+        *(np.concatenate([getattr(older, name), getattr(live, name)]) for name in COLUMNS)
+    )
@@ -4,63 +4,264 @@ CBMA Calculator - расчет индекса с применением 14-пе
 import json
 import logging
 import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
 
 # Добавляем путь к common модулям
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 # Используем стандартные библиотеки Python вместо legacy модулей
+from src.data.artifacts import (  # noqa: E402
+    dump_json_bytes,
+    publish_artifact,
+    update_manifest,
+)
+from src.data.tracing import span, traced  # noqa: E402
 
 logger = logging.getLogger(__name__)
 
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M:%SZ",
+    "%Y-%m-%d %H:%M:%S",
+    "%d.%m.%Y",
+    "%d/%m/%Y",
+    "%a, %b %d, %y",  # Поддержка формата "Fri, Jul 4, 25"
+    "%A, %B %d, %Y",  # Поддержка формата "Friday, July 4, 2025"
+]
+
+
+@lru_cache(maxsize=16384)
+def _parse_date(date_str: str) -> Optional[datetime]:
+    """Парсинг даты с кэшем: при повторных сборках даты не разбираются заново"""
+    for fmt in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(date_str, fmt)
+            # Если год меньше 100, добавляем 2000 (для формата %y)
+            if parsed.year < 100:
+                parsed = parsed.replace(year=parsed.year + 2000)
+            return parsed
+        except ValueError:
+            continue
+
+    return None
+
+
+def moving_average(values: List[float], period: int = 14) -> List[float]:
+    """Простая скользящая средняя скользящим окном (без пересчета суммы окна)"""
+    if not values or len(values) < period:
+        return []
+
+    result = []
+    window_sum = sum(values[:period])
+    result.append(window_sum / period)
+
+    # Скользящее окно для остальных значений
+    for i in range(period, len(values)):
+        window_sum = window_sum - values[i - period] + values[i]
+        result.append(window_sum / period)
+
+    return result
+
+
+# Сколько рассчитанных рядов и вариантов хранит один снимок
+MEMO_MAX_ENTRIES = 32
+
+
+@dataclass(frozen=True)
+class CBMASeries:
+    """Ряд CBMA одного периода MA колонками (точки, для которых MA определена)"""
+
+    times: np.ndarray
+    dates: np.ndarray
+    original: np.ndarray
+    cbma: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def row(self, index: int) -> Dict[str, Any]:
+        return {
+            "date": str(self.dates[index]),
+            "timestamp": int(self.times[index]),
+            "original_value": float(self.original[index]),
+            "cbma": float(self.cbma[index]),
+        }
+
+    def rows(self, start: int = 0, end: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Точки [start, end) в формате build_cbma (словари создаются только здесь)"""
+        return [
+            {"date": date, "timestamp": timestamp, "original_value": original, "cbma": cbma}
+            for date, timestamp, original, cbma in zip(
+                self.dates[start:end].tolist(),
+                self.times[start:end].tolist(),
+                self.original[start:end].tolist(),
+                self.cbma[start:end].tolist(),
+            )
+        ]
+
+
+@dataclass(frozen=True)
+class CBMASnapshot:
+    """
+    Неизменяемый снимок исходных данных CBMA
+
+    Точки хранятся только колонками numpy (время, значение, исходная строка
+    даты): ни разобранного JSON, ни объектов на каждую точку. Снимок не
+    меняется после создания: обновление данных создает новый снимок, а
+    читатели продолжают работать со старым, пока не возьмут новый. Результаты
+    расчетов (ряды для разных периодов MA, варианты матрицы) запоминаются в
+    самом снимке, не больше MEMO_MAX_ENTRIES последних использованных.
+    Одновременный первый расчет одного ключа в двух потоках дает одинаковый
+    результат, поэтому сам расчет идет без блокировки.
+    """
+
+    version: int
+    times: np.ndarray = field(repr=False, compare=False)
+    values: np.ndarray = field(repr=False, compare=False)
+    dates: np.ndarray = field(repr=False, compare=False)
+    # Идентичность исходного файла (mtime и размер), одинаковая во всех воркерах
+    source: str = ""
+    _memo: "OrderedDict[Hashable, Any]" = field(
+        default_factory=OrderedDict, repr=False, compare=False
+    )
+    _memo_lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @classmethod
+    def from_items(cls, version: int, items: List[Dict[str, Any]], source: str = "") -> "CBMASnapshot":
+        """Снимок из точек parse_items (сами точки не сохраняются)"""
+        return cls(
+            version,
+            times=np.array([item["timestamp"] for item in items], dtype=np.int64),
+            values=np.array([item["value"] for item in items], dtype=np.float64),
+            dates=np.array([item["date_str"] for item in items], dtype=np.str_),
+            source=source,
+        )
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def memoize(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Результат compute(), рассчитанный один раз для этого снимка (LRU)"""
+        with self._memo_lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+        value = compute()
+        with self._memo_lock:
+            # При гонке все потоки получат один объект
+            value = self._memo.setdefault(key, value)
+            self._memo.move_to_end(key)
+            while len(self._memo) > MEMO_MAX_ENTRIES:
+                self._memo.popitem(last=False)
+        return value
+
+    def is_memoized(self, key: Hashable) -> bool:
+        """Результат для key уже рассчитан в этом снимке"""
+        with self._memo_lock:
+            return key in self._memo
+
+    def series(self, ma_period: int) -> CBMASeries:
+        """Ряд CBMA для периода MA"""
+
+        def compute():
+            # Тот же расчет и округление, что в build_cbma
+            ma_values = moving_average(self.values.tolist(), ma_period)
+            start = ma_period - 1
+            return CBMASeries(
+                times=self.times[start:],
+                dates=self.dates[start:],
+                original=self.values[start:],
+                cbma=np.array([round(value, 2) for value in ma_values], dtype=np.float64),
+            )
+
+        return self.memoize(("series", ma_period), compute)
+
 
 class CBMACalculator:
     """Калькулятор для расчета CBMA индекса"""
 
     def __init__(self, data_file: Path):
         self.data_file = data_file
-        self._raw_data = None
-        self._processed_data = None
+        # Текущий снимок; замена ссылки атомарна, поэтому читатели не блокируются
+        self._snapshot: Optional[CBMASnapshot] = None
+        # Единственный писатель: загрузка и пересборка снимка
+        self._write_lock = threading.Lock()
+        self._version = 0
+
+    @traced("cbma.load_raw_data")
+    def _read_raw_data(self) -> Dict:
+        try:
+            with open(self.data_file, "r", encoding="utf-8") as f:
+                raw_data = json.load(f)
+            logger.info("Loaded %d raw data points", len(raw_data))
+            return raw_data
+        except Exception as e:
+            logger.error(f"Error loading data from {self.data_file}: {e}")
+            return {}
+
+    def _source_id(self) -> str:
+        try:
+            stat = Path(self.data_file).stat()
+            return f"{stat.st_mtime_ns}-{stat.st_size}"
+        except OSError:
+            return ""
+
+    def _build_snapshot(self) -> CBMASnapshot:
+        """Прочитать файл и опубликовать новый снимок (вызывается под _write_lock)"""
+        source = self._source_id()
+        raw_data = self._read_raw_data()
+        with span("cbma.parse_items"):
+            items = self.parse_items(raw_data, use_finance=False) if raw_data else []
+        self._version += 1
+        snapshot = CBMASnapshot.from_items(self._version, items, source)
+        self._snapshot = snapshot
+        return snapshot
+
+    def snapshot(self) -> CBMASnapshot:
+        """Текущий снимок данных (загружается при первом обращении)"""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._write_lock:
+            # Пока ждали блокировку, снимок мог собрать другой поток
+            if self._snapshot is None:
+                return self._build_snapshot()
+            return self._snapshot
+
+    def loaded_snapshot(self) -> Optional[CBMASnapshot]:
+        """Текущий снимок, если он уже загружен (файл не читается)"""
+        return self._snapshot
 
     def load_raw_data(self) -> Dict:
-        """Загрузить сырые данные из JSON файла"""
-        if self._raw_data is None:
-            try:
-                with open(self.data_file, "r", encoding="utf-8") as f:
-                    self._raw_data = json.load(f)
-                logger.info(f"Loaded {len(self._raw_data)} raw data points")
-            except Exception as e:
-                logger.error(f"Error loading data from {self.data_file}: {e}")
-                self._raw_data = {}
-
-        return self._raw_data
+        """Прочитать сырые данные из JSON файла (снимок их не хранит)"""
+        return self._read_raw_data()
 
-    def parse_date(self, date_str: str) -> Optional[datetime]:
-        """Парсинг даты из строки (встроенная реализация)"""
-        formats = [
-            "%Y-%m-%d",
-            "%Y-%m-%dT%H:%M:%S",
-            "%Y-%m-%dT%H:%M:%SZ",
-            "%Y-%m-%d %H:%M:%S",
-            "%d.%m.%Y",
-            "%d/%m/%Y",
-            "%a, %b %d, %y",  # Поддержка формата "Fri, Jul 4, 25"
-            "%A, %B %d, %Y",  # Поддержка формата "Friday, July 4, 2025"
-        ]
+    def reload_if_changed(self) -> bool:
+        """Заменить снимок, если файл данных изменился (проверка - один stat)"""
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.source == self._source_id():
+            return False
+        self.reload()
+        logger.info(f"Reloaded {self.data_file}: snapshot v{self._snapshot.version}")
+        return True
 
-        for fmt in formats:
-            try:
-                parsed = datetime.strptime(date_str, fmt)
-                # Если год меньше 100, добавляем 2000 (для формата %y)
-                if parsed.year < 100:
-                    parsed = parsed.replace(year=parsed.year + 2000)
-                return parsed
-            except ValueError:
-                continue
+    def reload(self) -> CBMASnapshot:
+        """Перечитать файл и заменить снимок; текущие читатели дорабатывают со старым"""
+        with self._write_lock:
+            return self._build_snapshot()
 
-        return None
+    def parse_date(self, date_str: str) -> Optional[datetime]:
+        """Парсинг даты из строки (встроенная реализация)"""
+        return _parse_date(date_str)
 
     def calculate_moving_average(
         self, values: List[float], period: int = 14
@@ -75,21 +276,9 @@ class CBMACalculator:
         Returns:
             Список значений скользящей средней
         """
-        if not values or len(values) < period:
-            return []
-
-        # Оптимизированный алгоритм SMA с скользящим окном
-        result = []
-        window_sum = sum(values[:period])
-        result.append(window_sum / period)
-
-        # Скользящее окно для остальных значений
-        for i in range(period, len(values)):
-            window_sum = window_sum - values[i - period] + values[i]
-            result.append(window_sum / period)
-
-        return result
+        return moving_average(values, period)
 
+    @traced("cbma.process_data")
     def process_data(
         self, use_finance: bool = False, ma_period: int = 14
     ) -> List[Dict]:
@@ -103,10 +292,29 @@ class CBMACalculator:
         Returns:
             Список обработанных данных с CBMA
         """
-        raw_data = self.load_raw_data()
-        if not raw_data:
-            return []
+        if use_finance:
+            raw_data = self._read_raw_data()
+            if not raw_data:
+                return []
+            sorted_items = self.parse_items(raw_data, use_finance=True)
+            result = self.build_cbma(sorted_items, ma_period=ma_period)
+        else:
+            result = self.snapshot().series(ma_period).rows()
+
+        logger.debug("Calculated CBMA for %d data points", len(result))
+        return result
+
+    def parse_items(self, raw_data: Dict, use_finance: bool = False) -> List[Dict]:
+        """
+        Разобрать сырые данные в отсортированный по дате список точек
+
+        Args:
+            raw_data: Содержимое data.json
+            use_finance: Использовать Finance или Overall данные (только старый формат)
 
+        Returns:
+            Список точек {date, date_str, value, timestamp}
+        """
         # Проверяем новый формат данных с массивом data
         if "data" in raw_data and isinstance(raw_data["data"], list):
             # Новый формат с массивом data
@@ -148,12 +356,17 @@ class CBMACalculator:
         sorted_items.sort(key=lambda x: x["date"])
 
         if sorted_items:
-            logger.info(
-                f"Sorted {len(sorted_items)} data points from {sorted_items[0]['date_str']} to {sorted_items[-1]['date_str']}"
+            logger.debug(
+                "Sorted %d data points from %s to %s",
+                len(sorted_items), sorted_items[0]["date_str"], sorted_items[-1]["date_str"],
             )
         else:
-            logger.info("Sorted 0 data points from N/A to N/A")
+            logger.debug("Sorted 0 data points from N/A to N/A")
 
+        return sorted_items
+
+    def build_cbma(self, sorted_items: List[Dict], ma_period: int = 14) -> List[Dict]:
+        """Рассчитать CBMA для отсортированных точек"""
         # Извлекаем значения для расчета MA
         values = [item["value"] for item in sorted_items]
 
@@ -177,10 +390,54 @@ class CBMACalculator:
                     }
                 )
 
-        logger.info(f"Calculated CBMA for {len(result)} data points")
-        self._processed_data = result
         return result
 
+    def extend_cbma(
+        self,
+        sorted_items: List[Dict],
+        previous_result: List[Dict],
+        previous_count: int,
+        ma_period: int = 14,
+    ) -> List[Dict]:
+        """
+        Досчитать CBMA только для точек, добавленных в конец ряда
+
+        Args:
+            sorted_items: Все точки (первые previous_count совпадают с прошлой сборкой)
+            previous_result: Результат прошлой сборки
+            previous_count: Сколько точек было в прошлой сборке
+            ma_period: Период скользящей средней
+
+        Returns:
+            Полный список CBMA (прошлый результат + новые точки)
+        """
+        if previous_count < ma_period:
+            return self.build_cbma(sorted_items, ma_period=ma_period)
+
+        new_count = len(sorted_items) - previous_count
+        if new_count <= 0:
+            return list(previous_result)
+
+        # Окно MA для новых точек захватывает (period - 1) предыдущих значений
+        start = previous_count - (ma_period - 1)
+        values = [item["value"] for item in sorted_items[start:]]
+        ma_values = self.calculate_moving_average(values, period=ma_period)
+
+        result = list(previous_result)
+        for item, ma_value in zip(sorted_items[previous_count:], ma_values):
+            result.append(
+                {
+                    "date": item["date_str"],
+                    "timestamp": item["timestamp"],
+                    "original_value": item["value"],
+                    "cbma": round(ma_value, 2),
+                }
+            )
+
+        logger.info(f"Extended CBMA with {new_count} new data points")
+        return result
+
+    @traced("cbma.get_history")
     def get_cbma_history(
         self, from_timestamp: int = 0, to_timestamp: int = None, ma_period: int = 14
     ) -> List[Dict]:
@@ -195,59 +452,44 @@ class CBMACalculator:
         Returns:
             Отфильтрованные данные CBMA
         """
-        if (
-            self._processed_data is None
-            or getattr(self, "_last_ma_period", None) != ma_period
-        ):
-            self._processed_data = self.process_data(ma_period=ma_period)
-            self._last_ma_period = ma_period
-
         if to_timestamp is None:
             to_timestamp = int(datetime.now().timestamp())
 
-        filtered_data = []
-        for item in self._processed_data:
-            if from_timestamp <= item["timestamp"] <= to_timestamp:
-                filtered_data.append(item)
+        series = self.snapshot().series(ma_period)
+        start = int(np.searchsorted(series.times, from_timestamp, side="left"))
+        end = int(np.searchsorted(series.times, to_timestamp, side="right"))
+        return series.rows(start, end)
 
-        return filtered_data
+    def _default_series(self) -> CBMASeries:
+        return self.snapshot().series(14)
 
     def get_latest_cbma(self) -> Optional[Dict]:
         """Получить последнее значение CBMA"""
-        if self._processed_data is None:
-            self.process_data()
-
-        return self._processed_data[-1] if self._processed_data else None
+        series = self._default_series()
+        return series.row(-1) if len(series) else None
 
     def get_statistics(self) -> Dict:
         """Получить статистику по данным"""
-        if self._processed_data is None:
-            self.process_data()
-
-        if not self._processed_data:
+        series = self._default_series()
+        if not len(series):
             return {}
 
-        cbma_values = [item["cbma"] for item in self._processed_data]
-        original_values = [item["original_value"] for item in self._processed_data]
+        def describe(values: np.ndarray) -> Dict[str, float]:
+            return {
+                "min": float(values.min()),
+                "max": float(values.max()),
+                "avg": float(values.mean()),
+                "latest": float(values[-1]),
+            }
 
         return {
-            "total_points": len(self._processed_data),
+            "total_points": len(series),
             "date_range": {
-                "from": self._processed_data[0]["date"],
-                "to": self._processed_data[-1]["date"],
-            },
-            "cbma": {
-                "min": min(cbma_values),
-                "max": max(cbma_values),
-                "avg": sum(cbma_values) / len(cbma_values),
-                "latest": cbma_values[-1],
-            },
-            "original": {
-                "min": min(original_values),
-                "max": max(original_values),
-                "avg": sum(original_values) / len(original_values),
-                "latest": original_values[-1],
+                "from": str(series.dates[0]),
+                "to": str(series.dates[-1]),
             },
+            "cbma": describe(series.cbma),
+            "original": describe(series.original),
         }
 
     def export_to_json(self, output_file: Path) -> bool:
@@ -260,23 +502,16 @@ class CBMACalculator:
         Returns:
             True если успешно, False если ошибка
         """
-        if self._processed_data is None:
-            self.process_data()
-
         try:
             # Преобразуем в формат для UDF сервера
-            udf_format = []
-            for item in self._processed_data:
-                udf_format.append(
-                    {
-                        "time": item["timestamp"],
-                        "value": item["cbma"],
-                        "date": item["date"],
-                    }
-                )
-
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(udf_format, f, indent=2, ensure_ascii=False)
+            udf_format = [
+                {"time": item["timestamp"], "value": item["cbma"], "date": item["date"]}
+                for item in self._default_series().rows()
+            ]
+
+            # Атомарная запись вместе со сжатыми копиями для nginx gzip_static
+            entry = publish_artifact(output_file, dump_json_bytes(udf_format))
+            update_manifest(Path(output_file).parent, {entry["file"]: entry})
 
             logger.info(f"Exported {len(udf_format)} CBMA data points to {output_file}")
             return True
@@ -0,0 +1,129 @@
+"""
+Матрица вариантов CBMA: период MA x сглаживание x разрешение
+"""
+import itertools
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .cbma_calculator import moving_average
+from .resample import resample_ohlcv
+from .tracing import span
+
+# Каталог артефактов матрицы относительно каталога данных
+MATRIX_DIR = "cbma"
+
+VARIANT_FILE_RE = re.compile(r"^CBMA_ma(\d+)_([DWM])(_smooth)?\.json$")
+
+
+@dataclass(frozen=True)
+class Variant:
+    """Один вариант индекса в матрице сборки"""
+
+    ma_period: int
+    smoothing: bool
+    resolution: str
+
+    @property
+    def name(self) -> str:
+        suffix = "_smooth" if self.smoothing else ""
+        return f"CBMA_ma{self.ma_period}_{self.resolution}{suffix}"
+
+    @property
+    def file_name(self) -> str:
+        return f"{self.name}.json"
+
+    @classmethod
+    def from_file_name(cls, file_name: str) -> Optional["Variant"]:
+        """Вариант по имени артефакта (None - не артефакт матрицы)"""
+        match = VARIANT_FILE_RE.match(file_name)
+        if not match:
+            return None
+        return cls(int(match[1]), bool(match[3]), match[2])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ma_period": self.ma_period,
+            "smoothing": self.smoothing,
+            "resolution": self.resolution,
+        }
+
+
+def matrix_variants(
+    ma_periods: Iterable[int], smoothing: Iterable[bool], resolutions: Iterable[str]
+) -> List[Variant]:
+    """Все сочетания периодов, сглаживания и разрешений"""
+    return [
+        Variant(period, smooth, resolution)
+        for period, smooth, resolution in itertools.product(
+            ma_periods, smoothing, resolutions
+        )
+    ]
+
+
+def smooth_values(values: Sequence[float]) -> List[float]:
+    """3-точечное скользящее среднее; крайние точки не сглаживаются"""
+    if len(values) < 3:
+        return list(values)
+
+    result = [values[0]]
+    for i in range(1, len(values) - 1):
+        result.append((values[i - 1] + values[i] + values[i + 1]) / 3)
+    result.append(values[-1])
+    return result
+
+
+def compute_variant(
+    times: Sequence[int], values: Sequence[float], variant: Variant
+) -> Dict[str, Any]:
+    """
+    Рассчитать вариант индекса из отсортированного ряда исходных значений
+
+    Функция без состояния, поэтому варианты можно считать в отдельных процессах.
+
+    Returns:
+        Ответ history в формате UDF (весь ряд)
+    """
+    period = variant.ma_period
+    with span("cbma.moving_average"):
+        cbma = [round(value, 2) for value in moving_average(list(values), period)]
+    if not cbma:
+        return {"s": "no_data"}
+
+    if variant.smoothing:
+        with span("cbma.smoothing"):
+            cbma = smooth_values(cbma)
+
+    t = np.asarray(times[period - 1:], dtype=np.int64)
+    c = np.round(np.asarray(cbma, dtype=np.float64), 2)
+
+    if variant.resolution == "D":
+        # Вход уже дневной - метки времени оставляем как в CBMA.json
+        columns = (t, c, c, c, c)
+    else:
+        with span("resample"):
+            t, o, h, l, c, _ = resample_ohlcv(
+                t, c, c, c, c, np.zeros(len(c)), variant.resolution
+            )
+        columns = (t, o, h, l, c)
+
+    t, o, h, l, c = (column.tolist() for column in columns)
+    return {"s": "ok", "t": t, "o": o, "h": h, "l": l, "c": c, "v": [0] * len(t)}
+
+
+def compact_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Ответ UDF со списками -> те же колонки в массивах numpy
+
+    Вместо тысяч объектов float на точку - несколько непрерывных буферов:
+    после fork воркеры читают их, не трогая счетчики ссылок каждой точки.
+    """
+    if payload.get("s") != "ok":
+        return payload
+    compact = {"s": "ok", "t": np.asarray(payload.get("t") or [], dtype=np.int64)}
+    for name in ("o", "h", "l", "c", "v"):
+        if payload.get(name) is not None:
+            compact[name] = np.asarray(payload[name], dtype=np.float64)
+    return compact
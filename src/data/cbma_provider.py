@@ -1,11 +1,20 @@
 """
 CBMA Provider - провайдер данных индекса CBMA
 """
+import json
 import logging
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Sequence, Tuple
 
+import numpy as np
+
+from .cache_backend import CacheBackend, pack_json, unpack_json
+from .candles import COLUMNS, CandleSeries
 from .cbma_calculator import CBMACalculator
+from .cbma_matrix import MATRIX_DIR, Variant, compact_payload, compute_variant
+from .resample import DAY, RESOLUTIONS, parse_resolution
+from .resolution_engine import ResolutionEngine
+from .tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -13,8 +22,21 @@ logger = logging.getLogger(__name__)
 class CBMAProvider:
     """Провайдер данных CBMA индекса"""
 
-    def __init__(self, data_file: Path):
+    # Сколько хранить в общем кэше варианты, рассчитанные на лету
+    SHARED_TTL = 86400
+
+    def __init__(
+        self,
+        data_file: Path,
+        shared: Optional[CacheBackend] = None,
+        ma_periods: Optional[Sequence[int]] = None,
+    ):
         self.data_file = data_file
+        # Допустимые периоды MA (None - любой): каждый новый период - расчет
+        # и запись в кэш, поэтому сервер ограничивает их периодами матрицы
+        self.ma_periods = tuple(sorted(ma_periods)) if ma_periods else None
+        # Общий кэш: вариант, рассчитанный одним воркером, берут остальные
+        self.shared = shared
         # Определяем путь к исходным данным (data.json)
         # Пытаемся найти data.json в той же папке, что и CBMA.json
         if data_file.parent.exists():
@@ -24,7 +46,19 @@ class CBMAProvider:
             self.raw_data_file = Path("/app/data/data.json")
 
         self.calculator = CBMACalculator(self.raw_data_file)
+        self.matrix_dir = self.raw_data_file.parent / MATRIX_DIR
+        # Прочитанные артефакты матрицы: variant -> (mtime_ns, payload).
+        # Записи только заменяются целиком (payload после чтения не меняется),
+        # поэтому потоки читают словарь без блокировки
+        self._artifacts: Dict[Variant, Tuple[int, Dict[str, Any]]] = {}
         self._symbol_info = None
+        # Прочие разрешения (3D, 2W, 3M) - свертка дневного варианта;
+        # "символ" движка - имя дневного варианта
+        self.engine = ResolutionEngine(self._daily_series, {"D": DAY})
+        # Серия дневного варианта на каждый payload (один объект - кэш движка попадает)
+        self._series: Dict[Variant, Tuple[Dict[str, Any], CandleSeries]] = {}
+        # Откуда берутся варианты: память, файл, общий кэш или расчет
+        self.stats = {"artifact_hits": 0, "artifact_loads": 0, "shared_hits": 0, "calculated": 0}
 
     def get_symbol_info(self, symbol: str) -> Optional[Dict[str, Any]]:
         """Получить информацию о символе"""
@@ -41,17 +75,137 @@ class CBMAProvider:
                 "timezone": "Etc/UTC",
                 "minmov": 1,
                 "pricescale": 100,
-                "supported_resolutions": ["D"],
+                "supported_resolutions": ["D", "W", "M"],
                 "has_intraday": False,
                 "has_daily": True,
-                "has_weekly_and_monthly": False,
+                "has_weekly_and_monthly": True,
                 "currency_code": "USD",
             }
 
         return self._symbol_info
 
+    def _load_artifact(self, variant: Variant) -> Optional[Dict[str, Any]]:
+        """Прочитать готовый вариант из data/cbma/ (перечитывается при смене mtime)"""
+        path = self.matrix_dir / variant.file_name
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+        cached = self._artifacts.get(variant)
+        if cached is not None and cached[0] == mtime_ns:
+            self.stats["artifact_hits"] += 1
+            return cached[1]
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = compact_payload(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cannot read CBMA artifact {path}: {e}")
+            return None
+
+        self._artifacts[variant] = (mtime_ns, payload)
+        self.stats["artifact_loads"] += 1
+        return payload
+
+    def preload(self) -> Dict[str, Any]:
+        """
+        Загрузить все данные заранее (в мастере gunicorn перед fork)
+
+        Снимок исходных данных и все артефакты матрицы читаются один раз и
+        хранятся в массивах numpy, так что воркеры делят эти страницы памяти.
+
+        Returns:
+            Сводка: сколько вариантов и точек загружено
+        """
+        snapshot = self.calculator.snapshot()
+        loaded = 0
+        for path in sorted(self.matrix_dir.glob("CBMA_*.json")):
+            variant = Variant.from_file_name(path.name)
+            if variant is not None and self._load_artifact(variant) is not None:
+                loaded += 1
+        summary = {"points": len(snapshot), "variants": loaded}
+        logger.info(f"CBMA preloaded: {summary['points']} points, {loaded} variants")
+        return summary
+
+    def _calculate_variant(self, variant: Variant) -> Dict[str, Any]:
+        """Расчет варианта на лету, если builder его не собрал (запоминается в снимке)"""
+        snapshot = self.calculator.snapshot()
+        shared_key = f"cbma:{snapshot.source}:{variant.name}" if snapshot.source else None
+
+        def compute():
+            if self.shared is not None and shared_key:
+                data = self.shared.get(shared_key)
+                if data is not None:
+                    try:
+                        payload = compact_payload(unpack_json(data))
+                        self.stats["shared_hits"] += 1
+                        return payload
+                    except ValueError as e:
+                        logger.warning("Corrupted shared CBMA variant %s: %s", shared_key, e)
+
+            logger.info("CBMA artifact %s not found, calculating", variant.file_name)
+            self.stats["calculated"] += 1
+            payload = compute_variant(
+                snapshot.times.tolist(), snapshot.values.tolist(), variant
+            )
+            if self.shared is not None and shared_key:
+                self.shared.set(shared_key, pack_json(payload), ttl=self.SHARED_TTL)
+            return compact_payload(payload)
+
+        return snapshot.memoize(("variant", variant), compute)
+
+    def _variant_payload(self, variant: Variant) -> Dict[str, Any]:
+        """Вариант из артефакта builder'а или рассчитанный на лету"""
+        with span("cbma.artifact"):
+            payload = self._load_artifact(variant)
+        if payload is None:
+            with span("cbma.variant"):
+                payload = self._calculate_variant(variant)
+        return payload
+
+    def _daily_series(self, name: str, interval: str) -> Optional[CandleSeries]:
+        """Источник движка разрешений: дневной вариант по имени"""
+        variant = Variant.from_file_name(f"{name}.json")
+        payload = self._variant_payload(variant)
+        if payload.get("s") != "ok" or not len(payload.get("t", ())):
+            return None
+        cached = self._series.get(variant)
+        if cached is not None and cached[0] is payload:
+            return cached[1]
+        t = payload["t"]
+        series = CandleSeries(
+            *(payload[column] if column in payload else np.zeros(len(t)) for column in COLUMNS)
+        )
+        self._series[variant] = (payload, series)
+        return series
+
+    def is_memoized(self, ma_period: int, resolution: str, smoothing: bool = True) -> bool:
+        """
+        Ответ get_history собирается из памяти: снимок загружен, вариант уже
+        прочитан или рассчитан, а бары разрешения уже свернуты
+        """
+        snapshot = self.calculator.loaded_snapshot()
+        if snapshot is None:
+            return False
+        try:
+            parsed = parse_resolution(resolution)
+        except ValueError:
+            return True
+        native = parsed.count == 1 and parsed.unit in RESOLUTIONS
+        variant = Variant(ma_period, smoothing, parsed.unit if native else "D")
+        if variant not in self._artifacts and not snapshot.is_memoized(("variant", variant)):
+            return False
+        return native or self.engine.is_cached(variant.name, parsed)
+
     def get_history(
-        self, symbol: str, from_timestamp: int, to_timestamp: int, ma_period: int = 14
+        self,
+        symbol: str,
+        from_timestamp: int,
+        to_timestamp: int,
+        ma_period: int = 14,
+        resolution: str = "D",
+        smoothing: bool = True,
     ) -> Dict[str, Any]:
         """
         Получить историю котировок CBMA
@@ -60,89 +214,58 @@ class CBMAProvider:
             symbol: Символ (должен быть CBMA)
             from_timestamp: Начальная временная метка
             to_timestamp: Конечная временная метка
-            ma_period: Период для скользящей средней (7, 14, 30)
+            ma_period: Период для скользящей средней (один из ma_periods)
+            resolution: Разрешение TradingView (1D, 1W, 1M готовые; 3D, 2W, 3M
+                сворачиваются из дневного варианта; внутридневных нет)
+            smoothing: 3-точечное сглаживание для устранения резких скачков
 
         Returns:
             Данные в формате UDF
         """
         if symbol != "CBMA":
             return {"s": "error", "errmsg": f"Unknown symbol: {symbol}"}
+        if ma_period < 1 or (self.ma_periods and ma_period not in self.ma_periods):
+            available = ", ".join(map(str, self.ma_periods or ()))
+            errmsg = f"Invalid ma_period: {ma_period}"
+            return {"s": "error", "errmsg": f"{errmsg} (available: {available})" if available else errmsg}
 
         try:
-            logger.info(
-                f"Getting CBMA history: from={from_timestamp}, to={to_timestamp}, ma_period={ma_period}"
-            )
-
-            # ВСЕГДА используем калькулятор для динамического расчета MA с нужным
-            # периодом
-            logger.info(
-                f"Calculating CBMA data dynamically with MA period {ma_period}..."
-            )
-            history_data = self.calculator.get_cbma_history(
-                from_timestamp, to_timestamp, ma_period
-            )
+            parsed = parse_resolution(resolution)
+        except ValueError as e:
+            return {"s": "error", "errmsg": str(e)}
 
-            if not history_data:
-                logger.warning("No CBMA history data returned from calculator")
+        try:
+            if parsed.count == 1 and parsed.unit in RESOLUTIONS:
+                # Варианты матрицы собирает builder, здесь только чтение
+                variant = Variant(ma_period, smoothing, parsed.unit)
+                payload = self._variant_payload(variant)
+            else:
+                variant = Variant(ma_period, smoothing, "D")
+                try:
+                    candles = self.engine.get(variant.name, parsed)
+                except ValueError:
+                    return {"s": "error", "errmsg": f"Resolution {parsed} is not available for CBMA"}
+                if candles is None:
+                    return {"s": "no_data"}
+                payload = {"s": "ok", **{name: getattr(candles, name) for name in COLUMNS}}
+
+            times = payload.get("t")
+            if payload.get("s") != "ok" or times is None or not len(times):
                 return {"s": "no_data"}
 
-            logger.info(f"Got {len(history_data)} CBMA data points from calculator")
-
-            # Преобразуем в формат UDF с сглаживанием для устранения резких скачков
-            times = []
-            raw_values = []
-
-            # Сначала собираем все исходные значения
-            for i, item in enumerate(history_data):
-                try:
-                    if (
-                        isinstance(item, dict)
-                        and "timestamp" in item
-                        and "cbma" in item
-                    ):
-                        times.append(int(item["timestamp"]))
-                        raw_values.append(float(item["cbma"]))
-                    else:
-                        logger.warning(f"Invalid CBMA data item at index {i}: {item}")
-                except (KeyError, TypeError, ValueError) as e:
-                    logger.warning(f"Error processing CBMA item at index {i}: {e}")
-                    continue
-
-            if not times:
-                logger.warning("No valid CBMA data after processing")
+            start = int(np.searchsorted(times, from_timestamp, side="left"))
+            end = int(np.searchsorted(times, to_timestamp, side="right"))
+            if start >= end:
                 return {"s": "no_data"}
 
-            # Применяем простое сглаживание (3-точечное скользящее среднее)
-            smoothed_values = []
-            for i in range(len(raw_values)):
-                if i == 0:
-                    # Первая точка - без сглаживания
-                    smoothed_values.append(raw_values[i])
-                elif i == len(raw_values) - 1:
-                    # Последняя точка - без сглаживания
-                    smoothed_values.append(raw_values[i])
-                else:
-                    # Средние точки - среднее из 3 точек
-                    smoothed = (
-                        raw_values[i - 1] + raw_values[i] + raw_values[i + 1]
-                    ) / 3
-                    smoothed_values.append(smoothed)
-
-            logger.info(f"Applied smoothing to {len(smoothed_values)} CBMA values")
-
-            result = {
-                "s": "ok",
-                "t": times,
-                # close values (для линейного графика используем только close)
-                "c": smoothed_values,
-                "o": smoothed_values,  # open = close
-                "h": smoothed_values,  # high = close
-                "l": smoothed_values,  # low = close
-                "v": [0] * len(smoothed_values),  # volume = 0
-            }
+            # Срезы массивов - без копирования данных
+            result = {"s": "ok"}
+            for key in COLUMNS:
+                result[key] = payload[key][start:end]
 
-            logger.info(
-                f"Returned {len(times)} valid CBMA data points for period {from_timestamp}-{to_timestamp}"
+            logger.debug(
+                "Returned %d CBMA points (%s, %s) for period %s-%s",
+                end - start, variant.name, parsed, from_timestamp, to_timestamp,
             )
             return result
 
@@ -197,7 +320,8 @@ class CBMAProvider:
     def refresh_data(self) -> bool:
         """Обновить данные CBMA"""
         try:
-            # Пересчитываем данные
+            # Новый снимок заменяет старый целиком (вместе с рассчитанными вариантами)
+            self.calculator.reload()
             processed_data = self.calculator.process_data(use_finance=False)
 
             if processed_data:
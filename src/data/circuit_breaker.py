@@ -0,0 +1,141 @@
+"""
+Circuit breaker для внешних API
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+
+class CircuitBreaker:
+    """
+    Автомат closed → open → half_open
+
+    После failure_threshold подряд неудачных запросов цепь размыкается и
+    запросы не выполняются reset_timeout секунд. Затем пропускается один
+    пробный запрос: успех замыкает цепь, ошибка снова размыкает ее.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow_request(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+
+            # half_open: пропускаем только один пробный запрос
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        """Запрос выполнен успешно"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """
+        Запрос завершился без результата (отмена, неожиданное исключение)
+
+        Пробный запрос half_open освобождается, иначе цепь больше не
+        пропустила бы ни одного запроса. Вызывается в finally после
+        record_success/record_failure - тогда ничего не меняет.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """Запрос завершился ошибкой"""
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Состояние для /api/status"""
+        with self._lock:
+            return {"state": self._state, "failures": self._failures}
+
+
+class CircuitBreakerRegistry:
+    """
+    Набор circuit breaker'ов по ключу (например, endpoint + символ)
+
+    Ключи приходят из запросов (любой символ), поэтому хранится не больше
+    max_entries breaker'ов: при переполнении удаляется давно не
+    использованный замкнутый (разомкнутые удаляются, только если других нет).
+    """
+
+    def __init__(
+        self, failure_threshold: int = 3, reset_timeout: float = 30.0, max_entries: int = 1024
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._breakers: "OrderedDict[Hashable, CircuitBreaker]" = OrderedDict()
+
+    def get(self, key: Hashable) -> CircuitBreaker:
+        """Получить (или создать) breaker для ключа"""
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is not None:
+                self._breakers.move_to_end(key)
+                return breaker
+            breaker = self._breakers[key] = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout
+            )
+            if len(self._breakers) > self.max_entries:
+                self._evict()
+        return breaker
+
+    def _evict(self):
+        for key, breaker in self._breakers.items():
+            if breaker.state == CircuitBreaker.CLOSED:
+                del self._breakers[key]
+                return
+        self._breakers.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._breakers)
+
+    def open_circuits(self) -> Dict[str, Dict[str, Any]]:
+        """Разомкнутые и полуоткрытые цепи"""
+        with self._lock:
+            breakers = dict(self._breakers)
+        result = {}
+        for key, breaker in breakers.items():
+            info = breaker.to_dict()
+            if info["state"] != CircuitBreaker.CLOSED:
+                name = ":".join(map(str, key)) if isinstance(key, tuple) else str(key)
+                result[name] = info
+        return result
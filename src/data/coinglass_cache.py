@@ -0,0 +1,403 @@
+"""
+Кэширующий слой над Coinglass API: stale-while-revalidate и single-flight
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .cache_backend import CacheBackend, pack_series, unpack_series
+from .candle_store import CandleStore
+from .candles import CandleSeries, extend_history
+from .coinglass_client import CoinglassClient, normalize_symbol
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """Выполняющийся запрос, которого ждут остальные вызывающие"""
+
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных вызовов в один"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        """Выполняется ли сейчас вызов с этим ключом"""
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Выполнить fn один раз для всех одновременных вызовов с одинаковым ключом
+
+        Returns:
+            Результат fn (общий для всех ожидающих)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class CachedCoinglassClient:
+    """CoinglassClient с кэшем свечей по интервалам"""
+
+    # Сколько секунд данные считаются свежими для каждого интервала
+    INTERVAL_TTL = {
+        "1m": 30,
+        "3m": 60,
+        "5m": 60,
+        "15m": 120,
+        "30m": 300,
+        "1h": 300,
+        "4h": 600,
+        "6h": 900,
+        "8h": 900,
+        "12h": 1200,
+        "1d": 1800,
+        "1w": 3600,
+    }
+    DEFAULT_TTL = 300
+
+    def __init__(
+        self,
+        client: CoinglassClient,
+        stale_ttl: int = 3600,
+        max_entries: int = 256,
+        store: Optional[CandleStore] = None,
+        shared: Optional[CacheBackend] = None,
+    ):
+        self.client = client
+        self.store = store  # история из backfill, дополняет окно API
+        # Общий кэш воркеров/реплик: второй уровень после локального LRU
+        self.shared = shared
+        self.stale_ttl = stale_ttl  # сколько ещё можно отдавать устаревшие данные
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Tuple[CandleSeries, float]]" = OrderedDict()
+        self._flight = SingleFlight()
+        # Загрузки асинхронного пути (ASGI): ключ -> задача в event loop
+        self._async_calls: Dict[Tuple, "asyncio.Future"] = {}
+
+        self.stats = {
+            "hits": 0,
+            "stale": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "degraded": 0,
+            "shared_hits": 0,
+        }
+
+    def __getattr__(self, name: str) -> Any:
+        # Остальные методы (get_available_symbols, search_symbols, ...) без кэша
+        return getattr(self.client, name)
+
+    def ttl_for(self, interval: str) -> int:
+        """TTL свежести для интервала"""
+        return self.INTERVAL_TTL.get(interval, self.DEFAULT_TTL)
+
+    @staticmethod
+    def _shared_key(key: Tuple) -> str:
+        symbol, interval, from_ts, to_ts = key
+        return f"coinglass:{symbol}:{interval}:{from_ts or ''}:{to_ts or ''}"
+
+    def _get_local(self, key: Tuple) -> Optional[Tuple[CandleSeries, float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _get_entry(self, key: Tuple) -> Optional[Tuple[CandleSeries, float]]:
+        entry = self._get_local(key)
+        if entry is not None:
+            return entry
+        return self._get_shared(key)
+
+    def _get_shared(
+        self, key: Tuple, newer_than: float = 0.0
+    ) -> Optional[Tuple[CandleSeries, float]]:
+        """Свечи из общего кэша (загруженные другим воркером или ведущим)"""
+        if self.shared is None:
+            return None
+        data = self.shared.get(self._shared_key(key))
+        if data is None:
+            return None
+        try:
+            entry = unpack_series(data)
+        except Exception as e:
+            logger.warning("Corrupted shared cache entry for %s: %s", key, e)
+            return None
+        if entry[1] <= newer_than:
+            return None
+
+        # Сохраняем локально с исходным временем загрузки
+        self._store(key, *entry, publish=False)
+        return entry
+
+    def _store(
+        self,
+        key: Tuple,
+        candles: CandleSeries,
+        fetched_at: Optional[float] = None,
+        publish: bool = True,
+    ):
+        if fetched_at is None:
+            fetched_at = time.time()
+        with self._lock:
+            self._entries[key] = (candles, fetched_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        if publish and self.shared is not None:
+            self.shared.set(
+                self._shared_key(key),
+                pack_series(candles, fetched_at),
+                ttl=self.ttl_for(key[1]) + self.stale_ttl,
+            )
+
+    def cached_intervals(self, symbol: str) -> List[str]:
+        """Интервалы полной истории symbol, которые можно отдать без запроса к API"""
+        symbol = symbol.upper()
+        now = time.time()
+        with self._lock:
+            return [
+                key[1]
+                for key, (_, fetched_at) in self._entries.items()
+                if key[0] == symbol
+                and key[2] is None
+                and key[3] is None
+                and now - fetched_at < self.ttl_for(key[1]) + self.stale_ttl
+            ]
+
+    def _fetch(
+        self,
+        symbol: str,
+        days: int,
+        interval: str,
+        from_ts: int = None,
+        to_ts: int = None,
+    ) -> Optional[CandleSeries]:
+        """Запрос к API; полная история дополняется свечами из backfill"""
+        candles = self.client.get_crypto_candles(symbol, days, interval, from_ts, to_ts)
+        if candles and self.store is not None and from_ts is None:
+            history = self.store.load(normalize_symbol(symbol), interval)
+            candles = extend_history(history, candles)
+        return candles
+
+    def _load(self, key: Tuple, loader: Callable[[], Optional[CandleSeries]]):
+        """Загрузить данные из API и положить в кэш (вызывается под single-flight)"""
+        candles = loader()
+        if candles:
+            self._store(key, candles)
+        return candles
+
+    def _refresh_in_background(self, key: Tuple, loader: Callable):
+        """Запустить одно фоновое обновление для ключа"""
+        if self._flight.in_flight(key):
+            return
+
+        def refresh():
+            try:
+                self._flight.do(key, lambda: self._load(key, loader))
+            except Exception as e:
+                logger.warning(f"Background refresh failed for {key}: {e}")
+
+        self.stats["refreshes"] += 1
+        threading.Thread(target=refresh, name="coinglass-refresh", daemon=True).start()
+
+    def get_crypto_candles(
+        self,
+        symbol: str,
+        days: int = 365,
+        interval: str = "4h",
+        from_ts: int = None,
+        to_ts: int = None,
+    ) -> Optional[CandleSeries]:
+        """
+        Получить свечи из кэша или из API
+
+        Свежие данные отдаются сразу, устаревшие (в пределах stale_ttl) тоже
+        отдаются сразу, а обновление идет одним фоновым запросом. Одинаковые
+        одновременные промахи объединяются в один запрос к API. Если API
+        недоступен, отдаются просроченные данные из кэша (если есть).
+        """
+        # days не передается в API (глубину задает limit), поэтому в ключ не входит
+        key = (symbol.upper(), interval, from_ts, to_ts)
+
+        def loader():
+            return self._fetch(symbol, days, interval, from_ts, to_ts)
+
+        local = self._get_local(key)
+        entry = local if local is not None else self._get_shared(key)
+        if entry is not None:
+            candles, fetched_at = entry
+            age = time.time() - fetched_at
+            ttl = self.ttl_for(interval)
+            if age < ttl:
+                # hits - из памяти процесса, shared_hits - из общего кэша
+                self.stats["hits" if entry is local else "shared_hits"] += 1
+                return candles
+            if age < ttl + self.stale_ttl:
+                # Ведущий воркер мог уже обновить данные в общем кэше
+                shared = self._get_shared(key, newer_than=fetched_at)
+                if shared is not None and time.time() - shared[1] < ttl:
+                    self.stats["shared_hits"] += 1
+                    return shared[0]
+                self.stats["stale"] += 1
+                self._refresh_in_background(key, loader)
+                return candles
+
+        self.stats["misses"] += 1
+        candles = self._flight.do(key, lambda: self._load(key, loader))
+
+        # API недоступен - лучше отдать просроченные данные, чем ничего
+        if candles is None and entry is not None:
+            self.stats["degraded"] += 1
+            logger.warning("Serving expired candles for %s", key)
+            return entry[0]
+        return candles
+
+    async def get_crypto_candles_async(
+        self,
+        fetch: Callable[..., Awaitable[Optional[CandleSeries]]],
+        symbol: str,
+        days: int = 365,
+        interval: str = "4h",
+    ) -> Optional[CandleSeries]:
+        """
+        Асинхронный вариант get_crypto_candles (ASGI режим)
+
+        Кэш, статистика и фоновое обновление устаревших данных общие с
+        синхронным путем. При промахе свечи загружает корутина fetch
+        (AsyncCoinglassClient.get_crypto_candles), одинаковые одновременные
+        промахи ждут одну загрузку. Обращения к общему кэшу и к backfill на
+        диске уходят в пул потоков, чтобы не блокировать event loop.
+        """
+        key = (symbol.upper(), interval, None, None)
+
+        local = entry = self._get_local(key)
+        if entry is None and self.shared is not None:
+            entry = await asyncio.to_thread(self._get_shared, key)
+        if entry is not None:
+            candles, fetched_at = entry
+            age = time.time() - fetched_at
+            ttl = self.ttl_for(interval)
+            if age < ttl:
+                self.stats["hits" if entry is local else "shared_hits"] += 1
+                return candles
+            if age < ttl + self.stale_ttl:
+                self.stats["stale"] += 1
+                self._refresh_in_background(
+                    key, lambda: self._fetch(symbol, days, interval)
+                )
+                return candles
+
+        self.stats["misses"] += 1
+        task = self._async_calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._load_async(key, fetch, symbol, days, interval)
+            )
+            self._async_calls[key] = task
+            task.add_done_callback(lambda _: self._async_calls.pop(key, None))
+        # shield: отмена одного клиента не отменяет загрузку для остальных
+        candles = await asyncio.shield(task)
+
+        if candles is None and entry is not None:
+            self.stats["degraded"] += 1
+            logger.warning("Serving expired candles for %s", key)
+            return entry[0]
+        return candles
+
+    async def _load_async(
+        self,
+        key: Tuple,
+        fetch: Callable[..., Awaitable[Optional[CandleSeries]]],
+        symbol: str,
+        days: int,
+        interval: str,
+    ) -> Optional[CandleSeries]:
+        candles = await fetch(symbol, days, interval)
+        if candles and self.store is not None:
+            history = await asyncio.to_thread(
+                self.store.load, normalize_symbol(symbol), interval
+            )
+            candles = extend_history(history, candles)
+        if candles:
+            if self.shared is not None:
+                await asyncio.to_thread(self._store, key, candles)
+            else:
+                self._store(key, candles)
+        return candles
+
+    def refresh(self, symbol: str, interval: str, days: int = 365) -> bool:
+        """
+        Загрузить свечи из API, не дожидаясь истечения TTL (фоновая задача)
+
+        Обновляет только ключи, срок свежести которых прошел наполовину, чтобы
+        клиенты не видели устаревших данных, а API не получал лишних запросов.
+        """
+        key = (symbol.upper(), interval, None, None)
+        entry = self._get_entry(key)
+        if entry is not None and time.time() - entry[1] < self.ttl_for(interval) / 2:
+            return False
+
+        self.stats["refreshes"] += 1
+        return bool(
+            self._flight.do(
+                key, lambda: self._load(key, lambda: self._fetch(symbol, days, interval))
+            )
+        )
+
+    def get_crypto_ohlcv(
+        self,
+        symbol: str,
+        days: int = 365,
+        interval: str = "4h",
+        from_ts: int = None,
+        to_ts: int = None,
+    ) -> Optional[List[Dict]]:
+        """OHLCV данные в построчном формате (через кэш)"""
+        candles = self.get_crypto_candles(symbol, days, interval, from_ts, to_ts)
+        return candles.to_rows() if candles else None
+
+    def get_btc_ohlcv(
+        self, days: int = 365, interval: str = "4h"
+    ) -> Optional[List[Dict]]:
+        """OHLCV данные для BTC (обратная совместимость)"""
+        return self.get_crypto_ohlcv("BTCUSDT", days, interval)
@@ -2,19 +2,116 @@
 Coinglass API client for BTC data
 """
 import requests
+import threading
 import time
 import logging
+from collections import OrderedDict
 from typing import Dict, List, Optional, Any
 
 from config import config
+from .candles import CandleSeries, decode_candles
+from .circuit_breaker import CircuitBreaker, CircuitBreakerRegistry
+from .metrics import REGISTRY
+from .rate_limiter import RateLimiter, get_shared_rate_limiter
+from .tracing import span, traced
 
 logger = logging.getLogger(__name__)
 
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "udf_upstream_request_duration_seconds",
+    "Coinglass API request latency (without rate limiter wait)",
+    ("endpoint", "outcome"),
+)
+
+
+def upstream_outcome(status_code: Optional[int]) -> str:
+    """Метка исхода запроса: 2xx/4xx/5xx или error (нет ответа)"""
+    return f"{status_code // 100}xx" if status_code else "error"
+
+
+CANDLES_ENDPOINT = "/api/spot/price/history"
+CANDLES_LIMIT = 4500  # максимум свечей в одном ответе
+# Сколько ответов "нет данных" помнить (ключи приходят из запросов)
+NEGATIVE_CACHE_MAX_ENTRIES = 4096
+
+# Длительность интервалов Coinglass в секундах
+INTERVAL_SECONDS = {
+    "1m": 60,
+    "3m": 180,
+    "5m": 300,
+    "15m": 900,
+    "30m": 1800,
+    "1h": 3600,
+    "4h": 14400,
+    "6h": 21600,
+    "8h": 28800,
+    "12h": 43200,
+    "1d": 86400,
+    "1w": 604800,
+}
+
+
+class UpstreamError(Exception):
+    """Coinglass API недоступен или цепь разомкнута"""
+
+
+def is_upstream_failure(status_code: int) -> bool:
+    """Считается ли HTTP статус отказом API (для circuit breaker)"""
+    return status_code == 429 or status_code >= 500
+
+
+def unwrap_payload(data: Any) -> Optional[Any]:
+    """Достать полезные данные из ответа Coinglass"""
+    # Проверяем разные форматы ответа
+    if isinstance(data, list):
+        return data
+    elif not isinstance(data, dict):
+        # Строка, число или null вместо объекта - данных нет
+        logger.error("Unexpected Coinglass payload: %s", type(data).__name__)
+        return None
+    elif "data" in data:
+        return data["data"]
+    elif data.get("success") is False:
+        logger.error(f"API error: {data.get('msg', 'Unknown error')}")
+        return None
+    else:
+        return data
+
+
+def normalize_symbol(symbol: str) -> str:
+    """Привести символ к формату спот-пары Binance (ETHUSD -> ETHUSDT)"""
+    # Убеждаемся что символ в правильном формате
+    if not symbol.endswith("USDT"):
+        symbol = symbol.replace("USD", "USDT")
+    return symbol.upper()
+
+
+def build_candles_params(
+    symbol: str, interval: str, from_ts: int = None, to_ts: int = None
+) -> Dict[str, Any]:
+    """Параметры запроса свечей к spot API"""
+    params = {
+        "exchange": "Binance",
+        "symbol": normalize_symbol(symbol),
+        "interval": interval,
+        "limit": CANDLES_LIMIT,
+    }
+
+    # Если переданы from_ts/to_ts – используем их
+    if from_ts is not None:
+        params["start_time"] = from_ts * 1000
+    if to_ts is not None:
+        params["end_time"] = to_ts * 1000
+
+    return params
+
 
 class CoinglassClient:
     """Клиент для получения данных BTC через Coinglass API"""
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(
+        self, api_key: Optional[str] = None, rate_limiter: Optional[RateLimiter] = None
+    ):
         self.api_key = api_key or config.coinglass_api_key or ""
         self.base_url = config.coinglass_base_url
         self.request_delay = 0.5  # секунды между запросами
@@ -25,8 +122,22 @@ class CoinglassClient:
         if self.api_key:
             self.headers["CG-API-KEY"] = self.api_key
 
-        # Rate limiting
-        self.last_request_time = 0
+        # Rate limiting (общий для всех клиентов процесса, в т.ч. асинхронных)
+        self.rate_limiter = rate_limiter or get_shared_rate_limiter(
+            self.base_url, self.request_delay
+        )
+
+        # Таймауты и защита от каскадных задержек при недоступности API
+        self.connect_timeout = 5
+        self.timeout = config.upstream.timeout
+        self.breakers = CircuitBreakerRegistry(
+            failure_threshold=config.upstream.failure_threshold,
+            reset_timeout=config.upstream.reset_timeout,
+        )
+        self.negative_ttl = config.upstream.negative_ttl
+        # Ключ -> срок действия; TTL общий, поэтому порядок вставки - порядок истечения
+        self._negative_cache: "OrderedDict[tuple, float]" = OrderedDict()
+        self._negative_lock = threading.Lock()
 
         # Кэш для списка доступных символов
         self._symbols_cache = {
@@ -37,48 +148,107 @@ class CoinglassClient:
 
     def _wait_for_rate_limit(self):
         """Обеспечить соблюдение rate limit"""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
+        with span("coinglass.rate_limit"):
+            self.rate_limiter.wait()
 
-        if time_since_last < self.request_delay:
-            sleep_time = self.request_delay - time_since_last
-            logger.debug(f"Rate limiting: sleeping {sleep_time:.2f}s")
-            time.sleep(sleep_time)
+    @traced("coinglass.fetch")
+    def _fetch(self, endpoint: str, params: Optional[Dict] = None) -> Optional[Any]:
+        """
+        Выполнить запрос к API через circuit breaker
 
-    def _make_request(
-        self, endpoint: str, params: Optional[Dict] = None
+        Returns:
+            Данные ответа или None, если API ответил, но данных нет
+
+        Raises:
+            UpstreamError: таймаут, сетевая ошибка, HTTP 429/5xx или открытая цепь
+        """
+        symbol = (params or {}).get("symbol", "")
+        breaker = self.breakers.get((endpoint, symbol))
+        if not breaker.allow_request():
+            raise UpstreamError(f"Circuit open for {endpoint} {symbol}")
+        probe = breaker.state == CircuitBreaker.HALF_OPEN
+        try:
+            return self._fetch_allowed(endpoint, params, breaker)
+        finally:
+            if probe:
+                breaker.release_probe()
+
+    def _fetch_allowed(
+        self, endpoint: str, params: Optional[Dict], breaker: CircuitBreaker
     ) -> Optional[Any]:
-        """Выполнить запрос к API"""
         self._wait_for_rate_limit()
 
         url = f"{self.base_url}{endpoint}"
 
+        started = time.perf_counter()
         try:
             response = requests.get(
-                url, headers=self.headers, params=params, timeout=30
+                url,
+                headers=self.headers,
+                params=params,
+                timeout=(self.connect_timeout, self.timeout),
             )
-            self.last_request_time = time.time()
-
-            if response.status_code == 200:
-                data = response.json()
-                # Проверяем разные форматы ответа
-                if "data" in data:
-                    return data["data"]
-                elif isinstance(data, list):
-                    return data
-                elif data.get("success") is False:
-                    logger.error(f"API error: {data.get('msg', 'Unknown error')}")
-                    return None
-                else:
-                    return data
-            else:
-                logger.error(f"HTTP {response.status_code}: {response.text}")
-                return None
-
         except Exception as e:
-            logger.error(f"Request error: {e}")
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, endpoint, "error")
+            breaker.record_failure()
+            raise UpstreamError(f"Request error: {e}") from e
+        UPSTREAM_SECONDS.observe(
+            time.perf_counter() - started, endpoint, upstream_outcome(response.status_code)
+        )
+
+        if is_upstream_failure(response.status_code):
+            breaker.record_failure()
+            raise UpstreamError(f"HTTP {response.status_code}: {response.text}")
+
+        # API ответил - даже ошибка 4xx означает, что сервис жив
+        breaker.record_success()
+
+        if response.status_code != 200:
+            logger.error(f"HTTP {response.status_code}: {response.text}")
             return None
 
+        try:
+            data = response.json()
+        except ValueError as e:
+            logger.error(f"Invalid JSON from {endpoint}: {e}")
+            return None
+
+        return unwrap_payload(data)
+
+    def _make_request(
+        self, endpoint: str, params: Optional[Dict] = None
+    ) -> Optional[Any]:
+        """Выполнить запрос к API"""
+        try:
+            return self._fetch(endpoint, params)
+        except UpstreamError as e:
+            logger.error(str(e))
+            return None
+
+    def _is_negative_cached(self, key: tuple) -> bool:
+        """Был ли недавно ответ "нет данных" для этого запроса"""
+        expires_at = self._negative_cache.get(key)
+        if expires_at is None:
+            return False
+        if expires_at > time.time():
+            return True
+        with self._negative_lock:
+            self._negative_cache.pop(key, None)
+        return False
+
+    def _remember_no_data(self, key: tuple):
+        """Запомнить ответ "нет данных" на negative_ttl секунд"""
+        now = time.time()
+        with self._negative_lock:
+            self._negative_cache.pop(key, None)
+            self._negative_cache[key] = now + self.negative_ttl
+            # Истекшие записи - в начале; сверх предела удаляем самые старые
+            while self._negative_cache:
+                oldest_key, expires_at = next(iter(self._negative_cache.items()))
+                if expires_at > now and len(self._negative_cache) <= NEGATIVE_CACHE_MAX_ENTRIES:
+                    break
+                del self._negative_cache[oldest_key]
+
     def get_available_symbols(self) -> List[Dict[str, str]]:
         """
         Получить список доступных символов
@@ -215,16 +385,16 @@ class CoinglassClient:
 
         return results[:limit]
 
-    def get_crypto_ohlcv(
+    def get_crypto_candles(
         self,
         symbol: str,
         days: int = 365,
         interval: str = "4h",
         from_ts: int = None,
         to_ts: int = None,
-    ) -> Optional[List[Dict]]:
+    ) -> Optional[CandleSeries]:
         """
-        Получить OHLCV данные для любой криптовалюты
+        Получить OHLCV данные в колоночном виде
 
         Args:
             symbol: Символ криптовалюты (например, ETHUSDT)
@@ -234,101 +404,65 @@ class CoinglassClient:
             to_ts: Конечная метка времени (в секундах)
 
         Returns:
-            Список OHLCV данных
+            Серия свечей t/o/h/l/c/v, отсортированная по времени
         """
-        # Убеждаемся что символ в правильном формате
-        if not symbol.endswith("USDT"):
-            symbol = symbol.replace("USD", "USDT")
-
-        # Начинаем с первой доступной даты CBMA: 2017-05-01 00:00:00 UTC
-        # start_date = datetime(2017, 5, 1, 0, 0, 0)
-        # start_time = int(start_date.timestamp() * 1000)  # В миллисекундах
-        # end_time = int(time.time() * 1000)  # Текущее время в миллисекундах
-
-        params = {
-            "exchange": "Binance",
-            "symbol": symbol.upper(),
-            "interval": interval,
-            "limit": 4500,
-        }
+        params = build_candles_params(symbol, interval, from_ts, to_ts)
+        symbol = params["symbol"]
+        endpoint = CANDLES_ENDPOINT
 
-        # Если переданы from_ts/to_ts – используем их
-        if from_ts is not None:
-            params["start_time"] = from_ts * 1000
-        if to_ts is not None:
-            params["end_time"] = to_ts * 1000
-
-        # Используем spot API для получения точных исторических данных
-        endpoint = "/api/spot/price/history"
-        logger.info(
-            f"Requesting {symbol} data from Coinglass Spot API "
-            f"with params: {params}"
-        )
-        data = self._make_request(endpoint, params)
+        negative_key = (symbol, interval, from_ts, to_ts)
+        if self._is_negative_cached(negative_key):
+            logger.debug("Negative cache hit for %s %s", symbol, interval)
+            return None
 
-        # Если данных нет, пробуем без exchange параметра (некоторые рынки так требуют)
-        if not data:
-            params.pop("exchange", None)
-            data = self._make_request(endpoint, params)
+        logger.debug("Requesting %s data from Coinglass Spot API with params: %s", symbol, params)
+        try:
+            data = self._fetch(endpoint, params)
+
+            # Если данных нет, пробуем без exchange параметра (некоторые рынки
+            # так требуют). При недоступности API повтор не делаем.
+            if not data:
+                params.pop("exchange", None)
+                data = self._fetch(endpoint, params)
+        except UpstreamError as e:
+            logger.warning("Coinglass unavailable for %s: %s", symbol, e)
+            return None
 
-        logger.info(
-            f"API response for {symbol}: type={type(data)}, "
-            f"length={len(data) if isinstance(data, (list, dict)) else 'N/A'}"
-        )
-        if data and isinstance(data, list) and len(data) > 0:
-            logger.info(f"First element: {data[0]}")
+        if data and isinstance(data, list):
+            logger.debug("API response for %s: length=%d", symbol, len(data))
         elif data and isinstance(data, dict):
-            logger.info(f"Response keys: {list(data.keys())}")
+            logger.debug("Response keys: %s", list(data.keys()))
         else:
-            logger.warning(f"No data received for {symbol}")
+            logger.warning("No data received for %s", symbol)
+            self._remember_no_data(negative_key)
             return None
 
-        if data:
-            # Преобразуем в удобный формат
-            result = []
-
-            # Проверяем формат данных - возможно это список списков
-            if isinstance(data, list) and len(data) > 0:
-                # Если первый элемент - список, то это формат [[timestamp, open, high,
-                # low, close, volume], ...]
-                if isinstance(data[0], list):
-                    for candle in data:
-                        if len(candle) >= 5:  # Минимум timestamp, o, h, l, c
-                            result.append(
-                                {
-                                    "timestamp": int(candle[0]),  # В миллисекундах
-                                    "time": int(candle[0]) // 1000,  # В секундах
-                                    "open": float(candle[1]),
-                                    "high": float(candle[2]),
-                                    "low": float(candle[3]),
-                                    "close": float(candle[4]),
-                                    "volume": float(candle[5])
-                                    if len(candle) > 5
-                                    else 0,
-                                }
-                            )
-                # Если первый элемент - словарь с ключами time, open, high, low, close
-                elif isinstance(data[0], dict):
-                    for candle in data:
-                        # API возвращает time вместо t, open вместо o и т.д.
-                        timestamp = int(candle.get("time", 0))
-                        result.append(
-                            {
-                                "timestamp": timestamp,  # В миллисекундах
-                                "time": timestamp // 1000,  # В секундах
-                                "open": float(candle.get("open", 0)),
-                                "high": float(candle.get("high", 0)),
-                                "low": float(candle.get("low", 0)),
-                                "close": float(candle.get("close", 0)),
-                                "volume": float(
-                                    candle.get("volume_usd", candle.get("volume", 0))
-                                ),
-                            }
-                        )
-
-            return sorted(result, key=lambda x: x["time"]) if result else None
+        # Разбираем ответ сразу в типизированные колонки
+        return decode_candles(data)
 
-        return None
+    def get_crypto_ohlcv(
+        self,
+        symbol: str,
+        days: int = 365,
+        interval: str = "4h",
+        from_ts: int = None,
+        to_ts: int = None,
+    ) -> Optional[List[Dict]]:
+        """
+        Получить OHLCV данные для любой криптовалюты
+
+        Args:
+            symbol: Символ криптовалюты (например, ETHUSDT)
+            days: Количество дней истории
+            interval: Интервал времени для данных
+            from_ts: Начальная метка времени (в секундах)
+            to_ts: Конечная метка времени (в секундах)
+
+        Returns:
+            Список OHLCV данных
+        """
+        candles = self.get_crypto_candles(symbol, days, interval, from_ts, to_ts)
+        return candles.to_rows() if candles else None
 
     def get_btc_ohlcv(
         self, days: int = 365, interval: str = "4h"
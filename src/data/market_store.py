@@ -0,0 +1,328 @@
+"""
+Единое колоночное хранилище рыночных данных из CSV папок инструментов
+
+Builder собирает все data/<папка>/<SYMBOL>, <RES>.csv в одну версию хранилища:
+
+    data/market/<version>/{t,o,h,l,c,v}.npy  - колонки всех серий подряд
+    data/market/<version>/index.json          - серия -> диапазон строк
+    data/market/current.json                  - текущая версия
+
+UDF сервер открывает колонки через mmap один раз и отдает серии как срезы
+без копирования.
+"""
+import csv
+import hashlib
+import json
+import logging
+import re
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .artifacts import dump_json_bytes, write_atomic
+from .candles import COLUMNS, TIME_DTYPE, VALUE_DTYPE, CandleSeries, from_columns
+from .resample import resample_ohlcv
+
+logger = logging.getLogger(__name__)
+
+CURRENT_NAME = "current.json"
+INDEX_NAME = "index.json"
+
+# "SP_SPX, 1D.csv" -> ("SP_SPX", "1D")
+CSV_NAME_RE = re.compile(r"^(?P<symbol>[A-Z0-9_.]+),\s*(?P<resolution>\w+)\.csv$", re.I)
+
+# Заголовки в CSV различаются регистром (Volume / volume)
+HEADER_ALIASES = {
+    "time": "t",
+    "open": "o",
+    "high": "h",
+    "low": "l",
+    "close": "c",
+    "volume": "v",
+}
+
+
+class MarketDataError(ValueError):
+    """CSV файл не удалось разобрать"""
+
+
+def series_key(symbol: str, resolution: str) -> str:
+    return f"{symbol.upper()}:{resolution.upper()}"
+
+
+def read_instrument_csv(path: Path) -> Tuple[CandleSeries, Dict[str, int]]:
+    """
+    Прочитать CSV инструмента в колонки
+
+    Строки с пустыми или NaN ценами отбрасываются, отсутствующий объем
+    (NaN) считается нулевым, время в миллисекундах переводится в секунды,
+    дубликаты по времени удаляются (остается последняя строка).
+
+    Returns:
+        Серия свечей и счетчики проблем валидации
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        try:
+            header = next(reader)
+        except StopIteration:
+            raise MarketDataError(f"{path}: empty file")
+
+        positions = {}
+        for i, name in enumerate(header):
+            column = HEADER_ALIASES.get(name.strip().lower())
+            if column is not None and column not in positions:
+                positions[column] = i
+        missing = [name for name in ("t", "o", "h", "l", "c") if name not in positions]
+        if missing:
+            raise MarketDataError(f"{path}: missing columns {missing} in {header}")
+
+        rows = [row for row in reader if row]
+
+    def column(name: str) -> np.ndarray:
+        index = positions.get(name)
+        if index is None:
+            return np.zeros(len(rows), dtype=VALUE_DTYPE)
+        return np.array(
+            [row[index] if index < len(row) and row[index] != "" else "nan" for row in rows],
+            dtype=VALUE_DTYPE,
+        )
+
+    t, o, h, l, c, v = (column(name) for name in COLUMNS)  # noqa: E741
+    issues = {"rows": len(rows), "dropped": 0, "no_volume": 0, "invalid_range": 0}
+
+    valid = ~(np.isnan(t) | np.isnan(o) | np.isnan(h) | np.isnan(l) | np.isnan(c))
+    issues["dropped"] = int(len(rows) - valid.sum())
+    t, o, h, l, c, v = (col[valid] for col in (t, o, h, l, c, v))  # noqa: E741
+
+    issues["no_volume"] = int(np.isnan(v).sum())
+    v = np.nan_to_num(v, nan=0.0)
+
+    times = t.astype(TIME_DTYPE)
+    times = np.where(times > 10**12, times // 1000, times)
+
+    # Не отбрасываем, но считаем: high должен покрывать open/close, low - тоже
+    issues["invalid_range"] = int(
+        np.count_nonzero((h < np.maximum(o, c)) | (l > np.minimum(o, c)))
+    )
+
+    series = from_columns(times, o, h, l, c, v)
+    unique_times, index = np.unique(series.t[::-1], return_index=True)
+    issues["duplicates"] = len(series) - len(unique_times)
+    if issues["duplicates"]:
+        index = len(series) - 1 - index
+        series = CandleSeries(unique_times, *(getattr(series, n)[index] for n in COLUMNS[1:]))
+
+    return series, issues
+
+
+def discover_csv(root: Path) -> Dict[str, Dict[str, Any]]:
+    """Найти CSV инструментов в data/<папка>/ -> серия -> {path, folder}"""
+    found = {}
+    for path in sorted(Path(root).glob("*/*.csv")):
+        match = CSV_NAME_RE.match(path.name)
+        if not match:
+            continue
+        key = series_key(match["symbol"], match["resolution"])
+        found[key] = {"path": path, "folder": path.parent.name}
+    return found
+
+
+def sources_fingerprint(sources: Dict[str, Dict[str, Any]]) -> str:
+    """Отпечаток набора CSV по путям, размерам и mtime"""
+    digest = hashlib.sha256()
+    for key in sorted(sources):
+        stat = sources[key]["path"].stat()
+        digest.update(f"{key}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def current_version(store_root: Path) -> Optional[Dict[str, Any]]:
+    """Содержимое current.json (или None, если хранилище еще не собрано)"""
+    try:
+        with open(Path(store_root) / CURRENT_NAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def build_market_store(
+    source_root: Path, store_root: Path, force: bool = False
+) -> Optional[Dict[str, Any]]:
+    """
+    Собрать новую версию хранилища из CSV, если исходники изменились
+
+    Недостающий 1W строится из 1D (недели с понедельника, UTC).
+
+    Returns:
+        Индекс новой версии или None, если сборка не потребовалась
+    """
+    store_root = Path(store_root)
+    sources = discover_csv(source_root)
+    if not sources:
+        logger.warning(f"CSV инструментов не найдены в {source_root}")
+        return None
+
+    fingerprint = sources_fingerprint(sources)
+    current = current_version(store_root)
+    if not force and current and current.get("fingerprint") == fingerprint:
+        return None
+
+    series: Dict[str, CandleSeries] = {}
+    meta: Dict[str, Dict[str, Any]] = {}
+    for key, source in sources.items():
+        try:
+            candles, issues = read_instrument_csv(source["path"])
+        except (OSError, ValueError) as e:
+            logger.error(f"Пропускаем {source['path']}: {e}")
+            continue
+        if not len(candles):
+            logger.warning(f"Нет строк в {source['path']}")
+            continue
+        if issues["dropped"] or issues["invalid_range"] or issues["duplicates"]:
+            logger.warning(f"{source['path'].name}: {issues}")
+        series[key] = candles
+        meta[key] = {"folder": source["folder"], "source": source["path"].name, "issues": issues}
+
+    for key in list(series):
+        symbol, resolution = key.split(":")
+        weekly = series_key(symbol, "1W")
+        if resolution == "1D" and weekly not in series:
+            daily = series[key]
+            series[weekly] = CandleSeries(
+                *resample_ohlcv(*(getattr(daily, name) for name in COLUMNS), "W")
+            )
+            meta[weekly] = {"folder": meta[key]["folder"], "derived_from": key}
+            logger.info(f"{weekly} построен из {key}")
+
+    # Колонки всех серий подряд, индекс хранит диапазон строк каждой серии
+    keys = sorted(series)
+    index = {}
+    offset = 0
+    for key in keys:
+        candles = series[key]
+        index[key] = dict(
+            meta[key],
+            start=offset,
+            end=offset + len(candles),
+            first=int(candles.t[0]),
+            last=int(candles.t[-1]),
+        )
+        offset += len(candles)
+
+    # Каждая сборка пишет в новый каталог: открытые читателями mmap не меняются
+    version = f"{time.time_ns()}-{fingerprint}"
+    version_dir = store_root / version
+    version_dir.mkdir(parents=True, exist_ok=True)
+    for name in COLUMNS:
+        column = np.concatenate([getattr(series[key], name) for key in keys])
+        np.save(version_dir / f"{name}.npy", column)
+
+    payload = {
+        "version": version,
+        "fingerprint": fingerprint,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "rows": offset,
+        "series": index,
+    }
+    write_atomic(version_dir / INDEX_NAME, dump_json_bytes(payload))
+    # Переключение на новую версию - одна атомарная запись указателя
+    pointer = {"version": version, "fingerprint": fingerprint}
+    write_atomic(store_root / CURRENT_NAME, dump_json_bytes(pointer))
+
+    # Предыдущую версию оставляем для читателей, которые еще держат ее mmap
+    previous = current.get("version") if current else None
+    for path in store_root.iterdir():
+        if path.is_dir() and path.name not in (version, previous):
+            shutil.rmtree(path, ignore_errors=True)
+
+    logger.info(f"Хранилище рыночных данных {version}: {len(keys)} серий, {offset} строк")
+    return payload
+
+
+class MarketStore:
+    """
+    Читатель хранилища: колонки открываются через mmap один раз на версию
+
+    Смена версии (current.json) проверяется не чаще, чем раз в check_interval
+    секунд.
+    """
+
+    def __init__(self, root: Path, check_interval: float = 5.0):
+        self.root = Path(root)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # (версия, индекс серий, колонки, готовые серии) - заменяется целиком
+        # одним присваиванием
+        self._state: Tuple[
+            Optional[str], Dict[str, Dict], Dict[str, np.ndarray], Dict[str, CandleSeries]
+        ] = (None, {}, {}, {})
+        self._checked_at = float("-inf")
+
+    def _open(self, version: str):
+        version_dir = self.root / version
+        with open(version_dir / INDEX_NAME, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        columns = {
+            name: np.load(version_dir / f"{name}.npy", mmap_mode="r") for name in COLUMNS
+        }
+        self._state = (version, index["series"], columns, {})
+        logger.info(f"Открыто хранилище рыночных данных {version}: {len(index['series'])} серий")
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            current = current_version(self.root)
+            if current and current.get("version") != self._state[0]:
+                try:
+                    self._open(current["version"])
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error(f"Не удалось открыть хранилище {current}: {e}")
+
+    @property
+    def version(self) -> Optional[str]:
+        self._refresh()
+        return self._state[0]
+
+    def symbols(self) -> List[str]:
+        """Символы, для которых есть хотя бы одна серия"""
+        self._refresh()
+        return sorted({key.split(":")[0] for key in self._state[1]})
+
+    def resolutions(self, symbol: str) -> List[str]:
+        """Разрешения, доступные для символа"""
+        self._refresh()
+        prefix = f"{symbol.upper()}:"
+        return sorted(key[len(prefix):] for key in self._state[1] if key.startswith(prefix))
+
+    def __contains__(self, symbol: str) -> bool:
+        return bool(self.resolutions(symbol))
+
+    def get(self, symbol: str, resolution: str) -> Optional[CandleSeries]:
+        """
+        Серия как срез общих колонок (без копирования)
+
+        В пределах версии хранилища возвращается один и тот же объект серии -
+        по нему движок разрешений узнает, что данные не менялись.
+        """
+        self._refresh()
+        _, index, columns, series = self._state
+        key = series_key(symbol, resolution)
+        cached = series.get(key)
+        if cached is not None:
+            return cached
+        entry = index.get(key)
+        if entry is None:
+            return None
+        start, end = entry["start"], entry["end"]
+        return series.setdefault(key, CandleSeries(*(columns[name][start:end] for name in COLUMNS)))
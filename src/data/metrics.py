@@ -0,0 +1,205 @@
+"""
+Метрики процесса в текстовом формате Prometheus
+
+Счетчики и гистограммы без внешних зависимостей. Запись значения - одна
+блокировка и bisect по границам корзин, поэтому метрики можно обновлять на
+каждом запросе. Значения, которые уже считают сами компоненты (статистика
+кэшей), собираются коллекторами только в момент выдачи /metrics.
+
+Снимок реестра (snapshot) - обычный словарь: воркеры gunicorn пишут свои
+снимки в файлы, а /metrics складывает их (merge_snapshots).
+"""
+import bisect
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Границы корзин по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Коллектор возвращает пары (значения меток, значение)
+Collector = Callable[[], Iterable[Tuple[Sequence[str], float]]]
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def samples(self) -> Dict[Tuple[str, ...], Any]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram:
+    """Гистограмма с метками (корзины хранятся не накопленными)"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # метки -> [счетчики корзин (+Inf последней), сумма, количество]
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> Dict[Tuple[str, ...], Any]:
+        with self._lock:
+            return {key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+
+
+class MetricsRegistry:
+    """Метрики и коллекторы процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: Dict[str, Tuple[str, str, Tuple[str, ...], Collector]] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        # Повторная регистрация (повторный импорт модуля) возвращает ту же метрику
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def collector(
+        self, name: str, help: str, labels: Sequence[str], collect: Collector, kind: str = "counter"
+    ):
+        """Метрика, значения которой читаются из компонента при выдаче /metrics"""
+        with self._lock:
+            self._collectors[name] = (kind, help, tuple(labels), collect)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Текущие значения всех метрик (JSON-совместимый словарь)"""
+        result = {}
+        for name, metric in list(self._metrics.items()):
+            entry = {"type": metric.kind, "help": metric.help, "labels": list(metric.labels)}
+            if isinstance(metric, Histogram):
+                entry["buckets"] = list(metric.buckets)
+            entry["samples"] = [[list(key), value] for key, value in metric.samples().items()]
+            result[name] = entry
+        for name, (kind, help, labels, collect) in list(self._collectors.items()):
+            try:
+                samples = [[list(key), float(value)] for key, value in collect()]
+            except Exception:
+                # Компонент еще не инициализирован - метрика пропускается
+                continue
+            result[name] = {"type": kind, "help": help, "labels": list(labels), "samples": samples}
+        return result
+
+
+def merge_snapshots(snapshots: Iterable[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Сложить снимки нескольких процессов (счетчики и корзины суммируются)
+
+    Значения gauge тоже складываются, поэтому gauge допустимы только
+    аддитивные (занятые слоты, размеры); доли и средние считаются в
+    Prometheus из счетчиков.
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for snapshot in snapshots:
+        for name, entry in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = {**entry, "samples": {}}
+            samples = target["samples"]
+            for key, value in entry["samples"]:
+                key = tuple(key)
+                current = samples.get(key)
+                if current is None:
+                    samples[key] = value
+                elif entry["type"] == "histogram":
+                    samples[key] = [
+                        [a + b for a, b in zip(current[0], value[0])],
+                        current[1] + value[1],
+                        current[2] + value[2],
+                    ]
+                else:
+                    samples[key] = current + value
+    for entry in merged.values():
+        entry["samples"] = [[list(key), value] for key, value in entry["samples"].items()]
+    return merged
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(snapshot: Dict[str, Dict[str, Any]]) -> str:
+    """Снимок -> текстовый формат Prometheus 0.0.4"""
+    lines = []
+    for name in sorted(snapshot):
+        entry = snapshot[name]
+        labels = entry["labels"]
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['type']}")
+        for key, value in sorted(entry["samples"], key=lambda sample: sample[0]):
+            if entry["type"] == "histogram":
+                counts, total, count = value
+                cumulative = 0
+                bounds = [_number(bound) for bound in entry["buckets"]] + ["+Inf"]
+                for bound, bucket in zip(bounds, counts):
+                    cumulative += bucket
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{_labels(labels, key, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels, key)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(labels, key)} {count}")
+            else:
+                lines.append(f"{name}{_labels(labels, key)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Реестр процесса
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,74 @@
+"""
+Rate limiter для внешних API, общий для потоков и корутин
+"""
+import asyncio
+import threading
+import time
+from typing import Dict
+
+from .metrics import REGISTRY
+
+RATE_LIMIT_WAIT = REGISTRY.histogram(
+    "udf_rate_limiter_wait_seconds",
+    "Wait for a rate limiter slot before an upstream request",
+    ("limiter",),
+    buckets=(0.0, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+class RateLimiter:
+    """Минимальный интервал между началом соседних запросов"""
+
+    def __init__(self, min_interval: float = 0.5, name: str = "default"):
+        self.min_interval = min_interval
+        self.name = name
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+        # Статистика ожиданий
+        self.waits = 0
+        self.total_wait = 0.0
+
+    def reserve(self) -> float:
+        """
+        Занять ближайший свободный слот
+
+        Returns:
+            Сколько секунд нужно подождать до начала запроса
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+            delay = slot - now
+            if delay > 0:
+                self.waits += 1
+                self.total_wait += delay
+        RATE_LIMIT_WAIT.observe(delay, self.name)
+        return delay
+
+    def wait(self):
+        """Дождаться своего слота (блокирующе)"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        """Дождаться своего слота (без блокировки event loop)"""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_shared_limiters: Dict[str, RateLimiter] = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_rate_limiter(name: str, min_interval: float = 0.5) -> RateLimiter:
+    """Общий для процесса limiter (например, один на базовый URL API)"""
+    with _shared_lock:
+        limiter = _shared_limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(min_interval, name)
+            _shared_limiters[name] = limiter
+        return limiter
@@ -0,0 +1,191 @@
+"""
+Разрешения баров и агрегация колонок по интервалам, выровненным по UTC
+"""
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+import numpy as np
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 86400
+WEEK = 7 * DAY
+# 1970-01-01 - четверг, первый понедельник эпохи - 1970-01-05
+MONDAY_OFFSET = 4 * DAY
+
+# Базовые календарные разрешения индекса
+RESOLUTIONS = ("D", "W", "M")
+
+UNIT_SECONDS = {"min": MINUTE, "H": HOUR, "D": DAY, "W": WEEK}
+
+# "240", "15min", "4H", "1D", "D", "3D", "1W", "1M", "12M"
+RESOLUTION_RE = re.compile(
+    r"^\s*(?P<count>\d*)\s*(?P<unit>MIN|M|H|D|W|S)?\s*$", re.IGNORECASE
+)
+
+
+@dataclass(frozen=True)
+class Resolution:
+    """Разрешение бара: count единиц unit (min, H, D, W, M)"""
+
+    count: int
+    unit: str
+
+    @property
+    def seconds(self) -> Optional[int]:
+        """Длина бара в секундах (None для месяцев - длина переменная)"""
+        if self.unit == "M":
+            return None
+        return self.count * UNIT_SECONDS[self.unit]
+
+    @property
+    def is_intraday(self) -> bool:
+        return self.unit in ("min", "H")
+
+    def to_udf(self) -> str:
+        """Каноническая запись TradingView: минуты числом, остальное с буквой"""
+        if self.unit == "min":
+            return str(self.count)
+        if self.unit == "H":
+            return str(self.count * 60)
+        return f"{self.count}{self.unit}"
+
+    def __str__(self) -> str:
+        return self.to_udf()
+
+
+def parse_resolution(spec: Union[str, Resolution]) -> Resolution:
+    """
+    Разобрать разрешение TradingView
+
+    Число без единицы - минуты ("1", "240"); "15min" - тоже минуты;
+    H - часы, D - дни, W - недели, M - месяцы ("D" = "1D").
+
+    Raises:
+        ValueError: Неизвестный формат
+    """
+    if isinstance(spec, Resolution):
+        return spec
+
+    match = RESOLUTION_RE.match(str(spec))
+    if not match or not (match["count"] or match["unit"]):
+        raise ValueError(f"Unsupported resolution: {spec!r}")
+
+    count = int(match["count"] or 1)
+    unit = (match["unit"] or "min").upper()
+    if count <= 0:
+        raise ValueError(f"Unsupported resolution: {spec!r}")
+    if unit == "S":
+        raise ValueError(f"Second resolutions are not supported: {spec!r}")
+
+    if unit == "MIN":
+        # Кратные часу и дню минуты приводим к одной записи (240 -> 4H) для ключа кэша
+        if count % 1440 == 0:
+            return Resolution(count // 1440, "D")
+        if count % 60 == 0:
+            return Resolution(count // 60, "H")
+        return Resolution(count, "min")
+    return Resolution(count, unit)
+
+
+def bucket_starts(times: np.ndarray, resolution: Union[str, Resolution]) -> np.ndarray:
+    """
+    Начало интервала (секунды UTC) для каждой метки времени
+
+    Интервалы выровнены по эпохе UTC: часы и дни - от полуночи, недели - от
+    понедельника, месяцы - от первого числа.
+    """
+    resolution = parse_resolution(resolution)
+    times = np.asarray(times, dtype=np.int64)
+
+    if resolution.unit == "M":
+        months = times.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+        months -= months % resolution.count
+        return months.astype("datetime64[M]").astype("datetime64[s]").astype(np.int64)
+
+    step = resolution.seconds
+    offset = MONDAY_OFFSET if resolution.unit == "W" else 0
+    return times - (times - offset) % step
+
+
+def resample_ohlcv(
+    t: np.ndarray,
+    o: np.ndarray,
+    h: np.ndarray,
+    l: np.ndarray,  # noqa: E741
+    c: np.ndarray,
+    v: np.ndarray,
+    resolution: Union[str, Resolution],
+) -> Tuple[np.ndarray, ...]:
+    """
+    Свернуть отсортированные по времени свечи в интервалы resolution
+
+    open - первая свеча интервала, high/low - экстремумы, close - последняя,
+    volume - сумма. Время бара - начало интервала.
+    """
+    if len(t) == 0:
+        return t, o, h, l, c, v
+
+    keys = bucket_starts(t, resolution)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    ends = np.concatenate((starts[1:], [len(keys)])) - 1
+
+    return (
+        keys[starts],
+        o[starts],
+        np.maximum.reduceat(h, starts),
+        np.minimum.reduceat(l, starts),
+        c[ends],
+        np.add.reduceat(v, starts),
+    )
+
+
+def choose_base_interval(
+    resolution: Union[str, Resolution],
+    intervals: Dict[str, int],
+    cached: Iterable[str] = (),
+) -> Optional[str]:
+    """
+    Выбрать самый крупный базовый интервал, из которого собирается resolution
+
+    Интервал той же длины используется напрямую. Иначе базовый интервал
+    подходит, если бары resolution складываются из целого числа его баров с
+    теми же границами. Для недель и месяцев берутся только
+    интервалы не длиннее дня. Из подходящих предпочитается уже загруженный
+    (cached), если он не мельче самого крупного больше чем в 24 раза.
+
+    Args:
+        resolution: Целевое разрешение
+        intervals: Доступные интервалы -> длина в секундах
+        cached: Интервалы, которые уже есть в кэше
+
+    Returns:
+        Имя интервала или None, если ни один не подходит
+    """
+    resolution = parse_resolution(resolution)
+    target = resolution.seconds
+
+    # Нативный интервал той же длины отдается как есть
+    for name, seconds in intervals.items():
+        if target is not None and seconds == target:
+            return name
+
+    suitable = []
+    for name, seconds in intervals.items():
+        if resolution.unit in ("W", "M"):
+            ok = seconds <= DAY and DAY % seconds == 0
+        else:
+            ok = target % seconds == 0
+        if ok:
+            suitable.append((seconds, name))
+    if not suitable:
+        return None
+
+    suitable.sort(reverse=True)
+    largest_seconds, largest = suitable[0]
+    cached = set(cached)
+    for seconds, name in suitable:
+        if name in cached and largest_seconds // seconds <= 24:
+            return name
+    return largest
@@ -0,0 +1,131 @@
+"""
+Движок разрешений: бары любого размера из ближайшего подходящего интервала
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from .candles import COLUMNS, CandleSeries
+from .resample import Resolution, choose_base_interval, parse_resolution, resample_ohlcv
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# fetch(symbol, interval) -> свечи базового интервала
+Fetcher = Callable[[str, str], Optional[CandleSeries]]
+
+
+class ResolutionEngine:
+    """
+    Бары запрошенного разрешения для одного источника свечей
+
+    Базовый интервал выбирается самый крупный из подходящих (или уже
+    загруженный), затем свечи сворачиваются векторно по границам UTC.
+    Результат кэшируется по (symbol, resolution) и пересчитывается только
+    когда источник вернул другой объект серии (данные обновились).
+    """
+
+    def __init__(
+        self,
+        fetch: Fetcher,
+        intervals: Dict[str, int],
+        cached_intervals: Optional[Callable[[str], Iterable[str]]] = None,
+        max_entries: int = 256,
+    ):
+        self.fetch = fetch
+        self.intervals = intervals
+        self.cached_intervals = cached_intervals
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        # (symbol, resolution) -> (базовая серия, результат)
+        self._results: "OrderedDict[Tuple[str, Resolution], Tuple[CandleSeries, CandleSeries]]" = (
+            OrderedDict()
+        )
+        self.stats = {"hits": 0, "resampled": 0, "native": 0}
+
+    def base_interval(self, symbol: str, resolution: Resolution) -> Optional[str]:
+        """Интервал источника, из которого строятся бары resolution"""
+        cached = self.cached_intervals(symbol) if self.cached_intervals else ()
+        return choose_base_interval(resolution, self.intervals, cached)
+
+    def plan(self, symbol: str, resolution) -> Tuple[Resolution, str]:
+        """
+        Разобрать разрешение и выбрать интервал источника
+
+        Raises:
+            ValueError: Неизвестный формат разрешения или ни один интервал
+                источника его не собирает (например, минуты при только
+                дневных данных)
+        """
+        resolution = parse_resolution(resolution)
+        interval = self.base_interval(symbol, resolution)
+        if interval is None:
+            raise ValueError(f"Resolution {resolution} is not available for {symbol}")
+        return resolution, interval
+
+    def is_cached(self, symbol: str, resolution: Resolution) -> bool:
+        """Бары resolution уже свернуты (для прежней базовой серии)"""
+        with self._lock:
+            return (symbol.upper(), resolution) in self._results
+
+    def get(self, symbol: str, resolution) -> Optional[CandleSeries]:
+        """
+        Свечи symbol в разрешении resolution
+
+        Raises:
+            ValueError: Неизвестный формат или недоступное разрешение
+        """
+        resolution, interval = self.plan(symbol, resolution)
+        return self.finish(symbol, resolution, interval, self.fetch(symbol, interval))
+
+    async def get_async(
+        self, symbol: str, resolution, fetch: Callable[[str, str], Awaitable]
+    ) -> Optional[CandleSeries]:
+        """То же, что get, но базовые свечи загружает корутина fetch(symbol, interval)"""
+        resolution, interval = self.plan(symbol, resolution)
+        return self.finish(symbol, resolution, interval, await fetch(symbol, interval))
+
+    def finish(
+        self,
+        symbol: str,
+        resolution: Resolution,
+        interval: str,
+        base: Optional[CandleSeries],
+    ) -> Optional[CandleSeries]:
+        """Свернуть базовые свечи в бары resolution (с кэшем результата)"""
+        if base is None or not len(base):
+            return None
+
+        if not interval_is_finer(self.intervals[interval], resolution):
+            # Нативный интервал той же длины
+            self.stats["native"] += 1
+            return base
+
+        key = (symbol.upper(), resolution)
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] is base:
+                self._results.move_to_end(key)
+                self.stats["hits"] += 1
+                return cached[1]
+
+        with span("resample"):
+            columns = resample_ohlcv(*(getattr(base, name) for name in COLUMNS), resolution)
+        result = CandleSeries(*columns)
+        self.stats["resampled"] += 1
+        logger.debug("%s %s: %d x %s -> %d bars", symbol, resolution, len(base), interval, len(result))
+
+        with self._lock:
+            self._results[key] = (base, result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return result
+
+
+def interval_is_finer(seconds: int, resolution: Resolution) -> bool:
+    """Базовый интервал мельче целевого разрешения (сворачивать есть смысл)"""
+    target = resolution.seconds
+    return target is None or seconds < target
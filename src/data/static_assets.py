@@ -0,0 +1,242 @@
+"""
+Статика графика (src/chart): манифест ассетов с хэшами и предсжатыми копиями
+
+Манифест строится один раз (при старте сервера или сборке builder'ом):
+    - .js/.css получают имя с хэшем содержимого (config.<hash>.js) и
+      кэшируются клиентом навсегда;
+    - в .html ссылки на них заменяются хэшированными именами, сами страницы
+      перепроверяются клиентом (no-cache + ETag);
+    - у каждого файла есть gzip и brotli копии, небольшие файлы целиком
+      хранятся в памяти - на запрос не нужны ни stat, ни сжатие.
+
+publish_static_assets пишет то же самое в каталог для nginx (gzip_static).
+"""
+import gzip
+import logging
+import mimetypes
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .artifacts import content_version, dump_json_bytes, write_atomic
+
+try:
+    import brotli
+except ImportError:  # brotli ставится вместе с Flask-Compress, но не обязателен
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ASSET_MANIFEST_NAME = "asset-manifest.json"
+# Файлы, которые получают имя с хэшем содержимого
+HASHED_SUFFIXES = (".js", ".css")
+# Страницы: ссылки на ассеты заменяются хэшированными именами
+PAGE_SUFFIXES = (".html",)
+# Меньшие файлы не сжимаем (как Flask-Compress)
+COMPRESS_MIN_SIZE = 500
+# Файлы больше этого размера отдаются с диска
+MEMORY_LIMIT = 1024 * 1024
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# src="config.js", href='style.css' (без схемы и абсолютных URL)
+REFERENCE_RE = re.compile(r"""\b(src|href)=(["'])(?!https?:|//|data:)\.?/?([^"'?#]+)\2""")
+
+
+@dataclass(frozen=True)
+class StaticAsset:
+    """Один ответ статики: тело и предсжатые копии"""
+
+    name: str
+    content_type: str
+    version: str
+    immutable: bool
+    body: Optional[bytes] = None
+    # Для файлов больше MEMORY_LIMIT - путь на диске вместо тела
+    path: Optional[Path] = None
+    encodings: Dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def cache_control(self) -> str:
+        return IMMUTABLE_CACHE if self.immutable else REVALIDATE_CACHE
+
+    def etag(self, encoding: Optional[str] = None) -> str:
+        return f'"{self.version}-{encoding}"' if encoding else f'"{self.version}"'
+
+    def choose_encoding(self, accept_encoding: str) -> Optional[str]:
+        """Предсжатая копия, которую принимает клиент (brotli предпочтительнее)"""
+        for encoding in ("br", "gzip"):
+            if encoding in self.encodings and accepts_encoding(accept_encoding, encoding):
+                return encoding
+        return None
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """
+    Принимает ли клиент кодировку по заголовку Accept-Encoding
+
+    Учитывается качество: "gzip;q=0" - отказ, "*" - любая кодировка.
+    """
+    wildcard = False
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        name = name.strip()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                pass
+        if name == encoding:
+            return quality > 0
+        if name == "*":
+            wildcard = quality > 0
+    return wildcard
+
+
+def hashed_name(name: str, version: str) -> str:
+    """config.js -> config.<version>.js"""
+    stem, dot, suffix = name.rpartition(".")
+    return f"{stem}.{version}.{suffix}" if dot else f"{name}.{version}"
+
+
+def compress_variants(data: bytes) -> Dict[str, bytes]:
+    """gzip и brotli копии (mtime=0 - одинаковые байты при одинаковом содержимом)"""
+    if len(data) < COMPRESS_MIN_SIZE:
+        return {}
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    # Копия больше оригинала не нужна
+    return {name: body for name, body in variants.items() if len(body) < len(data)}
+
+
+def rewrite_references(page: str, names: Dict[str, str]) -> str:
+    """Заменить в странице ссылки на ассеты хэшированными именами"""
+
+    def replace(match: "re.Match") -> str:
+        target = names.get(match.group(3))
+        if target is None:
+            return match.group(0)
+        quote = match.group(2)
+        return f"{match.group(1)}={quote}{target}{quote}"
+
+    return REFERENCE_RE.sub(replace, page)
+
+
+class AssetManifest:
+    """Все ассеты каталога по имени запроса (исходному и хэшированному)"""
+
+    def __init__(self, source_dir: Path, assets: Dict[str, StaticAsset], names: Dict[str, str]):
+        self.source_dir = source_dir
+        self.assets = assets
+        # Исходное имя -> хэшированное
+        self.names = names
+
+    @classmethod
+    def build(cls, source_dir: Path, memory_limit: int = MEMORY_LIMIT) -> "AssetManifest":
+        """Прочитать каталог, посчитать хэши и сжатые копии"""
+        source_dir = Path(source_dir)
+        files = sorted(
+            path for path in source_dir.rglob("*") if path.is_file() and not path.name.startswith(".")
+        )
+        assets: Dict[str, StaticAsset] = {}
+        names: Dict[str, str] = {}
+        pages = []
+
+        for path in files:
+            name = path.relative_to(source_dir).as_posix()
+            if path.suffix in PAGE_SUFFIXES:
+                pages.append((name, path))
+                continue
+            size = path.stat().st_size
+            if size > memory_limit:
+                assets[name] = StaticAsset(
+                    name, guess_type(name), f"{path.stat().st_mtime_ns:x}-{size:x}", False, path=path
+                )
+                continue
+            data = path.read_bytes()
+            version = content_version(data)
+            encodings = compress_variants(data)
+            if path.suffix in HASHED_SUFFIXES:
+                names[name] = hashed_name(name, version)
+                assets[names[name]] = StaticAsset(
+                    names[name], guess_type(name), version, True, data, encodings=encodings
+                )
+            # Исходное имя тоже отвечает (старые ссылки), но с перепроверкой
+            assets[name] = StaticAsset(name, guess_type(name), version, False, data, encodings=encodings)
+
+        # Страницы - после ассетов, когда известны хэшированные имена
+        for name, path in pages:
+            text = path.read_text(encoding="utf-8")
+            data = rewrite_references(text, names).encode("utf-8")
+            assets[name] = StaticAsset(
+                name, guess_type(name), content_version(data), False, data,
+                encodings=compress_variants(data),
+            )
+
+        manifest = cls(source_dir, assets, names)
+        logger.info(
+            f"Static assets: {len(files)} files, {len(names)} hashed, "
+            f"{manifest.memory_bytes() / 1024:.0f}KB in memory"
+        )
+        return manifest
+
+    def get(self, name: str) -> Optional[StaticAsset]:
+        return self.assets.get(name)
+
+    def memory_bytes(self) -> int:
+        return sum(
+            len(asset.body or b"") + sum(len(body) for body in asset.encodings.values())
+            for asset in self.assets.values()
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "files": dict(self.names),
+            "versions": {name: asset.version for name, asset in self.assets.items()},
+        }
+
+
+def guess_type(name: str) -> str:
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if content_type.startswith("text/") or content_type == "application/javascript":
+        content_type += "; charset=utf-8"
+    return content_type
+
+
+def publish_static_assets(source_dir: Path, out_dir: Path) -> Dict[str, Any]:
+    """
+    Записать ассеты для nginx: файлы под исходными и хэшированными именами,
+    .gz/.br копии рядом и asset-manifest.json
+
+    Неизменившиеся файлы не перезаписываются.
+    """
+    manifest = AssetManifest.build(source_dir)
+    out_dir = Path(out_dir)
+    written = 0
+
+    # Страницы пишутся последними: когда клиент получит новую страницу,
+    # хэшированные файлы, на которые она ссылается, уже на месте
+    ordered = sorted(manifest.assets.values(), key=lambda asset: asset.name.endswith(PAGE_SUFFIXES))
+    for asset in ordered:
+        target = out_dir / asset.name
+        data = asset.body if asset.body is not None else asset.path.read_bytes()
+        if target.exists() and target.read_bytes() == data:
+            continue
+        for encoding, suffix in (("gzip", ".gz"), ("br", ".br")):
+            copy = target.with_name(target.name + suffix)
+            if encoding in asset.encodings:
+                write_atomic(copy, asset.encodings[encoding])
+            elif copy.exists():
+                # Иначе gzip_static отдаст устаревшую копию
+                copy.unlink()
+        write_atomic(target, data)
+        written += 1
+
+    write_atomic(out_dir / ASSET_MANIFEST_NAME, dump_json_bytes(manifest.to_dict()))
+    logger.info(f"Static assets published to {out_dir}: {written} files written")
+    return manifest.to_dict()
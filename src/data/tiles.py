@@ -0,0 +1,119 @@
+"""
+Тайлы истории: серии, нарезанные по годам, в неизменяемых файлах
+
+    data/tiles/<SERIES>/<RES>/<year>-<hash>.json  - ответ UDF за календарный год
+    data/tiles/index.json                         - серия -> список тайлов
+
+Имя тайла содержит хэш содержимого, поэтому файл никогда не перезаписывается:
+изменение данных (обычно только текущий год) дает новый файл, а index.json
+переключает на него. Nginx отдает тайлы напрямую с expires 1y.
+"""
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+
+from .artifacts import content_version, dump_json_bytes, publish_artifact, write_atomic
+from .candles import COLUMNS, CandleSeries
+
+logger = logging.getLogger(__name__)
+
+TILES_DIR = "tiles"
+TILES_INDEX = "index.json"
+
+
+def tile_years(times: np.ndarray) -> np.ndarray:
+    """Календарный год (UTC) каждой метки времени"""
+    years = np.asarray(times, dtype=np.int64).astype("datetime64[s]").astype("datetime64[Y]")
+    return years.astype(np.int64) + 1970
+
+
+def split_by_year(candles: CandleSeries) -> List[Tuple[int, CandleSeries]]:
+    """Разбить отсортированную серию на годовые срезы (без копирования)"""
+    if not len(candles):
+        return []
+    years = tile_years(candles.t)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(years)) + 1, [len(years)]))
+    return [
+        (int(years[start]), CandleSeries(*(getattr(candles, n)[start:end] for n in COLUMNS)))
+        for start, end in zip(starts[:-1], starts[1:])
+    ]
+
+
+def read_tiles_index(root: Path) -> Dict[str, Any]:
+    """Прочитать индекс тайлов (пустой, если тайлы еще не собраны)"""
+    try:
+        with open(Path(root) / TILES_INDEX, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"series": {}}
+
+
+def _referenced_files(index: Dict[str, Any]) -> Set[str]:
+    return {tile["file"] for tiles in index.get("series", {}).values() for tile in tiles}
+
+
+def publish_tiles(root: Path, series: Iterable[Tuple[str, str, CandleSeries]]) -> Dict[str, Any]:
+    """
+    Нарезать серии на годовые тайлы и опубликовать новый индекс
+
+    Уже существующие тайлы (тот же хэш) не перезаписываются. Файлы, на которые
+    не ссылаются ни новый, ни предыдущий индекс, удаляются: клиенты, успевшие
+    получить прошлый индекс, еще могут догрузить его тайлы.
+
+    Args:
+        root: Каталог тайлов (data/tiles)
+        series: (имя серии, разрешение, свечи)
+
+    Returns:
+        Новый индекс
+    """
+    root = Path(root)
+    previous = read_tiles_index(root)
+    current_year = datetime.now(timezone.utc).year
+
+    entries: Dict[str, List[Dict[str, Any]]] = {}
+    written = 0
+    for name, resolution, candles in series:
+        tiles = []
+        for year, part in split_by_year(candles):
+            data = dump_json_bytes(part.to_udf())
+            relative = f"{name}/{resolution}/{year}-{content_version(data)[:12]}.json"
+            path = root / relative
+            if not path.exists():
+                publish_artifact(path, data)
+                written += 1
+            tiles.append(
+                {
+                    "year": year,
+                    "from": int(part.t[0]),
+                    "to": int(part.t[-1]),
+                    "count": len(part),
+                    "file": relative,
+                    # Прошедшие годы больше не меняются
+                    "final": year < current_year,
+                }
+            )
+        entries[f"{name}:{resolution}"] = tiles
+
+    index = {"updated_at": datetime.now(timezone.utc).isoformat(), "series": entries}
+    write_atomic(root / TILES_INDEX, dump_json_bytes(index))
+
+    keep = _referenced_files(index) | _referenced_files(previous)
+    removed = 0
+    for path in root.glob("*/*/*.json"):
+        if path.relative_to(root).as_posix() not in keep:
+            for suffix in ("", ".gz", ".br"):
+                stale = path.with_name(path.name + suffix)
+                if stale.exists():
+                    os.unlink(stale)
+            removed += 1
+
+    logger.info(
+        f"Тайлы истории: {len(entries)} серий, новых {written}, удалено {removed}"
+    )
+    return index
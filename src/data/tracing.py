@@ -0,0 +1,157 @@
+"""
+Легкая трассировка этапов обработки запроса
+
+Сервер открывает трассу на запрос (start_trace), а код данных отмечает
+этапы через span("name") или декоратор traced("name"). Вне трассы span
+ничего не делает, поэтому builder и CLI платят только за чтение ContextVar.
+Длительности этапов с одним именем складываются: трасса запроса - это
+разбивка вида {"coinglass.fetch": 120ms x1, "serialize": 3ms x1}.
+
+Трасса уходит клиенту в заголовке Server-Timing и, по желанию, пишется
+строкой JSON в локальный файл (TraceFile) для разбора потом.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar, Token
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("udf_trace", default=None)
+
+
+class Trace:
+    """Этапы одного запроса: имя -> [суммарное время, число вызовов]"""
+
+    __slots__ = ("name", "started", "spans", "_lock")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List] = {}
+        # Этапы могут выполняться в других потоках (asyncio.to_thread)
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            entry = self.spans.get(name)
+            if entry is None:
+                self.spans[name] = [seconds, 1]
+            else:
+                entry[0] += seconds
+                entry[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing (миллисекунды)"""
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, (seconds, _) in self.spans.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "total_ms": round(self.elapsed() * 1000, 3),
+            "spans": {
+                name: {"ms": round(seconds * 1000, 3), "count": count}
+                for name, (seconds, count) in self.spans.items()
+            },
+        }
+
+
+def start_trace(name: str) -> Token:
+    """Открыть трассу в текущем контексте (возвращает токен для finish_trace)"""
+    return _current.set(Trace(name))
+
+
+def finish_trace(token: Token) -> Optional[Trace]:
+    """Закрыть трассу, открытую start_trace"""
+    trace = _current.get()
+    _current.reset(token)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+class span:
+    """Контекстный менеджер этапа (без открытой трассы - ничего не делает)"""
+
+    __slots__ = ("name", "_trace", "_started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._trace = _current.get()
+        if self._trace is not None:
+            self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._trace is not None:
+            self._trace.add(self.name, time.perf_counter() - self._started)
+        return False
+
+
+def traced(name: str) -> Callable:
+    """Декоратор: весь вызов функции (или корутины) - этап name"""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TraceFile:
+    """
+    Трассы строками JSON в локальном файле
+
+    sample_rate - доля записываемых трасс; при превышении max_bytes файл
+    переименовывается в <имя>.1 (хранится одна предыдущая часть).
+    """
+
+    def __init__(self, path: Path, sample_rate: float = 1.0, max_bytes: int = 50 * 1024 * 1024):
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def write(self, trace: Trace, **fields: Any):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        record = {"ts": round(time.time(), 3), "pid": os.getpid(), **fields, **trace.to_dict()}
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                if self.path.exists() and self.path.stat().st_size >= self.max_bytes:
+                    os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError as e:
+                logger.warning(f"Cannot write trace to {self.path}: {e}")
@@ -0,0 +1,236 @@
+"""
+Контроль допуска для дорогих эндпоинтов (история, OHLCV)
+
+У каждого эндпоинта емкость в единицах стоимости и короткая очередь.
+Стоимость запроса оценивается по числу баров (диапазон, обрезанный по
+реальному ряду, / разрешение): узкий запрос стоит 1, широкий - не больше
+половины емкости, чтобы один запрос не занимал эндпоинт целиком. Если очередь полна, запрос
+сразу получает 429, если место не освободилось за queue_timeout - 503; в
+обоих случаях с Retry-After.
+
+Ожидающие в очереди запросы тоже занимают потоки gunicorn, поэтому общее
+число запросов в дорогих эндпоинтах ограничено max_in_flight (потоки минус
+резерв) - /health и /api/time всегда находят свободный поток.
+"""
+import asyncio
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+from src.data.resample import parse_resolution
+
+# Длина месяца для оценки числа баров
+MONTH_SECONDS = 30 * 86400
+
+
+class Rejected(Exception):
+    """Запрос не допущен: HTTP статус, причина и Retry-After (секунды)"""
+
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def estimate_bars(from_ts: int, to_ts: int, resolution: str) -> int:
+    """Оценка числа баров в ответе; неизвестное разрешение считается дневным"""
+    try:
+        seconds = parse_resolution(resolution).seconds or MONTH_SECONDS
+    except ValueError:
+        seconds = 86400
+    return max(0, int(to_ts) - int(from_ts)) // seconds + 1
+
+
+def cost_units(bars: int, bars_per_unit: int) -> int:
+    """Стоимость в единицах емкости (не меньше 1)"""
+    return max(1, math.ceil(bars / bars_per_unit))
+
+
+class _LimiterState:
+    """Общая часть синхронного и асинхронного ограничителя"""
+
+    def __init__(self, name: str, capacity: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.capacity = max(1, capacity)
+        # Дороже этого запрос не считается: остальное достается другим запросам
+        self.max_cost = max(1, self.capacity // 2)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.retry_after = max(1, math.ceil(queue_timeout))
+        self._used = 0
+        self._waiting = 0
+        self.stats = {"admitted": 0, "queued": 0, "rejected_queue": 0, "rejected_timeout": 0}
+
+    def _clamp(self, cost: int) -> int:
+        # Самый дорогой запрос занимает половину емкости, но все-таки выполняется
+        return min(max(1, cost), self.max_cost)
+
+    def _try_take(self, cost: int, queued: bool) -> bool:
+        # Новые запросы не обгоняют ожидающих
+        if self._used + cost <= self.capacity and (queued or self._waiting == 0):
+            self._used += cost
+            self.stats["admitted"] += 1
+            return True
+        return False
+
+    def _enter_queue(self):
+        if self._waiting >= self.max_queue:
+            self.stats["rejected_queue"] += 1
+            raise Rejected(429, f"{self.name}: too many queued requests", self.retry_after)
+        self._waiting += 1
+        self.stats["queued"] += 1
+
+    def _timeout(self):
+        self.stats["rejected_timeout"] += 1
+        return Rejected(503, f"{self.name}: server is busy", self.retry_after)
+
+    def status(self) -> Dict:
+        return {
+            "capacity": self.capacity,
+            "max_cost": self.max_cost,
+            "in_use": self._used,
+            "waiting": self._waiting,
+            "max_queue": self.max_queue,
+            **self.stats,
+        }
+
+
+class EndpointLimiter(_LimiterState):
+    """Ограничитель для потоков (Flask под gthread)"""
+
+    def __init__(self, name: str, capacity: int, max_queue: int, queue_timeout: float):
+        super().__init__(name, capacity, max_queue, queue_timeout)
+        self._cond = threading.Condition()
+
+    def acquire(self, cost: int) -> int:
+        """
+        Занять cost единиц (ждет в очереди не дольше queue_timeout)
+
+        Raises:
+            Rejected: Очередь полна (429) или место не освободилось (503)
+        """
+        cost = self._clamp(cost)
+        with self._cond:
+            if self._try_take(cost, queued=False):
+                return cost
+            self._enter_queue()
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while not self._try_take(cost, queued=True):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._timeout()
+                    self._cond.wait(remaining)
+                return cost
+            finally:
+                self._waiting -= 1
+
+    def release(self, cost: int):
+        with self._cond:
+            self._used -= cost
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, cost: int):
+        taken = self.acquire(cost)
+        try:
+            yield
+        finally:
+            self.release(taken)
+
+
+class AsyncEndpointLimiter(_LimiterState):
+    """Ограничитель для корутин (ASGI режим, один event loop)"""
+
+    def __init__(self, name: str, capacity: int, max_queue: int, queue_timeout: float):
+        super().__init__(name, capacity, max_queue, queue_timeout)
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        # Создается внутри работающего event loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self, cost: int) -> int:
+        cost = self._clamp(cost)
+        if self._try_take(cost, queued=False):
+            return cost
+        self._enter_queue()
+        deadline = time.monotonic() + self.queue_timeout
+        cond = self._condition()
+        try:
+            async with cond:
+                while not self._try_take(cost, queued=True):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._timeout()
+                    try:
+                        await asyncio.wait_for(cond.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            return cost
+        finally:
+            self._waiting -= 1
+
+    async def release(self, cost: int):
+        self._used -= cost
+        cond = self._condition()
+        async with cond:
+            cond.notify_all()
+
+    @asynccontextmanager
+    async def admit(self, cost: int):
+        taken = await self.acquire(cost)
+        try:
+            yield
+        finally:
+            await self.release(taken)
+
+
+class AdmissionController:
+    """Ограничители эндпоинтов и общий лимит потоков процесса"""
+
+    def __init__(
+        self,
+        limiters: Dict[str, EndpointLimiter],
+        max_in_flight: Optional[int] = None,
+        retry_after: int = 1,
+    ):
+        self.limiters = limiters
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected_busy = 0
+
+    @contextmanager
+    def admit(self, endpoint: str, cost: int):
+        """
+        Допустить запрос к endpoint со стоимостью cost
+
+        Raises:
+            Rejected: Нет свободных потоков, очередь полна или истекло ожидание
+        """
+        with self._lock:
+            if self.max_in_flight is not None and self._in_flight >= self.max_in_flight:
+                self.rejected_busy += 1
+                raise Rejected(503, "server is busy", self.retry_after)
+            self._in_flight += 1
+        try:
+            with self.limiters[endpoint].admit(cost):
+                yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def status(self) -> Dict:
+        return {
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "rejected_busy": self.rejected_busy,
+            "endpoints": {name: limiter.status() for name, limiter in self.limiters.items()},
+        }
@@ -0,0 +1,509 @@
+"""
+ASGI режим UDF сервера
+
+    uvicorn src.udf.asgi:app --host 0.0.0.0 --port 8000
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker \
+        gunicorn -c gunicorn.conf.py src.udf.asgi:app
+
+Маршруты и данные те же, что у Flask приложения (src/udf/server.py): модуль
+импортирует server и пользуется его провайдерами и реестром символов.
+История, символы, поиск, время, health и OHLCV обрабатываются корутинами:
+данные из памяти отдаются сразу (первое чтение варианта CBMA, его расчет и
+свертка баров выполняются в пуле потоков), свечи Coinglass загружает
+AsyncCoinglassClient, не занимая поток на время ответа API. Остальные
+маршруты (статика, /data/, /api/config, /api/status, ...) выполняет Flask
+приложение в пуле потоков. Flask под gunicorn остается режимом по умолчанию.
+"""
+import asyncio
+import gzip
+import io
+import json
+import logging
+import sys
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import parse_qs
+
+from src.data.async_coinglass_client import AsyncCoinglassClient
+from src.data.static_assets import accepts_encoding
+from src.udf import server
+from src.udf.admission import AsyncEndpointLimiter, Rejected
+from src.data.tracing import current_trace, finish_trace, span, start_trace
+from src.udf.request_metrics import observe_request
+from src.udf.tradingview_standards import HistoryStream
+
+logger = logging.getLogger(__name__)
+
+# Маленькие ответы не сжимаем (как Flask-Compress)
+COMPRESS_MIN_SIZE = 500
+# Крупные ответы сжимаются в пуле потоков, чтобы не задерживать event loop
+COMPRESS_IN_THREAD_SIZE = 64 * 1024
+# Потоковый ответ копит куски до этого размера перед отправкой
+STREAM_SEND_SIZE = 64 * 1024
+
+
+class Request:
+    """Разобранный HTTP запрос ASGI"""
+
+    __slots__ = ("method", "path", "query", "headers")
+
+    def __init__(self, scope: Dict[str, Any]):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        self.query = {name: values[-1] for name, values in query.items()}
+        self.headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in scope.get("headers", [])
+        }
+
+    def arg(self, name: str, default: Any = None, type: Callable = None) -> Any:
+        """Параметр запроса (как request.args.get во Flask)"""
+        value = self.query.get(name)
+        if value is None or type is None:
+            return default if value is None else value
+        try:
+            return type(value)
+        except ValueError:
+            return default
+
+
+class Response:
+    """
+    Ответ; body - байты или итератор кусков (потоковый ответ)
+
+    on_close - корутина, которая вызывается после отправки ответа
+    (освобождение слота допуска для потокового ответа).
+    """
+
+    __slots__ = ("body", "status", "content_type", "headers", "on_close")
+
+    def __init__(
+        self,
+        body: Union[bytes, Iterable[bytes]],
+        status: int = 200,
+        content_type: str = "application/json",
+        headers: Optional[List[Tuple[bytes, bytes]]] = None,
+    ):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or []
+        self.on_close: Optional[Callable[[], Awaitable]] = None
+
+
+def json_response(payload: Any, status: int = 200) -> Response:
+    with span("serialize"):
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return Response(body, status)
+
+
+def history_response(payload: Union[Dict[str, Any], HistoryStream]) -> Response:
+    """Ответ history: HistoryStream отдается кусками"""
+    if isinstance(payload, HistoryStream):
+        return Response(payload)
+    return json_response(payload)
+
+
+def rejected_response(payload: Any, rejected: Rejected) -> Response:
+    response = json_response(payload, rejected.status)
+    response.headers.append((b"retry-after", str(rejected.retry_after).encode("ascii")))
+    return response
+
+
+async def send_response(send: Callable, request: Request, response: Response):
+    headers = [
+        (b"content-type", response.content_type.encode("latin-1")),
+        (b"access-control-allow-origin", b"*"),
+        *response.headers,
+    ]
+    if not isinstance(response.body, bytes):
+        await send_stream(send, request, response, headers)
+        return
+
+    body = response.body
+    if len(body) >= COMPRESS_MIN_SIZE and accepts_encoding(
+        request.headers.get("accept-encoding", ""), "gzip"
+    ):
+        with span("compress"):
+            if len(body) >= COMPRESS_IN_THREAD_SIZE:
+                body = await asyncio.to_thread(gzip.compress, body, 6)
+            else:
+                body = gzip.compress(body, 6)
+        headers += [(b"content-encoding", b"gzip"), (b"vary", b"Accept-Encoding")]
+    headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    trace = current_trace()
+    if trace is not None:
+        headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+
+    await send({"type": "http.response.start", "status": response.status, "headers": headers})
+    await send(
+        {"type": "http.response.body", "body": b"" if request.method == "HEAD" else body}
+    )
+
+
+async def send_stream(
+    send: Callable, request: Request, response: Response, headers: List[Tuple[bytes, bytes]]
+):
+    """Chunked ответ: куски сериализуются и сжимаются по мере отправки"""
+    compressor = None
+    if accepts_encoding(request.headers.get("accept-encoding", ""), "gzip"):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        headers += [(b"content-encoding", b"gzip"), (b"vary", b"Accept-Encoding")]
+    trace = current_trace()
+    if trace is not None:
+        # Сериализация и сжатие потока идут после заголовков и в разбивку не входят
+        headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+
+    await send({"type": "http.response.start", "status": response.status, "headers": headers})
+    if request.method == "HEAD":
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    buffer: List[bytes] = []
+    size = 0
+    for chunk in response.body:
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            buffer.append(chunk)
+            size += len(chunk)
+        if size >= STREAM_SEND_SIZE:
+            await send({"type": "http.response.body", "body": b"".join(buffer), "more_body": True})
+            buffer, size = [], 0
+    if compressor is not None:
+        buffer.append(compressor.flush())
+    await send({"type": "http.response.body", "body": b"".join(buffer)})
+
+
+# =============================================
+# COINGLASS (АСИНХРОННО)
+# =============================================
+
+_async_client: Optional[AsyncCoinglassClient] = None
+
+
+def async_client() -> AsyncCoinglassClient:
+    """Асинхронный клиент процесса (общие с синхронным rate limiter и breaker'ы)"""
+    global _async_client
+    if _async_client is None:
+        base = getattr(server.coinglass_client, "client", server.coinglass_client)
+        _async_client = AsyncCoinglassClient(client=base)
+    return _async_client
+
+
+async def fetch_candles(symbol: str, interval: str, days: int = 365):
+    """Свечи Coinglass через кэш (если включен), без блокировки event loop"""
+    upstream = async_client()
+    cached = server.coinglass_client
+    if hasattr(cached, "get_crypto_candles_async"):
+        return await cached.get_crypto_candles_async(
+            upstream.get_crypto_candles, symbol, days, interval
+        )
+    return await upstream.get_crypto_candles(symbol, days, interval)
+
+
+# =============================================
+# КОНТРОЛЬ ДОПУСКА
+# =============================================
+
+# Потоки event loop не занимает ожидание, поэтому общий лимит потоков не нужен
+_settings = server.config.admission
+ADMISSION: Optional[Dict[str, AsyncEndpointLimiter]] = (
+    {
+        "history": AsyncEndpointLimiter(
+            "history", _settings.history_capacity, _settings.history_queue, _settings.queue_timeout
+        ),
+        "ohlcv": AsyncEndpointLimiter(
+            "ohlcv", _settings.ohlcv_capacity, _settings.ohlcv_queue, _settings.queue_timeout
+        ),
+    }
+    if _settings.enabled
+    else None
+)
+
+
+# =============================================
+# UDF API ENDPOINTS
+# =============================================
+
+
+async def udf_history(request: Request) -> Response:
+    """UDF исторические данные"""
+    symbol = request.arg("symbol", "").upper()
+    resolution = request.arg("resolution", "1D")
+    from_ts = request.arg("from", 0, int)
+    to_ts = request.arg("to", int(time.time()), int)
+    ma_period = request.arg("ma_period", 14, int)
+    smoothing = server.parse_switch(request.arg("smoothing"))
+
+    logger.debug("History request: %s, %s, %s-%s", symbol, resolution, from_ts, to_ts)
+
+    # Первое чтение варианта, его расчет и свертка баров идут в пуле потоков,
+    # чтобы не останавливать остальные соединения
+    ready = server.local_history_ready(symbol, resolution, ma_period, smoothing)
+    args = (symbol, resolution, from_ts, to_ts, ma_period, smoothing, ready)
+
+    if ADMISSION is None:
+        return await history(*args)
+    limiter = ADMISSION["history"]
+    cost_args = (symbol, from_ts, to_ts, resolution)
+    try:
+        cost = (
+            server.history_cost(*cost_args)
+            if ready
+            else await asyncio.to_thread(server.history_cost, *cost_args)
+        )
+        taken = await limiter.acquire(cost)
+    except Rejected as e:
+        logger.warning("Rejected %s: %s", request.path, e.reason)
+        return rejected_response(server.history_payload(status="error", errmsg=e.reason), e)
+    try:
+        response = await history(*args)
+    except BaseException:
+        await limiter.release(taken)
+        raise
+    if isinstance(response.body, bytes):
+        await limiter.release(taken)
+    else:
+        # Поток сериализуется при отправке - слот держим до ее конца
+        response.on_close = lambda: limiter.release(taken)
+    return response
+
+
+async def history(
+    symbol: str,
+    resolution: str,
+    from_ts: int,
+    to_ts: int,
+    ma_period: int,
+    smoothing: bool,
+    ready: bool,
+) -> Response:
+    args = (symbol, resolution, from_ts, to_ts, ma_period, smoothing)
+    if ready:
+        payload = server.local_history(*args)
+    else:
+        payload = await asyncio.to_thread(server.local_history, *args)
+    if payload is not None:
+        return history_response(payload)
+
+    if not server.coinglass_client:
+        logger.warning("Coinglass client not available")
+        return json_response(
+            server.history_payload(status="error", errmsg="Coinglass client not initialized")
+        )
+    if server.symbol_registry().source(symbol) != "coinglass":
+        return json_response(
+            server.history_payload(status="error", errmsg=f"Symbol {symbol} not supported")
+        )
+
+    try:
+        candles = await server.coinglass_engine.get_async(symbol, resolution, fetch_candles)
+    except ValueError as e:
+        return json_response(server.history_payload(status="error", errmsg=str(e)))
+    except Exception as e:
+        logger.error(f"Error getting {symbol} history from Coinglass: {e}")
+        return json_response(server.history_payload(status="error", errmsg=str(e)))
+    return history_response(server.coinglass_history(symbol, candles, from_ts, to_ts))
+
+
+async def udf_symbols(request: Request) -> Response:
+    """UDF символы"""
+    symbol = request.arg("symbol", "").upper()
+    if not symbol:
+        return json_response({"error": "Symbol not specified"}, 400)
+
+    payload = server.symbol_registry().symbol_payload(symbol)
+    if payload is None:
+        return json_response({"error": "Symbol not found"}, 404)
+    return Response(payload)
+
+
+async def udf_search(request: Request) -> Response:
+    """UDF поиск символов"""
+    return json_response(
+        server.symbol_registry().search(
+            request.arg("query", ""),
+            limit=request.arg("limit", 10, int),
+            symbol_type=request.arg("type", ""),
+            exchange=request.arg("exchange", ""),
+        )
+    )
+
+
+async def udf_time(request: Request) -> Response:
+    """UDF время сервера"""
+    return Response(str(int(time.time())).encode("ascii"), content_type="text/html; charset=utf-8")
+
+
+async def crypto_ohlcv(request: Request) -> Response:
+    """OHLCV данные криптовалют"""
+    symbol = request.arg("symbol", "BTC")
+    days = server.clamp_days(request.arg("days", 100, int))
+
+    if not server.coinglass_client:
+        return json_response({"error": "Coinglass client not available"}, 503)
+    try:
+        if ADMISSION is None:
+            candles = await fetch_candles(symbol, "4h", days)
+        else:
+            async with ADMISSION["ohlcv"].admit(server.ohlcv_cost(days)):
+                candles = await fetch_candles(symbol, "4h", days)
+        return json_response({"symbol": symbol, "data": candles.to_rows() if candles else None})
+    except Rejected as e:
+        logger.warning("Rejected %s: %s", request.path, e.reason)
+        return rejected_response({"error": e.reason}, e)
+    except Exception as e:
+        logger.error(f"Error getting crypto OHLCV: {e}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def health_check(request: Request) -> Response:
+    """Health check endpoint"""
+    return json_response(
+        {
+            "status": "healthy",
+            "timestamp": server.datetime.now().isoformat(),
+            "uptime": "running",
+        }
+    )
+
+
+ROUTES: Dict[str, Callable[[Request], Awaitable[Response]]] = {
+    "/api/history": udf_history,
+    "/api/symbols": udf_symbols,
+    "/api/search": udf_search,
+    "/api/time": udf_time,
+    "/api/crypto/ohlcv": crypto_ohlcv,
+    "/health": health_check,
+}
+
+
+# =============================================
+# ОСТАЛЬНЫЕ МАРШРУТЫ: FLASK В ПУЛЕ ПОТОКОВ
+# =============================================
+
+
+def build_environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    """WSGI environ для запроса ASGI"""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        # WSGI ожидает байты пути, декодированные как latin-1
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server_name),
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def run_wsgi(environ: Dict[str, Any]) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """Выполнить Flask приложение и собрать ответ целиком"""
+    started: Dict[str, Any] = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [
+            (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers
+        ]
+
+    result = server.app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return started["status"], started["headers"], body
+
+
+async def call_wsgi(scope: Dict[str, Any], receive: Callable, send: Callable):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+
+    status, headers, content = await asyncio.to_thread(run_wsgi, build_environ(scope, body))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+
+# =============================================
+# ПРИЛОЖЕНИЕ ASGI
+# =============================================
+
+
+async def lifespan(receive: Callable, send: Callable):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            server.start_background_jobs()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _async_client is not None:
+                await _async_client.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope: Dict[str, Any], receive: Callable, send: Callable):
+    """Точка входа ASGI"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    handler = ROUTES.get(scope["path"]) if scope["method"] in ("GET", "HEAD") else None
+    if handler is None:
+        await call_wsgi(scope, receive, send)
+        return
+
+    request = Request(scope)
+    started = time.perf_counter()
+    token = start_trace(handler.__name__) if server.config.tracing.enabled else None
+    try:
+        response = await handler(request)
+    except Exception as e:
+        logger.error(f"Unhandled error in {request.path}: {e}")
+        response = json_response({"error": "Internal server error"}, 500)
+    try:
+        await send_response(send, request, response)
+    finally:
+        if response.on_close is not None:
+            await response.on_close()
+    if token is not None:
+        server.finish_request_trace(finish_trace(token), path=request.path, status=response.status)
+
+    # Маршруты Flask учитывает сам (after_request)
+    if server.config.metrics.enabled:
+        endpoint = handler.__name__
+        klass = (
+            server.symbol_class(request.arg("symbol", ""))
+            if endpoint in server.SYMBOL_ENDPOINTS
+            else "none"
+        )
+        observe_request(endpoint, klass, response.status, time.perf_counter() - started)
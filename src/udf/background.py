@@ -0,0 +1,168 @@
+"""
+Фоновые задачи UDF сервера и выбор ведущего воркера
+
+Каждый воркер gunicorn запускает один поток BackgroundJobs. Задачи, которые
+ходят во внешние API (обновление свечей Coinglass), выполняет только ведущий
+воркер - владелец файловой блокировки logs/udf-leader.lock. Результаты он
+публикует через общий кэш, остальные воркеры берут их оттуда. Блокировку
+снимает ядро, когда процесс ведущего завершается, и на следующем такте ее
+забирает другой воркер.
+"""
+import fcntl
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:
+    """Ведущий среди процессов на одной машине через flock"""
+
+    def __init__(self, lock_path: Path):
+        self.lock_path = Path(lock_path)
+        self._fd: Optional[int] = None
+        self._pid = os.getpid()
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None and self._pid == os.getpid()
+
+    def try_acquire(self) -> bool:
+        """Стать ведущим, если блокировка свободна (не ждет)"""
+        if self._pid != os.getpid():
+            # Дескриптор унаследован через fork - блокировка принадлежит родителю
+            self._fd = None
+            self._pid = os.getpid()
+        if self._fd is not None:
+            return True
+
+        try:
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            logger.warning(f"Cannot open leader lock {self.lock_path}: {e}")
+            return False
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        self._fd = fd
+        self.heartbeat()
+        logger.info(f"Worker {os.getpid()} became leader ({self.lock_path})")
+        return True
+
+    def heartbeat(self):
+        """Записать pid и время в файл блокировки (для диагностики)"""
+        if self._fd is None:
+            return
+        data = f"{os.getpid()} {int(time.time())}\n".encode("ascii")
+        try:
+            os.ftruncate(self._fd, 0)
+            os.pwrite(self._fd, data, 0)
+        except OSError:
+            pass
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        except OSError:
+            pass
+        self._fd = None
+
+    @staticmethod
+    def current_leader(lock_path: Path) -> Optional[Dict[str, int]]:
+        """pid и время последнего такта ведущего (по файлу блокировки)"""
+        try:
+            pid, beat = Path(lock_path).read_text().split()
+            return {"pid": int(pid), "heartbeat": int(beat)}
+        except (OSError, ValueError):
+            return None
+
+
+@dataclass
+class Job:
+    """Периодическая задача"""
+
+    name: str
+    interval: float
+    fn: Callable[[], None]
+    leader_only: bool = True
+    last_run: float = 0.0
+    runs: int = 0
+    errors: int = 0
+
+
+class BackgroundJobs:
+    """Один поток на воркер: такт выборов и запуск задач, у которых подошел срок"""
+
+    def __init__(self, election: LeaderElection, tick: float = 5.0):
+        self.election = election
+        self.tick = tick
+        self.jobs: List[Job] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, name: str, interval: float, fn: Callable[[], None], leader_only: bool = True):
+        self.jobs.append(Job(name, interval, fn, leader_only))
+
+    def start(self):
+        """Запустить поток (в воркере, после fork)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="udf-background", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.election.release()
+
+    def run_once(self):
+        """Один такт: выборы, затем задачи с истекшим интервалом"""
+        leader = self.election.try_acquire()
+        if leader:
+            self.election.heartbeat()
+
+        now = time.monotonic()
+        for job in self.jobs:
+            if job.leader_only and not leader:
+                continue
+            if job.last_run and now - job.last_run < job.interval:
+                continue
+            job.last_run = now
+            try:
+                job.fn()
+                job.runs += 1
+            except Exception as e:
+                job.errors += 1
+                logger.error(f"Background job {job.name} failed: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.tick)
+
+    def status(self) -> Dict:
+        return {
+            "leader": self.election.is_leader,
+            "jobs": {
+                job.name: {
+                    "interval": job.interval,
+                    "leader_only": job.leader_only,
+                    "runs": job.runs,
+                    "errors": job.errors,
+                }
+                for job in self.jobs
+            },
+        }
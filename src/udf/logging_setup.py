@@ -0,0 +1,185 @@
+"""
+Логирование UDF сервера вне потока запроса
+
+Поток запроса только кладет запись в очередь (QueueHandler), а вывод в
+stderr выполняет поток QueueListener. Запись в очереди не форматируется:
+сообщение собирается из шаблона и аргументов (%-стиль, logger.info("... %s", x))
+уже в потоке логирования, поэтому на горячем пути логгеры вызываются
+с аргументами, а не с f-строками.
+
+Повторяющиеся сообщения ограничивает SampledLogFilter: один шаблон
+(логгер + msg) проходит не больше burst раз за window секунд, остальные
+отбрасываются и считаются в udf_log_suppressed_total; в начале следующего
+окна пишется одна строка сводки. ERROR и выше проходят всегда.
+
+После fork (воркеры gunicorn с preload) очередь и поток логирования
+создаются в дочернем процессе заново.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.data.metrics import REGISTRY
+
+LOG_RECORDS = REGISTRY.counter(
+    "udf_log_records_total", "Log records accepted by level", ("level",)
+)
+LOG_SUPPRESSED = REGISTRY.counter(
+    "udf_log_suppressed_total", "Log records dropped by sampling or a full queue", ("logger", "reason")
+)
+
+DEFAULT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Сколько разных шаблонов помнит фильтр (f-строки дают новый шаблон на каждый вызов)
+MAX_SAMPLED_KEYS = 2048
+
+
+class SampledLogFilter(logging.Filter):
+    """Не больше burst записей одного шаблона за window секунд"""
+
+    def __init__(self, burst: int = 5, window: float = 10.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        # (логгер, шаблон) -> [начало окна, пропущено, отброшено]
+        self._windows: Dict[Tuple[str, Any], List] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        dropped = 0
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                if entry is None and len(self._windows) >= MAX_SAMPLED_KEYS:
+                    self._windows.clear()
+                dropped = entry[2] if entry is not None else 0
+                self._windows[key] = [now, 1, 0]
+            elif entry[1] < self.burst:
+                entry[1] += 1
+            else:
+                entry[2] += 1
+                LOG_SUPPRESSED.inc(record.name, "sampled")
+                return False
+        if dropped:
+            logging.getLogger(record.name).log(
+                record.levelno, "%d similar messages suppressed: %r", dropped, record.msg
+            )
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования в потоке запроса
+
+    Стандартный prepare() собирает сообщение и traceback до постановки в
+    очередь; здесь запись уходит как есть (она остается в этом процессе).
+    Аргументы не должны меняться после вызова логгера - на горячем пути это
+    числа и строки.
+    """
+
+    def __init__(self, max_pending: int = 10000):
+        # SimpleQueue без блокировок Queue; предел проверяется по qsize()
+        super().__init__(queue.SimpleQueue())
+        self.max_pending = max_pending
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.max_pending and self.queue.qsize() >= self.max_pending:
+            # Вывод не успевает - теряем запись, а не задерживаем запрос
+            LOG_SUPPRESSED.inc(record.name, "queue_full")
+            return
+        self.queue.put_nowait(record)
+        LOG_RECORDS.inc(record.levelname)
+
+
+class _State:
+    handler: Optional[DeferredQueueHandler] = None
+    listener: Optional[QueueListener] = None
+    output: List[logging.Handler] = []
+    sampler: Optional[SampledLogFilter] = None
+
+
+def _start_listener():
+    _State.handler.queue = queue.SimpleQueue()
+    _State.listener = QueueListener(
+        _State.handler.queue, *_State.output, respect_handler_level=True
+    )
+    _State.listener.start()
+
+
+def _stop_listener():
+    if _State.listener is not None:
+        _State.listener.stop()
+        _State.listener = None
+
+
+def _restart_after_fork():
+    # Поток логирования родителя в дочерний процесс не переходит, а его
+    # очередь могла быть заблокирована в момент fork - создаем обе заново.
+    # Записи, не выведенные до fork, выведет родитель.
+    if _State.handler is not None:
+        _State.listener = None
+        _start_listener()
+
+
+def setup_logging(
+    level: str = "INFO",
+    fmt: str = DEFAULT_FORMAT,
+    queued: bool = True,
+    queue_size: int = 10000,
+    sample_burst: int = 5,
+    sample_window: float = 10.0,
+):
+    """
+    Настроить корневой логгер процесса (повторный вызов ничего не делает)
+
+    Уже настроенные обработчики корневого логгера (если есть) переносятся
+    за очередь; иначе создается StreamHandler, как в logging.basicConfig.
+    """
+    root = logging.getLogger()
+    if _State.handler is not None or _State.sampler is not None:
+        return
+    root.setLevel(level.upper())
+
+    output = list(root.handlers) or [logging.StreamHandler()]
+    for handler in output:
+        if handler.formatter is None:
+            handler.setFormatter(logging.Formatter(fmt))
+
+    _State.sampler = SampledLogFilter(sample_burst, sample_window)
+    if not queued:
+        for handler in output:
+            handler.addFilter(_State.sampler)
+            if handler not in root.handlers:
+                root.addHandler(handler)
+        return
+
+    _State.output = output
+    _State.handler = DeferredQueueHandler(max(0, queue_size))
+    _State.handler.addFilter(_State.sampler)
+    _start_listener()
+    root.handlers = [_State.handler]
+    os.register_at_fork(after_in_child=_restart_after_fork)
+    # При выходе выводим все, что осталось в очереди
+    atexit.register(_stop_listener)
+
+
+def logging_status() -> Dict[str, Any]:
+    suppressed = sum(LOG_SUPPRESSED.samples().values())
+    return {
+        "queued": _State.handler is not None,
+        "pending": _State.handler.queue.qsize() if _State.handler is not None else 0,
+        "suppressed": int(suppressed),
+        "sample_burst": _State.sampler.burst if _State.sampler else None,
+        "sample_window": _State.sampler.window if _State.sampler else None,
+    }
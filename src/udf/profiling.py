@@ -0,0 +1,224 @@
+"""
+Профилирование воркеров под реальной нагрузкой (по запросу, с ограничениями)
+
+Три инструмента, все пишут файлы в стандартных форматах в logs/profiles/:
+    - cProfile одного запроса (заголовок X-Profile-Token) -> .prof
+      (pstats, snakeviz);
+    - сэмплирующий профилировщик всех потоков воркера -> .folded
+      (свернутые стеки для flamegraph.pl и speedscope);
+    - tracemalloc: топ выделений памяти за окно -> .txt и .tracemalloc
+      (tracemalloc.Snapshot.load).
+
+Каждый вид запускается не чаще min_interval секунд на воркер и не более
+одного одновременно; файлов в каталоге хранится не больше max_files.
+Без токена администратора профилирование по запросу выключено.
+"""
+import cProfile
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingBusy(Exception):
+    """Профилирование этого вида сейчас недоступно (идет или было недавно)"""
+
+    def __init__(self, kind: str, retry_after: int):
+        super().__init__(f"{kind} profiling is busy, retry in {retry_after}s")
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+class Profiler:
+    """Профилирование процесса: cProfile запросов, сэмплы стеков, tracemalloc"""
+
+    def __init__(
+        self,
+        directory: Path,
+        token: str = "",
+        min_interval: float = 60.0,
+        max_files: int = 50,
+        sample_hz: int = 100,
+        max_seconds: float = 30.0,
+        top: int = 50,
+    ):
+        self.directory = Path(directory)
+        self.token = token
+        self.min_interval = min_interval
+        self.max_files = max_files
+        self.sample_hz = max(1, min(sample_hz, 1000))
+        self.max_seconds = max_seconds
+        self.top = top
+        self._lock = threading.Lock()
+        # вид -> время последнего запуска; виды, которые идут сейчас
+        self._last_run: Dict[str, float] = {}
+        self._running: Dict[str, bool] = {}
+        self.stats = {"request": 0, "sample": 0, "memory": 0, "refused": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    def authorized(self, supplied: Optional[str]) -> bool:
+        """Токен администратора (сравнение за постоянное время)"""
+        return self.enabled and bool(supplied) and hmac.compare_digest(supplied, self.token)
+
+    # -- ограничения -----------------------------------------------------
+
+    def _begin(self, kind: str):
+        """Занять вид профилирования или выбросить ProfilingBusy"""
+        with self._lock:
+            now = time.monotonic()
+            last = self._last_run.get(kind)
+            if self._running.get(kind) or (last is not None and now - last < self.min_interval):
+                self.stats["refused"] += 1
+                wait = self.min_interval - (now - last) if last is not None else self.min_interval
+                raise ProfilingBusy(kind, max(1, int(wait + 0.999)))
+            self._running[kind] = True
+            self._last_run[kind] = now
+
+    def _end(self, kind: str):
+        with self._lock:
+            self._running[kind] = False
+            self.stats[kind] += 1
+
+    def _target(self, kind: str, label: str, suffix: str) -> Path:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return self.directory / f"{kind}-{stamp}-{os.getpid()}-{label}{suffix}"
+
+    def _prune(self):
+        """Удалить самые старые файлы сверх max_files"""
+        try:
+            files = sorted(
+                (path for path in self.directory.iterdir() if path.is_file()),
+                key=lambda path: path.stat().st_mtime,
+            )
+        except OSError:
+            return
+        for path in files[: max(0, len(files) - self.max_files)]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    # -- cProfile одного запроса ----------------------------------------
+
+    def start_request(self) -> cProfile.Profile:
+        """Начать профилирование текущего запроса (в потоке запроса)"""
+        self._begin("request")
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Другой профилировщик уже активен в процессе
+            self._end("request")
+            raise ProfilingBusy("request", 1)
+        return profile
+
+    def finish_request(self, profile: cProfile.Profile, label: str) -> Path:
+        """Остановить профилирование запроса и записать .prof"""
+        profile.disable()
+        try:
+            target = self._target("request", label, ".prof")
+            profile.dump_stats(str(target))
+            self._prune()
+            logger.info(f"Request profile written to {target}")
+            return target
+        finally:
+            self._end("request")
+
+    # -- сэмплирующий профилировщик -------------------------------------
+
+    def start_sampling(self, seconds: float, label: str = "manual") -> Path:
+        """Запустить окно сэмплирования в отдельном потоке; возвращает путь результата"""
+        self._begin("sample")
+        seconds = max(0.1, min(seconds, self.max_seconds))
+        target = self._target("sample", label, ".folded")
+        threading.Thread(
+            target=self._sample, args=(seconds, target), name="udf-profiler", daemon=True
+        ).start()
+        return target
+
+    def _sample(self, seconds: float, target: Path):
+        stacks: Counter = Counter()
+        own = threading.get_ident()
+        interval = 1.0 / self.sample_hz
+        deadline = time.monotonic() + seconds
+        samples = 0
+        try:
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                        frame = frame.f_back
+                    stacks[";".join(reversed(stack))] += 1
+                samples += 1
+                time.sleep(interval)
+            lines = [f"{stack} {count}\n" for stack, count in stacks.most_common()]
+            target.write_text("".join(lines), encoding="utf-8")
+            self._prune()
+            logger.info(f"Sampling profile ({samples} samples, {seconds:.0f}s) written to {target}")
+        except Exception as e:
+            logger.error(f"Sampling profiler failed: {e}")
+        finally:
+            self._end("sample")
+
+    # -- tracemalloc ----------------------------------------------------
+
+    def start_memory(self, seconds: float, label: str = "manual") -> Path:
+        """Отслеживать выделения памяти seconds секунд, затем записать топ"""
+        self._begin("memory")
+        if tracemalloc.is_tracing():
+            self._end("memory")
+            raise ProfilingBusy("memory", 1)
+        seconds = max(1.0, min(seconds, self.max_seconds))
+        target = self._target("memory", label, ".txt")
+        tracemalloc.start(25)
+        timer = threading.Timer(seconds, self._dump_memory, args=(target,))
+        timer.daemon = True
+        timer.start()
+        return target
+
+    def _dump_memory(self, target: Path):
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            snapshot = snapshot.filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),)
+            )
+            lines = [f"traced: current={current / 1024:.0f}KB peak={peak / 1024:.0f}KB\n"]
+            for stat in snapshot.statistics("lineno")[: self.top]:
+                lines.append(f"{stat}\n")
+            target.write_text("".join(lines), encoding="utf-8")
+            snapshot.dump(str(target.with_suffix(".tracemalloc")))
+            self._prune()
+            logger.info(f"Memory profile written to {target}")
+        except Exception as e:
+            logger.error(f"Memory profiler failed: {e}")
+        finally:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self._end("memory")
+
+    def status(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "directory": str(self.directory),
+            "running": [kind for kind, running in self._running.items() if running],
+            **self.stats,
+        }
@@ -0,0 +1,121 @@
+"""
+Метрики запросов UDF сервера и выдача /metrics
+
+Каждый воркер gunicorn считает свои запросы. Фоновая задача воркера
+периодически пишет снимок в METRICS_DIR/<pid>.json, а /metrics складывает
+свежий снимок своего процесса со снимками остальных живых воркеров - так
+Prometheus видит весь сервер, в какой бы воркер ни попал запрос.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from src.data.artifacts import write_atomic
+from src.data.metrics import REGISTRY, merge_snapshots, render
+
+logger = logging.getLogger(__name__)
+
+REQUESTS = REGISTRY.counter(
+    "udf_requests_total", "HTTP requests by endpoint, symbol class and status", ("endpoint", "symbol_class", "status")
+)
+ERRORS = REGISTRY.counter(
+    "udf_request_errors_total", "HTTP requests answered with 5xx", ("endpoint", "symbol_class")
+)
+LATENCY = REGISTRY.histogram(
+    "udf_request_duration_seconds",
+    "Request handling time by endpoint and symbol class",
+    ("endpoint", "symbol_class"),
+)
+
+
+def observe_request(endpoint: str, symbol_class: str, status: int, seconds: float):
+    """Учесть один запрос (вызывается на каждом запросе)"""
+    LATENCY.observe(seconds, endpoint, symbol_class)
+    REQUESTS.inc(endpoint, symbol_class, str(status))
+    if status >= 500:
+        ERRORS.inc(endpoint, symbol_class)
+
+
+def cache_collectors(caches: Dict[str, Tuple[Any, Sequence[str], Sequence[str]]]):
+    """
+    Зарегистрировать метрики кэшей
+
+    Доля попаданий не публикуется: отношение из разных воркеров нельзя
+    сложить, поэтому отдаются счетчики попаданий и промахов, а долю считает
+    Prometheus (rate по outcome="hit" к rate по всем outcome).
+
+    Args:
+        caches: имя -> (функция, возвращающая словарь статистики или None,
+            ключи попаданий, ключи промахов)
+    """
+
+    def events() -> Iterable:
+        for name, (get_stats, _, _) in caches.items():
+            stats = get_stats()
+            for result, value in (stats or {}).items():
+                yield (name, result), value
+
+    def lookups() -> Iterable:
+        for name, (get_stats, hit_keys, miss_keys) in caches.items():
+            stats = get_stats()
+            if not stats:
+                continue
+            yield (name, "hit"), sum(stats.get(key, 0) for key in hit_keys)
+            yield (name, "miss"), sum(stats.get(key, 0) for key in miss_keys)
+
+    REGISTRY.collector(
+        "udf_cache_events_total", "Cache statistics by cache and result", ("cache", "result"), events
+    )
+    REGISTRY.collector(
+        "udf_cache_lookups_total", "Cache lookups by cache and outcome", ("cache", "outcome"), lookups
+    )
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def publish_snapshot(directory: Path):
+    """Записать снимок метрик процесса (фоновая задача каждого воркера)"""
+    directory = Path(directory)
+    write_atomic(directory / f"{os.getpid()}.json", json.dumps(REGISTRY.snapshot()).encode("utf-8"))
+
+
+def worker_snapshots(directory: Optional[Path]) -> List[Dict[str, Any]]:
+    """Снимки остальных живых воркеров (файлы завершившихся удаляются)"""
+    if not directory:
+        return []
+    snapshots = []
+    own = os.getpid()
+    for path in Path(directory).glob("*.json"):
+        try:
+            pid = int(path.stem)
+        except ValueError:
+            continue
+        if pid == own:
+            continue
+        if not _alive(pid):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            continue
+        try:
+            snapshots.append(json.loads(path.read_bytes()))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def render_metrics(directory: Optional[Path]) -> str:
+    """Текст /metrics: свой процесс плюс остальные воркеры"""
+    snapshots = [REGISTRY.snapshot(), *worker_snapshots(directory)]
+    return render(merge_snapshots(snapshots))
@@ -3,54 +3,263 @@ CBMA Index UDF Server
 Сервер для TradingView UDF API с данными CBMA индекса
 """
 
-from src.data.coinglass_client import CoinglassClient
+from src.data.cache_backend import create_cache_backend
+from src.data.cbma_calculator import _parse_date
+from src.data.coinglass_client import CANDLES_LIMIT, INTERVAL_SECONDS, CoinglassClient
+from src.data.coinglass_cache import CachedCoinglassClient
+from src.data.candle_store import CandleStore
 from src.data.cbma_provider import CBMAProvider
+from src.data.market_store import MarketStore
+from src.data.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from src.data.resolution_engine import ResolutionEngine
+from src.data.static_assets import AssetManifest, StaticAsset
+from src.data.tracing import TraceFile, finish_trace, span, start_trace
+from src.udf.admission import (
+    AdmissionController,
+    EndpointLimiter,
+    Rejected,
+    cost_units,
+    estimate_bars,
+)
+from src.udf.background import BackgroundJobs, LeaderElection
+from src.udf.logging_setup import logging_status, setup_logging
+from src.udf.profiling import Profiler, ProfilingBusy
+from src.udf.request_metrics import (
+    cache_collectors,
+    observe_request,
+    publish_snapshot,
+    render_metrics,
+)
+from src.udf.symbol_registry import SymbolRegistry, build_symbol_registry
+from src.udf.tradingview_standards import HistoryStream, TradingViewFormatter
+from src.udf.worker_stats import worker_report
 from config import config
 import logging
+import mimetypes
+import os
 from datetime import datetime
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+from flask import Flask, Response, g, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
 from flask_compress import Compress
+from werkzeug.security import safe_join
 import sys
+import threading
+import time
+from contextlib import ExitStack
+from functools import wraps
 
 # Добавляем путь к src модулям
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Настройка логирования: вывод в отдельном потоке, повторы ограничены
+setup_logging(
+    config.logging.level,
+    config.logging.format,
+    queued=config.logging.queue,
+    queue_size=config.logging.queue_size,
+    sample_burst=config.logging.sample_burst,
+    sample_window=config.logging.sample_window,
 )
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app, origins=["*"])
 
-# Включаем автоматическое сжатие всех ответов для экономии трафика
+# Эндпоинты, у которых в метриках различается класс символа
+SYMBOL_ENDPOINTS = {"udf_history", "udf_symbols", "crypto_ohlcv"}
+
+
+def symbol_class(symbol: str) -> str:
+    """Класс символа для меток метрик: cbma, market, crypto"""
+    if not symbol:
+        return "none"
+    symbol = symbol.upper()
+    if symbol == "CBMA":
+        return "cbma"
+    if market_store is not None and symbol in market_store:
+        return "market"
+    return "crypto"
+
+
+def project_path(value: str) -> Optional[Path]:
+    """Путь из конфигурации (относительные - от корня проекта); пусто - None"""
+    if not value:
+        return None
+    path = Path(value)
+    return path if path.is_absolute() else Path(__file__).parent.parent.parent / path
+
+
+def build_trace_file() -> Optional[TraceFile]:
+    settings = config.tracing
+    path = project_path(settings.file) if settings.enabled else None
+    if path is None:
+        return None
+    return TraceFile(path, settings.sample_rate, settings.file_max_mb * 1024 * 1024)
+
+
+trace_file = build_trace_file()
+
+
+def finish_request_trace(trace, **fields):
+    """Записать трассу запроса в файл (если включен)"""
+    if trace_file is not None and trace is not None:
+        trace_file.write(trace, **fields)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if config.tracing.enabled:
+        g.trace_token = start_trace(request.endpoint or "not_found")
+
+
+# Регистрируется раньше Flask-Compress и потому выполняется после него:
+# время запроса включает сжатие
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    endpoint = request.endpoint or "not_found"
+    if started is not None and config.metrics.enabled:
+        klass = symbol_class(request.args.get("symbol", "")) if endpoint in SYMBOL_ENDPOINTS else "none"
+        observe_request(endpoint, klass, response.status_code, time.perf_counter() - started)
+
+    token = g.pop("trace_token", None)
+    if token is not None:
+        compress_started = g.pop("compress_started", None)
+        trace = finish_trace(token)
+        if compress_started is not None and "Content-Encoding" in response.headers:
+            trace.add("compress", time.perf_counter() - compress_started)
+        response.headers["Server-Timing"] = trace.server_timing()
+        finish_request_trace(trace, path=request.path, status=response.status_code)
+    return response
+
+
+# Включаем автоматическое сжатие всех ответов для экономии трафика.
+# Потоковые ответы (большая история) сжимаются по кускам, gzip - тоже
+app.config["COMPRESS_ALGORITHM_STREAMING"] = ["zstd", "br", "gzip", "deflate"]
 Compress(app)
 
+
+# Регистрируется после Flask-Compress и выполняется перед ним: начало сжатия
+@app.after_request
+def mark_compress_start(response):
+    if "trace_token" in g:
+        g.compress_started = time.perf_counter()
+    return response
+
+
+# =============================================
+# ПРОФИЛИРОВАНИЕ
+# =============================================
+
+PROFILE_HEADER = "X-Profile-Token"
+
+profiler = Profiler(
+    project_path(config.profiling.dir),
+    token=config.profiling.token,
+    min_interval=config.profiling.min_interval,
+    max_files=config.profiling.max_files,
+    sample_hz=config.profiling.sample_hz,
+    max_seconds=config.profiling.max_seconds,
+)
+
+
+@app.before_request
+def start_request_profile():
+    """cProfile запроса с токеном администратора (не чаще min_interval)"""
+    supplied = request.headers.get(PROFILE_HEADER)
+    if supplied is None or not profiler.enabled or request.path.startswith("/api/admin/"):
+        return None
+    if not profiler.authorized(supplied):
+        return jsonify({"error": "Invalid profiling token"}), 403
+    try:
+        g.request_profile = profiler.start_request()
+    except ProfilingBusy as e:
+        g.profile_refused = e
+    return None
+
+
+@app.after_request
+def finish_request_profile(response):
+    profile = g.pop("request_profile", None)
+    if profile is not None:
+        target = profiler.finish_request(profile, request.endpoint or "not_found")
+        response.headers["X-Profile"] = target.name
+    refused = g.pop("profile_refused", None)
+    if refused is not None:
+        response.headers["X-Profile"] = f"busy; retry-after={refused.retry_after}"
+    return response
+
+
+def sample_periodically():
+    """Периодическое окно сэмплирования (фоновая задача каждого воркера)"""
+    try:
+        profiler.start_sampling(config.profiling.sample_seconds, label="periodic")
+    except ProfilingBusy:
+        pass
+
+
 # Глобальные переменные
 cbma_provider = None
 coinglass_client = None
+market_store = None
+market_engine = None
+coinglass_engine = None
+# (версия хранилища рыночных данных, реестр)
+_symbol_registry = None
+_registry_lock = threading.Lock()
 
 
 def init_providers():
     """Инициализация провайдеров данных"""
-    global cbma_provider, coinglass_client
+    global cbma_provider, coinglass_client, market_store
+    global market_engine, coinglass_engine
 
     try:
         # Путь к данным
         data_dir = Path(__file__).parent.parent.parent / "data"
         cbma_file = data_dir / "CBMA.json"
 
+        # Общий кэш воркеров (SQLite/Redis), если настроен
+        shared_cache = create_cache_backend(
+            config.shared_cache.url, max_entries=config.shared_cache.max_entries
+        )
+        if shared_cache is not None:
+            logger.info(f"Общий кэш: {shared_cache.name}")
+
         # Инициализация CBMA провайдера
-        cbma_provider = CBMAProvider(cbma_file)
+        cbma_provider = CBMAProvider(
+            cbma_file, shared=shared_cache, ma_periods=config.builder.ma_periods
+        )
         logger.info(f"CBMA Provider инициализирован: {cbma_file}")
 
+        # Рыночные данные из CSV (собирает builder, колонки открываются через mmap)
+        market_store = MarketStore(data_dir / "market")
+        market_engine = ResolutionEngine(
+            market_store.get, {"1D": 86400, "1W": 604800}
+        )
+
         # Инициализация Coinglass клиента
         if config.coinglass_api_key:
             coinglass_client = CoinglassClient(config.coinglass_api_key)
+            if config.coinglass_cache.enabled:
+                coinglass_client = CachedCoinglassClient(
+                    coinglass_client,
+                    stale_ttl=config.coinglass_cache.stale_ttl,
+                    max_entries=config.coinglass_cache.max_entries,
+                    store=CandleStore(data_dir / "candles"),
+                    shared=shared_cache,
+                )
+            coinglass_engine = ResolutionEngine(
+                lambda symbol, interval: coinglass_client.get_crypto_candles(
+                    symbol, days=365, interval=interval
+                ),
+                INTERVAL_SECONDS,
+                cached_intervals=getattr(coinglass_client, "cached_intervals", None),
+            )
             logger.info("Coinglass Client инициализирован")
         else:
             logger.warning("COINGLASS_API_KEY не найден, Coinglass API отключен")
@@ -62,6 +271,120 @@ def init_providers():
         logger.error(f"Traceback: {traceback.format_exc()}")
 
 
+background_jobs = None
+
+
+def refresh_coinglass():
+    """Обновить популярные свечи Coinglass (только ведущий воркер)"""
+    if not hasattr(coinglass_client, "refresh"):
+        return
+    refreshed = 0
+    for symbol in config.background.refresh_symbols:
+        for interval in config.background.refresh_intervals:
+            if coinglass_client.refresh(symbol, interval):
+                refreshed += 1
+    if refreshed:
+        logger.info(f"Coinglass refresh: {refreshed} series updated")
+
+
+def reload_datasets():
+    """Перечитать data.json, если builder его обновил"""
+    if cbma_provider is not None:
+        cbma_provider.calculator.reload_if_changed()
+
+
+def start_background_jobs():
+    """
+    Запустить фоновые задачи в текущем воркере (после fork)
+
+    Обновление из внешних API выполняет только ведущий воркер; проверка
+    локальных файлов данных нужна каждому воркеру, она стоит один stat.
+    """
+    global background_jobs
+    if not config.background.enabled or background_jobs is not None:
+        return background_jobs
+
+    lock_path = Path(config.background.lock_file)
+    if not lock_path.is_absolute():
+        lock_path = Path(__file__).parent.parent.parent / lock_path
+
+    jobs = BackgroundJobs(LeaderElection(lock_path), tick=config.background.tick)
+    if coinglass_client is not None:
+        if getattr(coinglass_client, "shared", None) is None:
+            # Ведущий обновил бы только свой кэш - остальные воркеры его не видят
+            logger.warning(
+                "Фоновое обновление Coinglass отключено: не настроен общий кэш (CACHE_BACKEND_URL)"
+            )
+        else:
+            jobs.add("coinglass_refresh", config.background.refresh_interval, refresh_coinglass)
+    jobs.add(
+        "dataset_reload",
+        config.background.dataset_check_interval,
+        reload_datasets,
+        leader_only=False,
+    )
+    if config.profiling.sample_every > 0:
+        jobs.add(
+            "profile_sample", config.profiling.sample_every, sample_periodically, leader_only=False
+        )
+    if config.metrics.enabled and config.metrics.dir:
+        jobs.add(
+            "metrics_publish",
+            config.metrics.publish_interval,
+            lambda: publish_snapshot(metrics_dir()),
+            leader_only=False,
+        )
+    jobs.start()
+    background_jobs = jobs
+    return jobs
+
+
+def preload_datasets():
+    """
+    Загрузить неизменяемые данные заранее (gunicorn preload_app, до fork)
+
+    Снимок CBMA, артефакты матрицы и индекс рыночных данных читаются один раз
+    в мастере; воркеры получают их готовыми и делят страницы памяти.
+    """
+    if cbma_provider is not None:
+        cbma_provider.preload()
+    if market_store is not None:
+        logger.info(f"Market store preloaded: {len(market_store.symbols())} symbols")
+    symbol_registry()
+
+
+def metrics_dir() -> Optional[Path]:
+    return project_path(config.metrics.dir)
+
+
+def component_stats(name: str):
+    return lambda: getattr(globals()[name], "stats", None)
+
+
+# Статистика кэшей читается только при выдаче /metrics
+cache_collectors(
+    {
+        "coinglass": (
+            component_stats("coinglass_client"), ("hits", "shared_hits", "stale"), ("misses",)
+        ),
+        "resolution_market": (component_stats("market_engine"), ("hits",), ("resampled",)),
+        "resolution_coinglass": (component_stats("coinglass_engine"), ("hits",), ("resampled",)),
+        "resolution_cbma": (
+            lambda: cbma_provider.engine.stats if cbma_provider else None, ("hits",), ("resampled",)
+        ),
+        "cbma_variants": (
+            component_stats("cbma_provider"),
+            ("artifact_hits", "shared_hits"),
+            ("artifact_loads", "calculated"),
+        ),
+        "calculator_dates": (
+            lambda: {"hits": _parse_date.cache_info().hits, "misses": _parse_date.cache_info().misses},
+            ("hits",),
+            ("misses",),
+        ),
+    }
+)
+
 # Инициализируем провайдеры при загрузке модуля
 init_providers()
 
@@ -70,32 +393,195 @@ init_providers()
 # =============================================
 
 
+# Манифест статики строится один раз (в мастере при preload)
+static_assets = AssetManifest.build(Path(__file__).parent.parent / "chart")
+
+
+def send_asset(asset: StaticAsset):
+    """Отдать ассет из манифеста: готовая сжатая копия, ETag, без stat и сжатия"""
+    if asset.path is not None:
+        return send_file(asset.path, mimetype=asset.content_type, etag=asset.version)
+
+    encoding = asset.choose_encoding(request.headers.get("Accept-Encoding", ""))
+    etag = asset.etag(encoding)
+    if etag in request.headers.get("If-None-Match", ""):
+        response = Response(status=304)
+    else:
+        body = asset.encodings[encoding] if encoding else asset.body
+        response = Response(body, content_type=asset.content_type)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = asset.cache_control
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
 @app.route("/")
 def index():
     """Главная страница"""
-    static_dir = Path(__file__).parent.parent / "chart"
-    return send_from_directory(static_dir, "index.html")
+    return send_asset(static_assets.get("index.html"))
 
 
 @app.route("/<path:filename>")
 def static_files(filename):
     """Обслуживание статических файлов"""
-    static_dir = Path(__file__).parent.parent / "chart"
+    asset = static_assets.get(filename)
+    if asset is None:
+        # Если файл не найден, возвращаем index.html (для SPA)
+        asset = static_assets.get("index.html")
+    return send_asset(asset)
+
 
-    # Проверяем существование файла
-    file_path = static_dir / filename
-    if file_path.exists() and file_path.is_file():
-        return send_from_directory(static_dir, filename)
+# Предсжатые копии артефактов builder'а в порядке предпочтения
+PRECOMPRESSED_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
 
-    # Если файл не найден, возвращаем index.html (для SPA)
-    return send_from_directory(static_dir, "index.html")
+
+def send_precompressed(directory: Path, filename: str):
+    """Отдать .br/.gz копию файла, если клиент ее принимает (без сжатия на лету)"""
+    source = safe_join(str(directory), filename)
+
+    if source is not None and os.path.isfile(source):
+        for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+            # Качество, а не подстрока: "gzip;q=0" означает отказ
+            if request.accept_encodings[encoding] > 0 and os.path.isfile(source + suffix):
+                response = send_from_directory(
+                    directory,
+                    filename + suffix,
+                    mimetype=mimetypes.guess_type(filename)[0],
+                )
+                response.headers["Content-Encoding"] = encoding
+                response.headers["Vary"] = "Accept-Encoding"
+                return response
+
+    return send_from_directory(directory, filename)
 
 
 @app.route("/data/<path:filename>")
 def data_files(filename):
     """Обслуживание файлов данных"""
     data_dir = Path(__file__).parent.parent.parent / "data"
-    return send_from_directory(data_dir, filename)
+    return send_precompressed(data_dir, filename)
+
+
+# =============================================
+# КОНТРОЛЬ ДОПУСКА
+# =============================================
+
+
+def build_admission() -> Optional[AdmissionController]:
+    """Ограничители /api/history и /api/crypto/ohlcv (None - выключено)"""
+    settings = config.admission
+    if not settings.enabled:
+        return None
+    limiters = {
+        "history": EndpointLimiter(
+            "history", settings.history_capacity, settings.history_queue, settings.queue_timeout
+        ),
+        "ohlcv": EndpointLimiter(
+            "ohlcv", settings.ohlcv_capacity, settings.ohlcv_queue, settings.queue_timeout
+        ),
+    }
+    max_in_flight = max(1, config.gunicorn_threads - settings.reserved_threads)
+    return AdmissionController(limiters, max_in_flight)
+
+
+admission = build_admission()
+
+
+def series_bounds(symbol: str) -> Optional[Tuple[int, int]]:
+    """Время первого и последнего бара локального ряда (None - ряд не локальный)"""
+    if symbol == "CBMA" and cbma_provider:
+        times = cbma_provider.calculator.snapshot().times
+        return (int(times[0]), int(times[-1])) if len(times) else (0, 0)
+    if market_store is not None and symbol in market_store:
+        series = [market_store.get(symbol, base) for base in market_store.resolutions(symbol)]
+        series = [candles for candles in series if candles is not None and len(candles)]
+        if not series:
+            return (0, 0)
+        return (
+            min(int(candles.t[0]) for candles in series),
+            max(int(candles.t[-1]) for candles in series),
+        )
+    return None
+
+
+def history_cost(symbol: str, from_ts: int, to_ts: int, resolution: str) -> int:
+    """
+    Стоимость запроса истории по числу баров, которые он может вернуть
+
+    Диапазон обрезается по реальному ряду: график запрашивает from=1 и
+    to=now, а баров в ответе не больше, чем в данных. Свечей Coinglass в
+    ответе не больше CANDLES_LIMIT.
+    """
+    bounds = series_bounds(symbol.upper())
+    if bounds is not None:
+        bars = estimate_bars(max(from_ts, bounds[0]), min(to_ts, bounds[1]), resolution)
+    else:
+        bars = min(estimate_bars(from_ts, to_ts, resolution), CANDLES_LIMIT)
+    return cost_units(bars, config.admission.bars_per_unit)
+
+
+def ohlcv_cost(days: int) -> int:
+    """Стоимость /api/crypto/ohlcv (4h свечи)"""
+    return cost_units(days * 6, config.admission.bars_per_unit)
+
+
+def clamp_days(days: int) -> int:
+    return min(max(1, days), config.admission.max_ohlcv_days)
+
+
+def parse_switch(value: Optional[str], default: bool = True) -> bool:
+    """Параметр-переключатель запроса: on/off, true/false, 1/0"""
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("on", "true", "1")
+
+
+def rejected_response(body: Dict[str, Any], rejected: Rejected):
+    response = jsonify(body)
+    response.status_code = rejected.status
+    response.headers["Retry-After"] = str(rejected.retry_after)
+    return response
+
+
+def admitted(
+    endpoint: str,
+    cost: Callable[[], int],
+    reject_body: Callable[[Rejected], Dict[str, Any]],
+):
+    """
+    Декоратор: выполнить обработчик, только если запрос допущен
+
+    Потоковый ответ сериализуется уже после выхода из обработчика, поэтому
+    его слот освобождается, когда ответ отдан или соединение закрыто.
+    """
+
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            if admission is None:
+                return handler(*args, **kwargs)
+            slot = ExitStack()
+            try:
+                slot.enter_context(admission.admit(endpoint, cost()))
+            except Rejected as e:
+                logger.warning("Rejected %s: %s", request.path, e.reason)
+                return rejected_response(reject_body(e), e)
+            try:
+                response = handler(*args, **kwargs)
+            except BaseException:
+                slot.close()
+                raise
+            if isinstance(response, Response) and response.is_streamed:
+                response.call_on_close(slot.close)
+            else:
+                slot.close()
+            return response
+
+        return wrapper
+
+    return decorator
 
 
 # =============================================
@@ -147,6 +633,55 @@ def udf_config():
     )
 
 
+def symbol_registry() -> SymbolRegistry:
+    """
+    Реестр символов; пересобирается, только если сменилась версия хранилища
+    рыночных данных (новые CSV инструменты)
+
+    Пересобирает один поток, остальные тем временем отдают прежний реестр.
+    """
+    global _symbol_registry
+
+    market_version = market_store.version if market_store is not None else None
+    state = _symbol_registry
+    if state is not None and state[0] == market_version:
+        return state[1]
+
+    # Ждем только если реестра еще нет совсем
+    if not _registry_lock.acquire(blocking=state is None):
+        return state[1]
+    try:
+        state = _symbol_registry
+        if state is not None and state[0] == market_version:
+            return state[1]
+
+        crypto_symbols = None
+        if coinglass_client:
+            try:
+                crypto_symbols = coinglass_client.get_available_symbols()
+            except Exception as e:
+                logger.error(f"Error getting crypto symbols from Coinglass: {e}")
+
+        market_symbols = {}
+        if market_store is not None:
+            market_symbols = {
+                symbol: market_store.resolutions(symbol)
+                for symbol in market_store.symbols()
+            }
+
+        registry = build_symbol_registry(crypto_symbols, market_symbols)
+        # Версия и реестр заменяются одной ссылкой
+        _symbol_registry = (market_version, registry)
+        logger.info(f"Реестр символов собран: {len(registry)} символов")
+        return registry
+    finally:
+        _registry_lock.release()
+
+
+# Реестр собирается при старте, а не на первом запросе
+symbol_registry()
+
+
 @app.route("/api/symbols")
 def udf_symbols():
     """UDF символы"""
@@ -155,121 +690,125 @@ def udf_symbols():
     if not symbol:
         return jsonify({"error": "Symbol not specified"}), 400
 
-    # CBMA Index
+    # Ответ сериализован при сборке реестра
+    payload = symbol_registry().symbol_payload(symbol)
+    if payload is None:
+        return jsonify({"error": "Symbol not found"}), 404
+    return app.response_class(payload, mimetype="application/json")
+
+
+def history_payload(
+    data=None, status: str = "ok", errmsg: str = None
+) -> Union[Dict[str, Any], HistoryStream]:
+    """
+    Единый путь для всех ответов history (колонки, строки или ошибка)
+
+    Колонки длиннее config.api.history_stream_rows возвращаются как
+    HistoryStream и отдаются клиенту кусками.
+    """
+    threshold = config.api.history_stream_rows
+    if status == "ok" and threshold:
+        stream = HistoryStream.from_data(data, min_rows=threshold)
+        if stream is not None:
+            return stream
+    with span("format"):
+        return TradingViewFormatter.format_history_response(data, status, errmsg=errmsg)
+
+
+def send_history(payload: Union[Dict[str, Any], HistoryStream]):
+    """Ответ Flask: потоковый (chunked) для HistoryStream, иначе jsonify"""
+    if isinstance(payload, HistoryStream):
+        return Response(iter(payload), mimetype="application/json")
+    with span("serialize"):
+        return jsonify(payload)
+
+
+def history_response(data=None, status: str = "ok", errmsg: str = None):
+    return send_history(history_payload(data, status, errmsg))
+
+
+def local_history(
+    symbol: str,
+    resolution: str,
+    from_ts: int,
+    to_ts: int,
+    ma_period: int = 14,
+    smoothing: bool = True,
+) -> Optional[Union[Dict[str, Any], HistoryStream]]:
+    """
+    История из данных в памяти процесса: CBMA и инструменты из CSV
+
+    Общая для Flask и ASGI режимов, не ждет сети.
+
+    Returns:
+        Ответ history или None, если символ не локальный
+    """
     if symbol == "CBMA":
-        return jsonify(
-            {
-                "name": "CBMA",
-                "exchange-traded": "CBMA",
-                "exchange-listed": "CBMA",
-                "timezone": "UTC",
-                "minmov": 1,
-                "minmov2": 0,
-                "pointvalue": 1,
-                "session": "24x7",
-                "has_intraday": True,
-                "has_no_volume": True,
-                "description": "Crypto Bear Market Altcoin Index 14-day MA",
-                "type": "index",
-                "supported_resolutions": [
-                    "1",
-                    "5",
-                    "15",
-                    "30",
-                    "60",
-                    "240",
-                    "1D",
-                    "1W",
-                    "1M",
-                ],
-                "pricescale": 100,
-                "ticker": "CBMA",
-            }
-        )
-
-    # Криптовалюты - динамическая проверка через Coinglass API
-    if coinglass_client:
+        if not cbma_provider:
+            return history_payload(status="error", errmsg="CBMA provider not initialized")
         try:
-            available_symbols = coinglass_client.get_available_symbols()
-            symbol_names = {s["symbol"]: s["name"] for s in available_symbols}
-
-            if symbol in symbol_names:
-                return jsonify(
-                    {
-                        "name": symbol,
-                        "exchange-traded": "CRYPTO",
-                        "exchange-listed": "CRYPTO",
-                        "timezone": "UTC",
-                        "minmov": 1,
-                        "minmov2": 0,
-                        "pointvalue": 1,
-                        "session": "24x7",
-                        "has_intraday": True,
-                        "has_no_volume": False,
-                        "description": symbol_names[symbol],
-                        "type": "crypto",
-                        "supported_resolutions": [
-                            "1",
-                            "5",
-                            "15",
-                            "30",
-                            "60",
-                            "240",
-                            "1D",
-                            "1W",
-                            "1M",
-                        ],
-                        "pricescale": 100,
-                        "ticker": symbol,
-                    }
-                )
+            # Готовые варианты (период x сглаживание x разрешение) собирает builder
+            data = cbma_provider.get_history(
+                symbol, from_ts, to_ts, ma_period, resolution=resolution, smoothing=smoothing
+            )
+            if data.get("s") != "ok":
+                return history_payload(status=data.get("s"), errmsg=data.get("errmsg"))
+            logger.debug("Returning %d CBMA data points", len(data["t"]))
+            return history_payload(data)
         except Exception as e:
-            logger.error(f"Error getting crypto symbols from Coinglass: {e}")
-
-    # Fallback для основных криптовалют если API недоступен
-    crypto_fallback = {
-        "BTCUSDT": "Bitcoin",
-        "ETHUSDT": "Ethereum",
-        "ADAUSDT": "Cardano",
-        "SOLUSDT": "Solana",
-        "DOTUSDT": "Polkadot",
-    }
+            logger.error(f"Error getting CBMA history: {e}")
+            return history_payload(status="error", errmsg=str(e))
 
-    if symbol in crypto_fallback:
-        return jsonify(
-            {
-                "name": symbol,
-                "exchange-traded": "CRYPTO",
-                "exchange-listed": "CRYPTO",
-                "timezone": "UTC",
-                "minmov": 1,
-                "minmov2": 0,
-                "pointvalue": 1,
-                "session": "24x7",
-                "has_intraday": True,
-                "has_no_volume": False,
-                "description": crypto_fallback[symbol],
-                "type": "crypto",
-                "supported_resolutions": [
-                    "1",
-                    "5",
-                    "15",
-                    "30",
-                    "60",
-                    "240",
-                    "1D",
-                    "1W",
-                    "1M",
-                ],
-                "pricescale": 100,
-                "ticker": symbol,
-            }
-        )
+    # Инструменты из CSV: бары любого разрешения из дневных или недельных
+    if market_store is not None and symbol in market_store:
+        try:
+            candles = market_engine.get(symbol, resolution)
+        except ValueError as e:
+            return history_payload(status="error", errmsg=str(e))
+        if candles is None:
+            return history_payload(status="no_data")
+        return history_payload(candles.slice_range(from_ts, to_ts))
+
+    return None
 
-    return jsonify({"error": "Symbol not found"}), 404
+
+def local_history_ready(
+    symbol: str, resolution: str, ma_period: int = 14, smoothing: bool = True
+) -> bool:
+    """
+    local_history и history_cost ответят из памяти, без чтения файлов и расчета
+
+    ASGI режим вызывает их прямо в event loop только в этом случае, иначе в
+    пуле потоков. Для символов не из памяти процесса (Coinglass) - True.
+    """
+    if symbol == "CBMA":
+        return cbma_provider is None or cbma_provider.is_memoized(ma_period, resolution, smoothing)
+    return market_store is None or symbol not in market_store
+
+
+def coinglass_history(
+    symbol: str, candles, from_ts: int, to_ts: int
+) -> Union[Dict[str, Any], HistoryStream]:
+    """Ответ history из свечей Coinglass"""
+    if not candles:
+        return history_payload(status="no_data")
+    # Фильтруем по времени (бинарный поиск по колонке t)
+    result = candles.slice_range(from_ts, to_ts)
+    logger.debug("Returning %d %s data points from Coinglass", len(result), symbol)
+    return history_payload(result)
 
 
 @app.route("/api/history")
+@admitted(
+    "history",
+    lambda: history_cost(
+        request.args.get("symbol", ""),
+        request.args.get("from", 0, type=int),
+        request.args.get("to", int(datetime.now().timestamp()), type=int),
+        request.args.get("resolution", "1D"),
+    ),
+    lambda rejected: history_payload(status="error", errmsg=rejected.reason),
+)
 def udf_history():
     """UDF исторические данные"""
     symbol = request.args.get("symbol", "").upper()
@@ -277,76 +816,37 @@ def udf_history():
     from_ts = int(request.args.get("from", 0))
     to_ts = int(request.args.get("to", datetime.now().timestamp()))
 
-    logger.info(f"History request: {symbol}, {resolution}, {from_ts}-{to_ts}")
+    logger.debug("History request: %s, %s, %s-%s", symbol, resolution, from_ts, to_ts)
 
-    if symbol == "CBMA":
-        if cbma_provider:
-            try:
-                # Правильный порядок аргументов: symbol, from_timestamp, to_timestamp,
-                # ma_period
-                ma_period = 14  # По умолчанию 14 дней
-                data = cbma_provider.get_history(symbol, from_ts, to_ts, ma_period)
-                logger.info(f"Returning {len(data.get('t', []))} CBMA data points")
-                return jsonify(data)
-            except Exception as e:
-                logger.error(f"Error getting CBMA history: {e}")
-                return jsonify({"s": "error", "errmsg": str(e)})
-        else:
-            return jsonify({"s": "error", "errmsg": "CBMA provider not initialized"})
+    payload = local_history(
+        symbol,
+        resolution,
+        from_ts,
+        to_ts,
+        request.args.get("ma_period", 14, type=int),
+        parse_switch(request.args.get("smoothing")),
+    )
+    if payload is not None:
+        return send_history(payload)
 
     # Проверяем Coinglass API для криптовалют
     if coinglass_client:
         try:
-            available_symbols = coinglass_client.get_available_symbols()
-            symbol_names = {s["symbol"]: s["name"] for s in available_symbols}
-
-            if symbol in symbol_names:
-                # Определяем интервал для Coinglass в зависимости от запрошенного
-                # resolution
-                resolution_map = {
-                    "240": "4h",
-                    "4H": "4h",
-                    "4h": "4h",
-                    "D": "1d",
-                    "1D": "1d",
-                    "3D": "1d",
-                    "1W": "1d",
-                }
-                interval = resolution_map.get(resolution.upper(), "4h")
-                data = coinglass_client.get_crypto_ohlcv(
-                    symbol, days=365, interval=interval
-                )
-
-                if data:
-                    # Фильтруем по времени
-                    filtered_data = [
-                        candle for candle in data if from_ts <= candle["time"] <= to_ts
-                    ]
-
-                    # Преобразуем в формат UDF
-                    result = {
-                        "s": "ok",
-                        "t": [candle["time"] for candle in filtered_data],
-                        "o": [candle["open"] for candle in filtered_data],
-                        "h": [candle["high"] for candle in filtered_data],
-                        "l": [candle["low"] for candle in filtered_data],
-                        "c": [candle["close"] for candle in filtered_data],
-                        "v": [candle["volume"] for candle in filtered_data],
-                    }
-                    logger.info(
-                        f"Returning {len(result['t'])} {symbol} data points from Coinglass"
-                    )
-                    return jsonify(result)
-                else:
-                    return jsonify({"s": "no_data"})
+            if symbol_registry().source(symbol) == "coinglass":
+                # Базовый интервал Coinglass выбирает движок разрешений
+                try:
+                    candles = coinglass_engine.get(symbol, resolution)
+                except ValueError as e:
+                    return history_response(status="error", errmsg=str(e))
+                return send_history(coinglass_history(symbol, candles, from_ts, to_ts))
         except Exception as e:
             logger.error(f"Error getting {symbol} history from Coinglass: {e}")
-            return jsonify({"s": "error", "errmsg": str(e)})
+            return history_response(status="error", errmsg=str(e))
     else:
         logger.warning("Coinglass client not available")
-        return jsonify({"s": "error", "errmsg": "Coinglass client not initialized"})
+        return history_response(status="error", errmsg="Coinglass client not initialized")
 
-    return jsonify({"s": "error", "errmsg": f"Symbol {symbol} not supported"})
+    return history_response(status="error", errmsg=f"Symbol {symbol} not supported")
 
 
 @app.route("/api/time")
@@ -358,47 +858,52 @@ def udf_time():
 @app.route("/api/search")
 def udf_search():
     """UDF поиск символов"""
-    query = request.args.get("query", "").upper()
-    limit = int(request.args.get("limit", 10))
-
-    results = []
-
-    # CBMA Index
-    if "CBMA" in query or "CBMA" in query or "INDEX" in query:
-        results.append(
-            {
-                "symbol": "CBMA",
-                "full_name": "CBMA:CBMA",
-                "description": "Crypto Bear Market Altcoin Index 14-day MA",
-                "exchange": "CBMA",
-                "ticker": "CBMA",
-                "type": "index",
-            }
+    query = request.args.get("query", "")
+    limit = request.args.get("limit", 10, type=int)
+
+    return jsonify(
+        symbol_registry().search(
+            query,
+            limit=limit,
+            symbol_type=request.args.get("type", ""),
+            exchange=request.args.get("exchange", ""),
         )
+    )
 
-    # Криптовалюты
-    crypto_matches = {
-        "BTC": {"symbol": "BTCUSD", "description": "Bitcoin"},
-        "ETH": {"symbol": "ETHUSD", "description": "Ethereum"},
-        "ADA": {"symbol": "ADAUSD", "description": "Cardano"},
-        "SOL": {"symbol": "SOLUSD", "description": "Solana"},
-        "DOT": {"symbol": "DOTUSD", "description": "Polkadot"},
-    }
 
-    for crypto, info in crypto_matches.items():
-        if crypto in query or info["description"].upper() in query:
-            results.append(
-                {
-                    "symbol": info["symbol"],
-                    "full_name": f"CRYPTO:{info['symbol']}",
-                    "description": info["description"],
-                    "exchange": "CRYPTO",
-                    "ticker": info["symbol"],
-                    "type": "crypto",
-                }
-            )
+@app.route("/metrics")
+def metrics():
+    """Метрики в формате Prometheus"""
+    if not config.metrics.enabled:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(render_metrics(metrics_dir()), content_type=METRICS_CONTENT_TYPE)
 
-    return jsonify(results[:limit])
+
+@app.route("/api/admin/profile", methods=["GET"])
+@app.route("/api/admin/profile/<kind>", methods=["POST"])
+def admin_profile(kind=None):
+    """Профилирование воркера: GET - состояние, POST sample|memory - окно профиля"""
+    if not profiler.enabled:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    if not profiler.authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({"error": "Invalid profiling token"}), 403
+    if kind is None:
+        return jsonify({"pid": os.getpid(), **profiler.status()})
+
+    seconds = request.args.get("seconds", config.profiling.sample_seconds, type=float)
+    try:
+        if kind == "sample":
+            target = profiler.start_sampling(seconds)
+        elif kind == "memory":
+            target = profiler.start_memory(seconds)
+        else:
+            return jsonify({"error": f"Unknown profile kind: {kind}"}), 404
+    except ProfilingBusy as e:
+        response = jsonify({"error": str(e)})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    return jsonify({"pid": os.getpid(), "kind": kind, "file": target.name}), 202
 
 
 @app.route("/api/status")
@@ -420,6 +925,14 @@ def api_status():
                 "cbma": cbma_provider is not None,
                 "coinglass": coinglass_client is not None,
             },
+            "coinglass_open_circuits": (
+                coinglass_client.breakers.open_circuits() if coinglass_client else {}
+            ),
+            "worker": worker_report(),
+            "background": background_jobs.status() if background_jobs else None,
+            "admission": admission.status() if admission else None,
+            "profiling": profiler.status(),
+            "logging": logging_status(),
             "endpoints": [
                 "/api/config",
                 "/api/symbols",
@@ -454,10 +967,15 @@ def crypto_symbols():
 
 
 @app.route("/api/crypto/ohlcv")
+@admitted(
+    "ohlcv",
+    lambda: ohlcv_cost(clamp_days(request.args.get("days", 100, type=int))),
+    lambda rejected: {"error": rejected.reason},
+)
 def crypto_ohlcv():
     """OHLCV данные криптовалют"""
     symbol = request.args.get("symbol", "BTC")
-    days = int(request.args.get("days", 100))
+    days = clamp_days(request.args.get("days", 100, type=int))
 
     if coinglass_client:
         try:
@@ -496,4 +1014,6 @@ if __name__ == "__main__":
     logger.info(f"Starting CBMA UDF Server on {host}:{port}")
     logger.info(f"Debug mode: {debug}")
 
+    start_background_jobs()
+
     app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,199 @@
+"""
+Реестр символов UDF сервера
+
+Строится один раз из TradingViewSymbolInfo: ответы /symbols сериализуются
+заранее, поиск идет по префиксному дереву токенов (тикер, части тикера,
+слова описания, тип, биржа).
+"""
+import json
+import re
+from typing import Dict, Iterable, List, Optional
+
+from .tradingview_standards import TradingViewFormatter, TradingViewSymbolInfo
+
+TOKEN_RE = re.compile(r"[A-Z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбить строку на токены поиска (верхний регистр, буквы и цифры)"""
+    return TOKEN_RE.findall(str(text).upper())
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        # Символы, у которых есть токен с этим префиксом (в порядке добавления)
+        self.ids: List[int] = []
+
+
+class SymbolRegistry:
+    """Неизменяемый после сборки реестр символов"""
+
+    def __init__(self):
+        self._symbols: List[TradingViewSymbolInfo] = []
+        self._by_ticker: Dict[str, int] = {}
+        self._sources: List[str] = []
+        self._symbol_payloads: List[bytes] = []
+        self._search_results: List[Dict] = []
+        self._root = _TrieNode()
+
+    def add(
+        self,
+        info: TradingViewSymbolInfo,
+        source: str,
+        aliases: Iterable[str] = (),
+    ):
+        """
+        Добавить символ
+
+        Args:
+            info: Информация о символе
+            source: Откуда брать историю ("cbma", "market", "coinglass")
+            aliases: Дополнительные слова для поиска
+        """
+        ticker = info.ticker.upper()
+        if ticker in self._by_ticker:
+            return
+
+        symbol_id = len(self._symbols)
+        self._symbols.append(info)
+        self._by_ticker[ticker] = symbol_id
+        self._sources.append(source)
+        self._symbol_payloads.append(
+            json.dumps(info.to_udf_symbol(), separators=(",", ":")).encode("utf-8")
+        )
+        self._search_results.append(info.to_search_result())
+
+        tokens = {ticker}
+        texts = (info.name, info.description, info.full_name, info.type, info.exchange)
+        for text in (*texts, *aliases):
+            tokens.update(tokenize(text))
+        for token in tokens:
+            self._insert(token, symbol_id)
+
+    def _insert(self, token: str, symbol_id: int):
+        node = self._root
+        for char in token:
+            node = node.children.setdefault(char, _TrieNode())
+            if not node.ids or node.ids[-1] != symbol_id:
+                node.ids.append(symbol_id)
+
+    def _prefix_ids(self, prefix: str) -> List[int]:
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.ids
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol.upper() in self._by_ticker
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    def get(self, symbol: str) -> Optional[TradingViewSymbolInfo]:
+        symbol_id = self._by_ticker.get(symbol.upper())
+        return None if symbol_id is None else self._symbols[symbol_id]
+
+    def source(self, symbol: str) -> Optional[str]:
+        symbol_id = self._by_ticker.get(symbol.upper())
+        return None if symbol_id is None else self._sources[symbol_id]
+
+    def symbol_payload(self, symbol: str) -> Optional[bytes]:
+        """Готовый JSON ответа /symbols"""
+        symbol_id = self._by_ticker.get(symbol.upper())
+        return None if symbol_id is None else self._symbol_payloads[symbol_id]
+
+    def search(
+        self,
+        query: str,
+        limit: int = 30,
+        symbol_type: str = "",
+        exchange: str = "",
+    ) -> List[Dict]:
+        """
+        Поиск по префиксам токенов
+
+        Каждое слово запроса должно быть префиксом какого-либо токена символа.
+        Пустой запрос возвращает все символы.
+        """
+        tokens = tokenize(query)
+        if tokens:
+            # Начинаем с самого узкого списка, остальные слова - проверка членства
+            candidates = sorted((self._prefix_ids(token) for token in tokens), key=len)
+            ids = candidates[0]
+            others = [set(other) for other in candidates[1:]]
+        else:
+            ids, others = range(len(self._symbols)), []
+
+        results = []
+        for symbol_id in ids:
+            if any(symbol_id not in other for other in others):
+                continue
+            info = self._symbols[symbol_id]
+            if symbol_type and info.type != symbol_type:
+                continue
+            if exchange and info.exchange != exchange:
+                continue
+            results.append(self._search_results[symbol_id])
+            if len(results) >= limit:
+                break
+        return results
+
+
+# Названия инструментов из CSV (как в src/chart/config.js)
+MARKET_DESCRIPTIONS = {
+    "SP_SPX": "S&P 500",
+    "TVC_VIX": "VIX",
+    "TVC_DXY": "DXY",
+    "CRYPTOCAP_TOTAL2": "Without BTC",
+    "CRYPTOCAP_TOTAL3": "Without BTC/ETH",
+    "CRYPTOCAP_TOTAL3ESBTC": "Total3 - BTC",
+    "CRYPTOCAP_OTHERS": "Others",
+    "CRYPTOCAP_OTHERSBTC": "Others BTC",
+}
+
+# Если Coinglass недоступен, основные криптовалюты все равно находятся
+CRYPTO_FALLBACK = [
+    {"symbol": "BTCUSDT", "name": "Bitcoin"},
+    {"symbol": "ETHUSDT", "name": "Ethereum"},
+    {"symbol": "ADAUSDT", "name": "Cardano"},
+    {"symbol": "SOLUSDT", "name": "Solana"},
+    {"symbol": "DOTUSDT", "name": "Polkadot"},
+]
+
+
+def build_symbol_registry(
+    crypto_symbols: Optional[List[Dict[str, str]]] = None,
+    market_symbols: Optional[Dict[str, List[str]]] = None,
+) -> SymbolRegistry:
+    """
+    Собрать реестр: CBMA, инструменты из CSV и криптовалюты
+
+    Args:
+        crypto_symbols: Список Coinglass [{"symbol", "name"}, ...]
+        market_symbols: Символ из хранилища рыночных данных -> разрешения
+    """
+    registry = SymbolRegistry()
+
+    cbma = TradingViewFormatter.create_cbma_symbol()
+    cbma.exchange = cbma.listed_exchange = "CBMA"
+    registry.add(cbma, "cbma", aliases=("COINBASE", "INDEX"))
+
+    for symbol, resolutions in sorted((market_symbols or {}).items()):
+        info = TradingViewFormatter.create_market_symbol(
+            symbol, MARKET_DESCRIPTIONS.get(symbol), resolutions
+        )
+        registry.add(info, "market")
+
+    for item in crypto_symbols or CRYPTO_FALLBACK:
+        symbol = item["symbol"].upper()
+        info = TradingViewFormatter.create_crypto_symbol(symbol, item.get("name"))
+        info.exchange = info.listed_exchange = "CRYPTO"
+        base = symbol[:-4] if symbol.endswith("USDT") else symbol
+        registry.add(info, "coinglass", aliases=(base, "USDT"))
+
+    return registry
@@ -3,11 +3,17 @@
 Обеспечивает полную совместимость с официальной спецификацией TradingView
 """
 
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Mapping, Optional, Sequence, Union
 from dataclasses import dataclass
 from enum import Enum
+import json
 import time
 
+import numpy as np
+
+from src.data.candles import COLUMNS, CandleSeries, is_sorted
+from src.data.resample import parse_resolution
+
 
 class SymbolType(Enum):
     """Типы символов согласно TradingView"""
@@ -94,6 +100,41 @@ class TradingViewSymbolInfo:
             "full_name": self.full_name,
         }
 
+    def to_udf_symbol(self) -> Dict[str, Any]:
+        """Ответ /symbols в формате UDF (имена полей по спецификации)"""
+        return {
+            "name": self.name,
+            "ticker": self.ticker,
+            "description": self.description,
+            "type": self.type,
+            "session": self.session,
+            "timezone": self.timezone,
+            "exchange-traded": self.exchange,
+            "exchange-listed": self.listed_exchange,
+            "minmov": self.minmov,
+            "minmov2": self.minmove2,
+            "pointvalue": 1,
+            "pricescale": self.pricescale,
+            "supported_resolutions": self.supported_resolutions,
+            "has_intraday": self.has_intraday,
+            "has_daily": self.has_daily,
+            "has_weekly_and_monthly": self.has_weekly_and_monthly,
+            "has_no_volume": self.has_no_volume,
+            "volume_precision": self.volume_precision,
+            "currency_code": self.currency_code,
+        }
+
+    def to_search_result(self) -> Dict[str, Any]:
+        """Элемент ответа /search"""
+        return {
+            "symbol": self.ticker,
+            "full_name": self.full_name,
+            "description": self.description,
+            "exchange": self.exchange,
+            "ticker": self.ticker,
+            "type": self.type,
+        }
+
 
 @dataclass
 class TradingViewConfig:
@@ -145,6 +186,150 @@ class TradingViewConfig:
         }
 
 
+def _series_columns(series: CandleSeries) -> Optional[Dict[str, Any]]:
+    """Колонки CandleSeries -> ответ UDF (серия уже упорядочена по времени)"""
+    if not len(series):
+        return None
+    response = {"s": "ok"}
+    for name in COLUMNS:
+        response[name] = getattr(series, name).tolist()
+    return response
+
+
+def _mapping_columns(columns: Mapping[str, Sequence]) -> Optional[Dict[str, Any]]:
+    """Готовые колонки {"t", "c", ["o", "h", "l", "v"]} -> ответ UDF"""
+    times = columns.get("t")
+    if times is None or not len(times):
+        return None
+
+    names = [name for name in COLUMNS if columns.get(name) is not None]
+    order = None
+    if not is_sorted(np.asarray(times)):
+        order = np.argsort(np.asarray(times), kind="stable")
+
+    response = {"s": "ok"}
+    for name in names:
+        column = columns[name]
+        if order is not None:
+            response[name] = np.asarray(column)[order].tolist()
+        elif isinstance(column, list):
+            response[name] = column
+        elif isinstance(column, np.ndarray):
+            response[name] = column.tolist()
+        else:
+            response[name] = list(column)
+    return response
+
+
+# Строк колонки в одном куске потокового ответа history
+STREAM_CHUNK_ROWS = 4096
+
+
+class HistoryStream:
+    """
+    Большой ответ history, который сериализуется кусками
+
+    JSON объект {"s": "ok", "t": [...], ...} пишется колонка за колонкой по
+    STREAM_CHUNK_ROWS значений, поэтому ни списки Python, ни строка всего
+    ответа не собираются в памяти целиком.
+    """
+
+    __slots__ = ("columns", "rows", "chunk_rows")
+
+    def __init__(self, columns: Dict[str, Sequence], chunk_rows: int = STREAM_CHUNK_ROWS):
+        self.columns = columns
+        self.rows = len(columns["t"])
+        self.chunk_rows = max(1, chunk_rows)
+
+    @classmethod
+    def from_data(
+        cls, data: Union[CandleSeries, Mapping[str, Sequence], None], min_rows: int = 1
+    ) -> Optional["HistoryStream"]:
+        """
+        Поток из колонок
+
+        Returns:
+            None, если данные строковые, короче min_rows или неупорядочены
+        """
+        if isinstance(data, CandleSeries):
+            columns = {name: getattr(data, name) for name in COLUMNS}
+        elif isinstance(data, Mapping) and data.get("t") is not None:
+            columns = {name: data[name] for name in COLUMNS if data.get(name) is not None}
+        else:
+            return None
+        times = columns["t"]
+        if len(times) < max(1, min_rows):
+            return None
+        if not isinstance(data, CandleSeries) and not is_sorted(np.asarray(times)):
+            return None
+        return cls(columns)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield b'{"s":"ok"'
+        for name, column in self.columns.items():
+            yield f',"{name}":['.encode("ascii")
+            for start in range(0, self.rows, self.chunk_rows):
+                part = column[start : start + self.chunk_rows]
+                if isinstance(part, np.ndarray):
+                    part = part.tolist()
+                text = json.dumps(part, separators=(",", ":"))[1:-1]
+                yield (text if not start else "," + text).encode("ascii")
+            yield b"]"
+        yield b"}"
+
+
+def _row_columns(rows: Sequence[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Строки -> колонки за один проход (с проверкой упорядоченности)"""
+    if not rows:
+        return None
+
+    t, o, h, l, c, v = [], [], [], [], [], []  # noqa: E741
+    has_ohlc = has_volume = False
+    ordered = True
+    previous = None
+
+    for item in rows:
+        time_value = item["time"]
+        if previous is not None and time_value < previous:
+            ordered = False
+        previous = time_value
+
+        close = item.get("close")
+        if close is None:
+            close = item.get("value", 0)
+        open_ = item.get("open")
+        if open_ is not None:
+            has_ohlc = True
+        volume = item.get("volume")
+        if volume is not None:
+            has_volume = True
+
+        t.append(time_value)
+        c.append(close)
+        o.append(close if open_ is None else open_)
+        h.append(item.get("high", close))
+        l.append(item.get("low", close))
+        v.append(volume or 0)
+
+    response = {"s": "ok", "t": t, "c": c}
+    if has_ohlc:
+        response.update(o=o, h=h, l=l)
+    if has_volume:
+        response["v"] = v
+
+    if not ordered:
+        order = sorted(range(len(t)), key=t.__getitem__)
+        for name in ("t", "o", "h", "l", "c", "v"):
+            if name in response:
+                column = response[name]
+                response[name] = [column[i] for i in order]
+
+    return response
+
+
 class TradingViewFormatter:
     """Утилиты для форматирования данных согласно TradingView стандартам"""
 
@@ -159,7 +344,7 @@ class TradingViewFormatter:
             session="24x7",
             timezone="Etc/UTC",
             minmov=1,
-            pricescale=100000000,  # 8 знаков после запятой для точности
+            pricescale=100,  # builder округляет CBMA до 2 знаков
             supported_resolutions=["1D", "1W", "1M"],
             has_intraday=False,
             has_daily=True,
@@ -229,53 +414,73 @@ class TradingViewFormatter:
             currency_code="USD",
         )
 
+    @staticmethod
+    def create_market_symbol(
+        symbol: str, description: str = None, resolutions: List[str] = None
+    ) -> TradingViewSymbolInfo:
+        """Создать информацию об инструменте из CSV (индексы, капитализация)"""
+        # Внутридневные бары из дневных данных не собрать - их не объявляем
+        resolutions = [
+            resolution for resolution in resolutions or ()
+            if not parse_resolution(resolution).is_intraday
+        ]
+        return TradingViewSymbolInfo(
+            name=symbol,
+            ticker=symbol,
+            description=description or symbol,
+            type=SymbolType.INDEX.value,
+            session="24x7",
+            timezone="Etc/UTC",
+            minmov=1,
+            pricescale=100,
+            supported_resolutions=resolutions or ["1D", "1W"],
+            has_intraday=False,
+            has_daily=True,
+            has_weekly_and_monthly=True,
+            has_no_volume=False,
+            volume_precision=0,
+            exchange="INDICES",
+            listed_exchange="INDICES",
+            full_name=description or symbol,
+        )
+
     @staticmethod
     def format_history_response(
-        data: List[Dict[str, Any]], status: str = "ok", next_time: Optional[int] = None
+        data: Union[CandleSeries, Mapping[str, Sequence], Sequence[Dict[str, Any]], None],
+        status: str = "ok",
+        next_time: Optional[int] = None,
+        errmsg: Optional[str] = None,
     ) -> Dict[str, Any]:
-        """Форматировать ответ history согласно UDF спецификации"""
-        if status != "ok" or not data:
-            return {
-                "s": status,
-                "errmsg": "No data available" if status == "no_data" else None,
-            }
-
-        # Сортируем данные по времени
-        sorted_data = sorted(data, key=lambda x: x.get("time", 0))
-
-        response = {
-            "s": "ok",
-            "t": [item["time"] for item in sorted_data],
-            "c": [item.get("close", item.get("value", 0)) for item in sorted_data],
-        }
-
-        # Добавляем OHLC данные если доступны
-        if any("open" in item for item in sorted_data):
-            response.update(
-                {
-                    "o": [
-                        item.get("open", item.get("close", item.get("value", 0)))
-                        for item in sorted_data
-                    ],
-                    "h": [
-                        item.get("high", item.get("close", item.get("value", 0)))
-                        for item in sorted_data
-                    ],
-                    "l": [
-                        item.get("low", item.get("close", item.get("value", 0)))
-                        for item in sorted_data
-                    ],
-                }
-            )
-
-        # Добавляем объем если доступен
-        if any("volume" in item for item in sorted_data):
-            response["v"] = [item.get("volume", 0) for item in sorted_data]
-
-        # Добавляем next_time если есть еще данные
-        if next_time:
-            response["nextTime"] = next_time
-
+        """
+        Форматировать ответ history согласно UDF спецификации
+
+        Args:
+            data: Колонки (CandleSeries или {"t": [...], "c": [...], ...}) либо
+                строки {"time", "open", ..., "close" или "value", "volume"}.
+                Строки обходятся один раз; сортировка выполняется, только если
+                данные пришли неупорядоченными.
+            status: Статус ответа ("ok", "no_data", "error")
+            next_time: Время предыдущего бара для ответа no_data
+            errmsg: Текст ошибки для статуса "error"
+        """
+        if status == "ok":
+            if isinstance(data, CandleSeries):
+                response = _series_columns(data)
+            elif isinstance(data, Mapping):
+                response = _mapping_columns(data)
+            else:
+                response = _row_columns(data or [])
+            if response is not None:
+                return response
+            status = "no_data"
+
+        response = {"s": status}
+        if status == "no_data":
+            response["errmsg"] = errmsg or "No data available"
+            if next_time:
+                response["nextTime"] = next_time
+        else:
+            response["errmsg"] = errmsg
         return response
 
     @staticmethod
@@ -341,29 +546,20 @@ class TradingViewFormatter:
 
     @staticmethod
     def validate_resolution(resolution: str) -> bool:
-        """Проверить валидность разрешения"""
-        valid_resolutions = ["1", "5", "15", "30", "60", "240", "1D", "1W", "1M"]
-        return resolution in valid_resolutions
+        """Проверить валидность разрешения (N минут, NH, ND, NW, NM)"""
+        try:
+            parse_resolution(resolution)
+        except ValueError:
+            return False
+        return True
 
     @staticmethod
     def normalize_resolution(resolution: str) -> str:
-        """Нормализовать разрешение к стандартному формату"""
-        resolution_map = {
-            "1": "1",
-            "5": "5",
-            "15": "15",
-            "30": "30",
-            "60": "60",
-            "240": "240",
-            "4H": "240",
-            "D": "1D",
-            "1D": "1D",
-            "W": "1W",
-            "1W": "1W",
-            "M": "1M",
-            "1M": "1M",
-        }
-        return resolution_map.get(resolution, resolution)
+        """Нормализовать разрешение к стандартному формату ("4H" -> "240", "D" -> "1D")"""
+        try:
+            return parse_resolution(resolution).to_udf()
+        except ValueError:
+            return resolution
 
 
 # Предопределенные символы для использования
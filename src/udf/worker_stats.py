@@ -0,0 +1,75 @@
+"""
+Время запуска и память воркеров UDF сервера
+"""
+import os
+import resource
+import time
+from typing import Any, Dict, Optional
+
+# Заполняется хуком gunicorn post_worker_init (или при старте без gunicorn)
+WORKER_INFO: Dict[str, Any] = {}
+
+
+def memory_usage() -> Dict[str, Optional[int]]:
+    """
+    Память текущего процесса в килобайтах
+
+    rss - вся резидентная память, shared - страницы, общие с мастером и
+    другими воркерами (copy-on-write после preload), private - собственные
+    страницы процесса, pss - rss с общими страницами, поделенными поровну.
+    """
+    usage = {"rss": None, "pss": None, "shared": None, "private": None}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+        usage["rss"] = fields.get("Rss")
+        usage["pss"] = fields.get("Pss")
+        usage["shared"] = fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)
+        usage["private"] = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    except OSError:
+        # Не Linux: только пиковый RSS
+        usage["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage
+
+
+def record_worker_start(started_at: float, preloaded: bool) -> Dict[str, Any]:
+    """
+    Запомнить время запуска воркера
+
+    Args:
+        started_at: time.monotonic() в момент fork
+        preloaded: Данные загружены в мастере до fork
+    """
+    WORKER_INFO.update(
+        {
+            "pid": os.getpid(),
+            "preloaded": preloaded,
+            "startup_ms": round((time.monotonic() - started_at) * 1000, 1),
+            "started_at": time.time(),
+            "memory_kb": memory_usage(),
+        }
+    )
+    return WORKER_INFO
+
+
+def worker_report() -> Dict[str, Any]:
+    """Сведения о воркере для /api/status (память - текущая)"""
+    report = dict(WORKER_INFO)
+    report.setdefault("pid", os.getpid())
+    report["memory_kb_now"] = memory_usage()
+    return report
+
+
+def format_memory(usage: Dict[str, Optional[int]]) -> str:
+    """Строка для лога: rss/shared/private в мегабайтах"""
+    def mb(value: Optional[int]) -> str:
+        return "?" if value is None else f"{value / 1024:.1f}"
+
+    return (
+        f"rss={mb(usage.get('rss'))}MB shared={mb(usage.get('shared'))}MB "
+        f"private={mb(usage.get('private'))}MB"
+    )